@@ -0,0 +1,148 @@
+"""
+Copyright 2020 kivou.2000607@gmail.com
+
+This file is part of yata-bot.
+
+    yata is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    yata is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with yata-bot. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+""" Bytes written per loop tick for the configurations
+
+    Replays the configuration changes of the retal and oc loops (new mentions)
+    and of the verify loops (timestamps) on large guilds, written either as
+    whole configurations or as patches of the changed keys, and reports the
+    bytes sent to the database per tick.
+
+    With --db, the configurations are also written in the database of
+    DB_CREDENTIALS (bot_server rows of an existing bot --bot-id) and the WAL bytes
+    generated per tick are reported.
+
+    python -m bench.config_bytes --guilds 20 --factions 300 --ticks 50
+    DB_CREDENTIALS='{"dbname": "yata", ...}' python -m bench.config_bytes --db --bot-id 999
+"""
+
+# import standard modules
+import json
+import time
+import random
+import asyncio
+import argparse
+
+# import bot functions and classes
+import inc.config_writer
+from inc import yata_db
+from inc.config_writer import ConfigWriter
+
+
+def configuration(n, factions, trackings):
+    """ configuration of a large guild (factions roles and retal / oc trackings)
+    """
+    currents = {}
+    for i in range(trackings):
+        currents[str(400000000000000000 + i)] = {
+            "channel": [str(500000000000000000 + i), f'retal-{i}', '#'],
+            "discord_user": [str(400000000000000000 + i), f'user#{i:04d}', ''],
+            "torn_user": [str(2000000 + i), f'Player{i}', '', f'key{i:013d}'],
+            "role": [str(600000000000000000 + i), f'role-{i}', '@'],
+            "mentions": [random.randint(1, 10 ** 9) for _ in range(10)]}
+
+    return {"admin": {"prefix": {"!": "!"}, "server_admins": {str(300000000000000000 + i): {"name": f'Admin{i}', "torn_id": 2000000 + i} for i in range(5)}},
+            "verify": {"roles_verified": {"700000000000000000": "verified"},
+                       "factions": {str(30000 + f): {str(800000000000000000 + f): f'faction role {f}'} for f in range(factions)},
+                       "positions": {str(30000 + f): True for f in range(factions // 2)},
+                       "other": {"daily_verify": 1, "weekly_verify": 1, "daily_check": 1, "weekly_check": 1}},
+            "chain": {"currents": dict(currents)},
+            "oc": {"currents": json.loads(json.dumps(currents))}}
+
+
+def tick(guilds, configurations, writer, patch, t, args):
+    """ changes of one loop tick (new mentions, verify timestamps every few ticks)
+    """
+    for guild_id in guilds:
+        c = configurations[guild_id]
+        for module in ["chain", "oc"]:
+            for discord_user_id in random.sample(sorted(c[module]["currents"]), args.changes):
+                c[module]["currents"][discord_user_id]["mentions"].append(random.randint(1, 10 ** 9))
+                writer.mark(guild_id, f'guild-{guild_id}', [module, "currents", discord_user_id] if patch else None)
+        if not t % 10:
+            c["verify"]["other"]["daily_verify"] = int(time.time())
+            writer.mark(guild_id, f'guild-{guild_id}', ["verify", "other", "daily_verify"] if patch else None)
+
+
+async def run(args, patch):
+    random.seed(0)
+    guilds = [1000 + n for n in range(args.guilds)]
+    configurations = {guild_id: configuration(guild_id, args.factions, args.trackings) for guild_id in guilds}
+    writer = ConfigWriter(args.bot_id, lambda guild_id: configurations.get(guild_id, {}))
+    sent = [0]
+
+    async def set_configurations(bot_id, servers, patches=[]):
+        sent[0] += sum([len(json.dumps(configuration)) for _, _, configuration in servers])
+        sent[0] += sum([sum([len(json.dumps(path)) + len(value or '') for path, value in changes]) for _, _, changes, _ in patches])
+        if args.db:
+            await yata_db.set_configurations(bot_id, servers, patches)
+
+    inc.config_writer.set_configurations = set_configurations
+
+    if args.db:
+        # rows of the benchmark bot
+        await yata_db.set_configurations(args.bot_id, [(guild_id, f'guild-{guild_id}', configurations[guild_id]) for guild_id in guilds])
+        async with yata_db.connection() as con:
+            wal_start = await con.fetchval('SELECT pg_current_wal_lsn()')
+
+    for t in range(args.ticks):
+        tick(guilds, configurations, writer, patch, t, args)
+        await writer.flush()
+
+    r = {"sent_kb_per_tick": sent[0] / 1024 / args.ticks}
+    if args.db:
+        async with yata_db.connection() as con:
+            wal = await con.fetchval('SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), $1::pg_lsn)', wal_start)
+            r["wal_kb_per_tick"] = float(wal) / 1024 / args.ticks
+
+            # written configurations are the ones in memory
+            for guild_id in guilds:
+                db = await yata_db.get_configuration(args.bot_id, guild_id)
+                assert db == configurations[guild_id], f'configuration of {guild_id} differs'
+
+            await con.execute('DELETE FROM bot_server WHERE bot_id = $1', args.bot_id)
+
+    return r
+
+
+async def main(args):
+    size = len(json.dumps(configuration(0, args.factions, args.trackings))) / 1024
+    print(f'{args.guilds} guilds with {size:.1f}kB configurations, {2 * args.changes} changed trackings per guild and tick')
+    for name, patch in [("whole configurations", False), ("patches", True)]:
+        r = await run(args, patch)
+        line = f'< {name} > sent {r["sent_kb_per_tick"]:.1f}kB/tick'
+        if args.db:
+            line += f' WAL {r["wal_kb_per_tick"]:.1f}kB/tick'
+        print(line)
+    if args.db:
+        await yata_db.close_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bytes written per tick for the configurations")
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--factions", type=int, default=300, help="factions with roles per guild")
+    parser.add_argument("--trackings", type=int, default=20, help="retal and oc trackings per guild")
+    parser.add_argument("--changes", type=int, default=2, help="retal and oc trackings with new mentions per tick")
+    parser.add_argument("--ticks", type=int, default=50)
+    parser.add_argument("--db", action="store_true", help="write in the database of DB_CREDENTIALS")
+    parser.add_argument("--bot-id", type=int, default=999, help="bot id of the benchmark rows (deleted at the end)")
+    args = parser.parse_args()
+
+    asyncio.get_event_loop().run_until_complete(main(args))
@@ -0,0 +1,107 @@
+"""
+Copyright 2020 kivou.2000607@gmail.com
+
+This file is part of yata-bot.
+
+    yata is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    yata is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with yata-bot. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+""" Microbenchmark of the database lookups of inc/yata_db
+
+    Compares the latency of each lookup with the values inlined in the SQL
+    (a new statement to parse and plan for every value) and with bound
+    parameters (statement prepared once per pooled connection).
+
+    Runs against the database of DB_CREDENTIALS (a local copy of YATA's
+    database, the lookups are read only).
+
+    DB_CREDENTIALS='{"dbname": "yata", "user": "postgres", "host": "localhost"}' python -m bench.db_lookups --lookups 2000
+"""
+
+# import standard modules
+import time
+import asyncio
+import argparse
+import statistics
+
+# import bot functions
+from inc import yata_db
+from inc.yata_db import connection
+
+LOOKUPS = {
+    "get_yata_user T": ('SELECT "tId", "name", "value" FROM player_view_player_key WHERE "tId" = {0};',
+                        'SELECT "tId", "name", "value" FROM player_view_player_key WHERE "tId" = $1'),
+    "get_yata_user D": ('SELECT "tId", "name", "value" FROM player_view_player_key WHERE "dId" = {0};',
+                        'SELECT "tId", "name", "value" FROM player_view_player_key WHERE "dId" = $1'),
+    "get_configuration": ('SELECT configuration FROM bot_server WHERE bot_id = {0} AND discord_id = {1};',
+                          'SELECT configuration FROM bot_server WHERE bot_id = $1 AND discord_id = $2'),
+}
+
+
+async def sample(n):
+    """ random ids of existing users and servers
+    """
+    async with connection() as con:
+        users = await con.fetch('SELECT "tId", "dId" FROM player_view_player_key WHERE "dId" > 0 ORDER BY random() LIMIT $1', n)
+        servers = await con.fetch('SELECT bot_id, discord_id FROM bot_server ORDER BY random() LIMIT $1', n)
+    return {"get_yata_user T": [(u["tId"],) for u in users],
+            "get_yata_user D": [(u["dId"],) for u in users],
+            "get_configuration": [(s["bot_id"], s["discord_id"]) for s in servers]}
+
+
+async def measure(query, values, lookups, inline):
+    latencies = []
+    for i in range(lookups):
+        args = values[i % len(values)]
+        start = time.perf_counter()
+        async with connection() as con:
+            if inline:
+                await con.fetch(query.format(*args))
+            else:
+                await con.fetch(query, *args)
+        latencies.append(time.perf_counter() - start)
+
+    latencies = sorted(latencies)
+    return {"mean_us": 1e6 * statistics.mean(latencies),
+            "p50_us": 1e6 * latencies[int(0.5 * (len(latencies) - 1))],
+            "p95_us": 1e6 * latencies[int(0.95 * (len(latencies) - 1))]}
+
+
+async def main(args):
+    await yata_db.init_pool()
+    ids = await sample(args.ids)
+    for name, (inline, bound) in LOOKUPS.items():
+        if not len(ids[name]):
+            print(f'< {name} > no rows to look up')
+            continue
+
+        # warm up the pool connections
+        await measure(bound, ids[name], 100, False)
+
+        before = await measure(inline, ids[name], args.lookups, True)
+        after = await measure(bound, ids[name], args.lookups, False)
+        print(f'< {name} > inline mean {before["mean_us"]:.0f}us p95 {before["p95_us"]:.0f}us | '
+              f'bound mean {after["mean_us"]:.0f}us p95 {after["p95_us"]:.0f}us '
+              f'({100 * (after["mean_us"] / before["mean_us"] - 1):+.1f}%)')
+    print(yata_db.pool_stats())
+    await yata_db.close_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency of the database lookups")
+    parser.add_argument("--lookups", type=int, default=2000, help="lookups per query and mode")
+    parser.add_argument("--ids", type=int, default=500, help="distinct ids looked up")
+    args = parser.parse_args()
+
+    asyncio.get_event_loop().run_until_complete(main(args))
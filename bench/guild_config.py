@@ -0,0 +1,161 @@
+"""
+Copyright 2020 kivou.2000607@gmail.com
+
+This file is part of yata-bot.
+
+    yata is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    yata is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with yata-bot. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+""" Microbenchmark of the configuration reads of a command
+
+    A command message reads the prefix, the configuration of its module,
+    checks the channel is allowed and gets the alerts role and channel.
+    Compares the reads of the JSON configurations (before) with the reads
+    of the compiled configurations (inc/guild_config.py) on a guild with
+    many roles and channels.
+
+    python -m bench.guild_config --roles 250 --channels 500 --messages 100000
+"""
+
+# import standard modules
+import time
+import argparse
+
+# import discord modules
+from discord.utils import get
+
+# import bot functions and classes
+from bots.yata import YataBot
+
+
+class Item:
+    """ role or channel (id only)
+    """
+
+    def __init__(self, id):
+        self.id = id
+
+
+class Guild:
+    """ guild with the roles and channels lookups of discord.Guild
+    """
+
+    def __init__(self, id, roles, channels):
+        self.id = id
+        self._roles = {role.id: role for role in roles}
+        self._channels = {channel.id: channel for channel in channels}
+
+    @property
+    def roles(self):
+        return list(self._roles.values())
+
+    @property
+    def channels(self):
+        return list(self._channels.values())
+
+    def get_role(self, id):
+        return self._roles.get(id)
+
+    def get_channel(self, id):
+        return self._channels.get(id)
+
+
+class Context:
+    def __init__(self, guild, channel):
+        self.guild = guild
+        self.channel = channel
+
+
+def run(coro):
+    """ result of a coroutine that doesn't wait
+    """
+    try:
+        coro.send(None)
+    except StopIteration as e:
+        return e.value
+
+
+# configuration reads before the compiled configurations
+def get_prefix_before(bot, guild):
+    return bot.configurations.get(guild.id, {}).get("admin", {}).get("prefix", "!")
+
+
+def get_guild_configuration_by_module_before(bot, guild, module, check_key=False):
+    c = bot.configurations.get(guild.id, {}).get(module, False)
+    if check_key and c:
+        return c if len(c.get(check_key, {})) else False
+    else:
+        return c
+
+
+async def check_channel_allowed_before(ctx, config, channel_key=None):
+    channel_key = "channels_allowed" if channel_key is None else channel_key
+    if str(ctx.channel.id) not in config.get(channel_key, []):
+        # lookups of the allowed channels listed in the error message of the command
+        [get(ctx.guild.channels, id=int(k)) for k in config.get(channel_key, {}) if str(k).isdigit()]
+        return False
+    return True
+
+
+def get_module_item_before(guild_items, configuration_items):
+    ids = [id for id in configuration_items if id.isdigit()]
+    return get(guild_items, id=int(ids[0])) if len(ids) else None
+
+
+def message_before(bot, ctx):
+    get_prefix_before(bot, ctx.guild)
+    config = get_guild_configuration_by_module_before(bot, ctx.guild, "loot")
+    run(check_channel_allowed_before(ctx, config))
+    get_module_item_before(ctx.guild.roles, config.get("roles_alerts", {}))
+    get_module_item_before(ctx.guild.channels, config.get("channels_alerts", {}))
+
+
+def message_compiled(bot, ctx):
+    bot.get_guild_config(ctx.guild.id).prefix
+    config = bot.get_guild_configuration_by_module(ctx.guild, "loot")
+    run(bot.check_channel_allowed(ctx, config))
+    bot.get_guild_module_role(ctx.guild, "loot", "roles_alerts")
+    bot.get_guild_module_channel(ctx.guild, "loot", "channels_alerts")
+
+
+def main(args):
+    roles = [Item(600000000000000000 + i) for i in range(args.roles)]
+    channels = [Item(500000000000000000 + i) for i in range(args.channels)]
+    guild = Guild(1, roles, channels)
+
+    # alerts role and channel last of the guild (worst case of the lists lookups)
+    configuration = {
+        "admin": {"prefix": "!", "channels_admin": {str(channels[0].id): "admin"}},
+        "loot": {"channels_allowed": {str(c.id): f'loot-{i}' for i, c in enumerate(channels[-5:])},
+                 "channels_alerts": {str(channels[-1].id): "loot-alerts"},
+                 "roles_alerts": {str(roles[-1].id): "loot"}}}
+    bot = YataBot(configurations={guild.id: configuration}, command_prefix="!", bot_id=1)
+    ctx = Context(guild, channels[-1])
+
+    for name, message in [("before", message_before), ("compiled", message_compiled)]:
+        start = time.perf_counter()
+        for i in range(args.messages):
+            message(bot, ctx)
+        elapsed = time.perf_counter() - start
+        print(f'< {name} > {1e6 * elapsed / args.messages:.2f}us per message')
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Configuration reads per command message")
+    parser.add_argument("--roles", type=int, default=250)
+    parser.add_argument("--channels", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=100000)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,94 @@
+"""
+Copyright 2020 kivou.2000607@gmail.com
+
+This file is part of yata-bot.
+
+    yata is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    yata is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with yata-bot. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+""" Event loop lag of the database reads of the tasks loops
+
+    Reads the rackets data (Racket.racketsTask, Stocks.notify) the old way
+    (psycopg2 connection and query on the event loop thread) and with
+    inc.yata_db.get_data (asyncpg pool) while measuring the event loop lag.
+
+    DB_CREDENTIALS='{"dbname": "yata", "user": "postgres", "host": "localhost"}' python -m bench.loop_lag --bot-id 1
+"""
+
+# import standard modules
+import os
+import json
+import time
+import asyncio
+import argparse
+
+# import bot functions and classes
+from inc import yata_db
+from inc.loop_lag import LoopLag
+
+
+def get_data_sync(bot_id, module):
+    """ get_data before being async
+    """
+    import psycopg2
+    db_cred = json.loads(os.environ.get("DB_CREDENTIALS"))
+    con = psycopg2.connect(**db_cred)
+    cur = con.cursor()
+    cur.execute("SELECT timestamp, rackets FROM bot_rackets WHERE id = %s;", (bot_id,))
+    timestamp, data = cur.fetchone()
+    cur.close()
+    con.close()
+    return timestamp, json.loads(data)
+
+
+async def measure(read, args):
+    lag = LoopLag(interval=0.005, samples=100000)
+    lag.start()
+    await asyncio.sleep(0.1)
+    lag.reset()
+
+    start = time.perf_counter()
+    for i in range(args.reads):
+        await read()
+        await asyncio.sleep(0)
+    elapsed = time.perf_counter() - start
+
+    await asyncio.sleep(0.1)
+    lag.stop()
+    return lag.stats(), args.reads / elapsed
+
+
+async def main(args):
+    await yata_db.init_pool()
+
+    async def sync_read():
+        get_data_sync(args.bot_id, "rackets")
+
+    async def async_read():
+        await yata_db.get_data(args.bot_id, "rackets")
+
+    for name, read in [("psycopg2 on the loop", sync_read), ("asyncpg pool", async_read)]:
+        stats, rate = await measure(read, args)
+        print(f'< {name} > lag mean {stats["mean"]} p95 {stats["p95"]} max {stats["max"]} ({rate:.0f} reads/s)')
+
+    await yata_db.close_pool()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Event loop lag of the database reads")
+    parser.add_argument("--reads", type=int, default=200)
+    parser.add_argument("--bot-id", type=int, default=1, help="id of the bot_rackets row read")
+    args = parser.parse_args()
+
+    asyncio.get_event_loop().run_until_complete(main(args))
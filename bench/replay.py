@@ -0,0 +1,367 @@
+"""
+Copyright 2020 kivou.2000607@gmail.com
+
+This file is part of yata-bot.
+
+    yata is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    yata is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with yata-bot. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+""" Replay benchmark of the tasks loops hot paths
+
+    Feeds the recorded payloads of bench/fixtures through the real code of
+    Chain._retal, Crimes._oc, Racket.racketsTask, API._notify and Loot.notify
+    with discord and the http calls stubbed, and reports the latency of each
+    iteration, the memory allocated and the throughput.
+
+    python -m bench.replay --iterations 50 --factions 100 --users 500
+    python -m bench.replay --compare bench/results/replay-abc1234.json
+"""
+
+# import standard modules
+import os
+import json
+import time
+import asyncio
+import argparse
+import logging
+import platform
+import statistics
+import subprocess
+import tracemalloc
+from urllib.parse import urlparse
+from urllib.parse import parse_qs
+
+# import bot
+from bots.yata import YataBot
+from inc.ratelimit import RateLimiter
+from inc.torn_api import TornClient
+import cogs.loot
+import cogs.racket
+from cogs.chain import Chain
+from cogs.crimes import Crimes
+from cogs.racket import Racket
+from cogs.api import API
+from cogs.loot import Loot
+
+# import simulator payloads
+from bench.torn_sim import TornSimulator
+
+RESULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+TORN_URL = "http://torn.bench"
+YATA_URL = "http://yata.bench"
+
+
+# discord stubs
+class Channel:
+    messages = 0  # messages sent by all the channels and members
+
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.sent = 0
+
+    def __str__(self):
+        return self.name
+
+    async def send(self, *args, **kwargs):
+        self.sent += 1
+        Channel.messages += 1
+
+
+class Role:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.mention = f'<@&{id}>'
+
+    def __str__(self):
+        return self.name
+
+
+class Member(Channel):
+    def __init__(self, id, name):
+        Channel.__init__(self, id, name)
+        self.nick = name
+        self.display_name = name
+        self.bot = False
+        self.mention = f'<@{id}>'
+
+
+class Guild:
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+        self.channels = [Channel(id * 10 + 1, "alerts")]
+        self.roles = [Role(id * 10 + 2, "alerts")]
+        self.members = [Member(id * 10 + 3, f'member-{id}')]
+        self._roles = {role.id: role for role in self.roles}
+        self._channels = {channel.id: channel for channel in self.channels}
+        self._members = {member.id: member for member in self.members}
+
+    def __str__(self):
+        return self.name
+
+    def get_role(self, id):
+        return self._roles.get(id)
+
+    def get_channel(self, id):
+        return self._channels.get(id)
+
+    def get_member(self, id):
+        return self._members.get(id)
+
+
+class BenchBot(YataBot):
+    """ YataBot with stubbed guilds and master keys
+    """
+
+    def __init__(self, guilds, **args):
+        YataBot.__init__(self, **args)
+        self._bench_guilds = guilds
+
+    @property
+    def guilds(self):
+        return self._bench_guilds
+
+    def get_guild(self, id):
+        return next((g for g in self._bench_guilds if g.id == id), None)
+
+    async def get_master_key(self, guild):
+        return 0, 2000607, "benchmasterkey00"
+
+    async def send_log(self, *args, **kwargs):
+        pass
+
+    async def send_log_main(self, *args, **kwargs):
+        pass
+
+
+class NoSleep:
+    """ asyncio for the loops sleeping at the end of their tick
+    """
+
+    def __getattr__(self, name):
+        return getattr(asyncio, name)
+
+    async def sleep(self, delay, *args):
+        pass
+
+
+def torn_client(sim):
+    """ Torn client with the http calls replaced by the recorded payloads
+        (json round trip kept to account for the decoding)
+    """
+    client = TornClient(base_url=TORN_URL, yata_url=YATA_URL, limiter=RateLimiter(rate=10 ** 9, period=1, burst=10 ** 9), cache_size=0, coalesce_window=0)
+
+    async def fetch(url, error=''):
+        url = urlparse(url)
+        if url.netloc == urlparse(YATA_URL).netloc:
+            payload = sim.yata_payload(url.path.strip("/").replace("/", "_"))
+        else:
+            section, _, id = url.path.strip("/").partition("/")
+            selections = [s for s in parse_qs(url.query).get("selections", [""])[0].split(",") if s] or ["basic"]
+            payload = sim.torn_payload(section, id, selections)
+        text = json.dumps(payload)
+        return json.loads(text), len(text)
+
+    client._fetch = fetch
+    return client
+
+
+def tracking(guild, n):
+    """ retal or oc tracking configuration of a faction
+    """
+    member = guild.members[0]
+    return {"channel": [str(guild.channels[0].id)],
+            "discord_user": [str(member.id)],
+            "torn_user": [2000600 + n, f'Player{n}', 0, f'benchkey{n:08d}'],
+            "role": [str(guild.roles[0].id)]}
+
+
+NOTIFICATIONS = {"event": {}, "message": {}, "award": {}, "energy": {}, "nerve": {}, "chain": {}, "education": {},
+                 "bank": {}, "drug": {}, "medical": {}, "booster": {}, "travel": {}}
+
+
+async def setup(args):
+    sim = TornSimulator()
+    guilds = [Guild(1000 + n, f'guild-{n}') for n in range(args.guilds)]
+    configurations = {}
+    for g in guilds:
+        alerts = {"channels_alerts": {str(g.channels[0].id): "alerts"}, "roles_alerts": {str(g.roles[0].id): "alerts"}}
+        configurations[g.id] = {"admin": {}, "rackets": dict(alerts), "loot": dict(alerts)}
+
+    bot = BenchBot(guilds, configurations=configurations, command_prefix="!", bot_id=3, main_server_id=guilds[0].id)
+    bot.torn = torn_client(sim)
+
+    # cogs without starting their tasks loops
+    instances = {}
+    for cog in [Chain, Crimes, Racket, API, Loot]:
+        instances[cog.__name__] = cog.__new__(cog)
+        instances[cog.__name__].bot = bot
+
+    # database and sleep stubs
+    torn = sim.torn_payload("torn", "", ["rackets", "territory", "timestamp"])
+    previous = json.loads(json.dumps(torn))
+    rackets = sorted(previous["rackets"])
+    previous["rackets"].pop(rackets[0])  # new racket
+    previous["rackets"][rackets[1]]["level"] += 1  # racket moved down
+    previous["rackets"]["ZZZ"] = dict(previous["rackets"][rackets[2]])  # racket vanished
+    for territory in previous["territory"].values():  # new wars
+        territory.pop("war", None)
+
+    async def get_faction_names(ids):
+        return {faction_id: f'Faction [{faction_id}]' for faction_id in ids}
+
+    async def push_data(*args):
+        pass
+
+    async def get_data(bot_id, module):
+        return previous["timestamp"], previous
+
+    cogs.racket.get_data = get_data
+    cogs.racket.get_faction_names = get_faction_names
+    cogs.racket.push_data = push_data
+    cogs.loot.asyncio = NoSleep()
+
+    return bot, guilds, instances
+
+
+def scenarios(args, bot, guilds, instances):
+    """ name: (coroutine function of an iteration, units per iteration, unit)
+    """
+    trackings = [(guilds[n % len(guilds)], n) for n in range(args.factions)]
+    members = [Member(3000 + n, f'user-{n}') for n in range(args.users)]
+
+    async def retal():
+        for guild, n in trackings:
+            await instances["Chain"]._retal(guild, tracking(guild, n))
+
+    async def oc():
+        for guild, n in trackings:
+            await instances["Crimes"]._oc(guild, tracking(guild, n))
+
+    async def rackets():
+        await Racket.racketsTask.coro(instances["Racket"])
+
+    async def notify():
+        for n, member in enumerate(members):
+            await instances["API"]._notify(member, json.loads(json.dumps(NOTIFICATIONS)), f'benchuser{n:07d}')
+
+    async def loot():
+        await Loot.notify.coro(instances["Loot"])
+
+    return {"chain/retal": (retal, args.factions, "factions"),
+            "crimes/oc": (oc, args.factions, "factions"),
+            "racket/rackets": (rackets, len(guilds), "guilds"),
+            "api/notify": (notify, args.users, "users"),
+            "loot/notify": (loot, len(guilds), "guilds")}
+
+
+async def measure(run, units, unit, iterations):
+    # warm up
+    await run()
+
+    # latency
+    messages = Channel.messages
+    latencies = []
+    for i in range(iterations):
+        start = time.perf_counter()
+        await run()
+        latencies.append(time.perf_counter() - start)
+    messages = (Channel.messages - messages) / iterations
+
+    # allocations (separate pass, tracemalloc slows down the iterations)
+    tracemalloc.start()
+    snapshot = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    current = tracemalloc.get_traced_memory()[0]
+    await run()
+    peak = tracemalloc.get_traced_memory()[1] - current
+    stats = tracemalloc.take_snapshot().compare_to(snapshot, "filename")
+    tracemalloc.stop()
+
+    latencies = sorted(latencies)
+    mean = statistics.mean(latencies)
+    return {"iterations": iterations,
+            "units": units,
+            "unit": unit,
+            "mean_ms": 1000 * mean,
+            "p50_ms": 1000 * latencies[int(0.5 * (len(latencies) - 1))],
+            "p95_ms": 1000 * latencies[int(0.95 * (len(latencies) - 1))],
+            "max_ms": 1000 * latencies[-1],
+            f'{unit}_per_s': units / mean if mean else 0,
+            "messages": messages,
+            "peak_kb": peak / 1024,
+            "allocated_blocks": sum([max(0, s.count_diff) for s in stats])}
+
+
+def commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(results, previous):
+    print(f'\n# compared to {previous["commit"]}')
+    for name, r in results["scenarios"].items():
+        p = previous["scenarios"].get(name)
+        if p is None:
+            continue
+        print(f'< {name} > mean {p["mean_ms"]:.2f}ms -> {r["mean_ms"]:.2f}ms ({100 * (r["mean_ms"] / p["mean_ms"] - 1):+.1f}%) '
+              f'peak {p["peak_kb"]:.0f}kB -> {r["peak_kb"]:.0f}kB')
+
+
+async def main(args):
+    bot, guilds, instances = await setup(args)
+    results = {"commit": commit(),
+               "date": time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime()),
+               "python": platform.python_version(),
+               "parameters": vars(args),
+               "scenarios": {}}
+
+    for name, (run, units, unit) in scenarios(args, bot, guilds, instances).items():
+        if args.only and name not in args.only:
+            continue
+        r = await measure(run, units, unit, args.iterations)
+        results["scenarios"][name] = r
+        print(f'< {name} > mean {r["mean_ms"]:.2f}ms p95 {r["p95_ms"]:.2f}ms {r[unit + "_per_s"]:.0f} {unit}/s peak {r["peak_kb"]:.0f}kB {r["allocated_blocks"]} blocks {r["messages"]:.0f} messages')
+
+    await bot.torn.close()
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay benchmark of the tasks loops")
+    parser.add_argument("--iterations", type=int, default=20)
+    parser.add_argument("--guilds", type=int, default=20, help="guilds with rackets and loot alerts")
+    parser.add_argument("--factions", type=int, default=50, help="retal and oc trackings")
+    parser.add_argument("--users", type=int, default=200, help="members with personal notifications")
+    parser.add_argument("--only", nargs="*", help="scenarios to run (eg: chain/retal api/notify)")
+    parser.add_argument("--output", help="json results (default bench/results/replay-<commit>.json)")
+    parser.add_argument("--compare", help="json results of a previous run")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.ERROR)
+    results = asyncio.get_event_loop().run_until_complete(main(args))
+
+    output = args.output or os.path.join(RESULTS, f'replay-{results["commit"]}.json')
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=1)
+    print(f'results saved in {output}')
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
@@ -0,0 +1,253 @@
+"""
+Copyright 2020 kivou.2000607@gmail.com
+
+This file is part of yata-bot.
+
+    yata is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    yata is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with yata-bot. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+""" Local stand-in for api.torn.com and YATA's API for offline benchmarks
+
+    Serves the recorded payloads of bench/fixtures (timestamps moved to now)
+    with configurable latency, per key rate limiting and error injection.
+
+    python bench/torn_sim.py --port 8080 --latency lognormal:0.3,0.5 --error-rate 0.02
+
+    Point the bot at it with
+    TORN_API_URL=http://localhost:8080 YATA_URL=http://localhost:8080 python yata.py
+
+    Endpoints
+    - /user/{id}?selections=...&key=...
+    - /faction/{id}?selections=...&key=...
+    - /torn/?selections=...&key=...
+    - /loot/timings/
+    - /stock/alerts/
+    - GET /_sim/stats: calls, errors and rate limited calls
+    - GET or POST /_sim/config: read or change the configuration (json)
+"""
+
+# import standard modules
+import os
+import json
+import time
+import random
+import asyncio
+import argparse
+import logging
+from collections import deque
+
+# import aiohttp server
+from aiohttp import web
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+# fields moved from the recording time to now
+SHIFTED_FIELDS = {"timestamp", "timestamp_started", "timestamp_ended", "time_started", "time_ready", "time_completed",
+                  "server_time", "changed", "created", "started", "ends", "start", "departed", "time_bought", "ts"}
+
+# Torn API errors
+ERRORS = {
+    0: "Unknown error",
+    2: "Incorrect key",
+    4: "Wrong fields",
+    5: "Too many requests",
+    8: "IP block",
+    9: "API disabled",
+}
+
+
+def latency_sampler(spec):
+    """ latency distributions (seconds)
+        - fixed:0.2
+        - uniform:0.1,0.5
+        - lognormal:0.3,0.5 (median, sigma)
+        - pareto:0.2,3 (minimum, shape)
+    """
+    kind, _, args = spec.partition(":")
+    args = [float(a) for a in args.split(",") if a]
+    if kind == "fixed":
+        return lambda: args[0]
+    if kind == "uniform":
+        return lambda: random.uniform(args[0], args[1])
+    if kind == "lognormal":
+        import math
+        mu = math.log(args[0])
+        return lambda: random.lognormvariate(mu, args[1])
+    if kind == "pareto":
+        return lambda: args[0] * random.paretovariate(args[1])
+    raise ValueError(f'unknown latency distribution {spec}')
+
+
+def shift(data, delta):
+    """ copy of the payload with the timestamps moved by delta
+    """
+    if isinstance(data, dict):
+        return {k: v + delta if k in SHIFTED_FIELDS and isinstance(v, int) and v > 0 else shift(v, delta) for k, v in data.items()}
+    if isinstance(data, list):
+        return [shift(v, delta) for v in data]
+    return data
+
+
+class TornSimulator:
+
+    def __init__(self, latency="lognormal:0.3,0.5", rate=100, period=60, error_rate=0, error_codes="0,9", http_error_rate=0, hang_rate=0, hang=600):
+        self.fixtures = {}
+        for name in ["user", "faction", "torn", "loot_timings", "stock_alerts"]:
+            with open(os.path.join(FIXTURES, f'{name}.json')) as f:
+                self.fixtures[name] = json.load(f)
+
+        self.config = {}
+        self.set_config(latency=latency, rate=rate, period=period, error_rate=error_rate, error_codes=error_codes,
+                        http_error_rate=http_error_rate, hang_rate=hang_rate, hang=hang)
+
+        self.calls = {}  # key -> deque of the calls timestamps
+        self.stats = {"calls": 0, "rate limited": 0, "errors": 0, "http errors": 0, "hangs": 0}
+
+    def set_config(self, **config):
+        self.config.update(config)
+        self._latency = latency_sampler(self.config["latency"])
+        if isinstance(self.config["error_codes"], str):
+            self.config["error_codes"] = [int(c) for c in self.config["error_codes"].split(",") if c]
+
+    def rate_limited(self, key):
+        now = time.monotonic()
+        calls = self.calls.setdefault(key, deque())
+        while len(calls) and calls[0] <= now - self.config["period"]:
+            calls.popleft()
+        if len(calls) >= self.config["rate"]:
+            return True
+        calls.append(now)
+        return False
+
+    async def fault(self):
+        """ latency and injected faults
+            return: a response for the fault or None
+        """
+        self.stats["calls"] += 1
+        await asyncio.sleep(max(0, self._latency()))
+
+        if random.random() < self.config["hang_rate"]:
+            self.stats["hangs"] += 1
+            await asyncio.sleep(self.config["hang"])
+
+        if random.random() < self.config["http_error_rate"]:
+            self.stats["http errors"] += 1
+            return web.Response(status=random.choice([500, 502, 503]), text="<html>Bad gateway</html>")
+
+        if random.random() < self.config["error_rate"]:
+            self.stats["errors"] += 1
+            code = random.choice(self.config["error_codes"])
+            return web.json_response({"error": {"code": code, "error": ERRORS.get(code, "Unknown error")}})
+
+        return None
+
+    async def api(self, request):
+        section = request.match_info["section"]
+        id = request.match_info.get("id", "")
+        key = request.query.get("key", "")
+        selections = [s for s in request.query.get("selections", "").split(",") if s] or ["basic"]
+
+        response = await self.fault()
+        if response is not None:
+            return response
+
+        if len(key) != 16:
+            return web.json_response({"error": {"code": 2, "error": ERRORS[2]}})
+
+        if self.rate_limited(key):
+            self.stats["rate limited"] += 1
+            return web.json_response({"error": {"code": 5, "error": ERRORS[5]}})
+
+        return web.json_response(self.torn_payload(section, id, selections))
+
+    def torn_payload(self, section, id, selections):
+        """ recorded payload of a Torn API call (timestamps moved to now)
+        """
+        fixture = self.fixtures[section]
+        if any([s not in fixture["selections"] for s in selections]):
+            return {"error": {"code": 4, "error": ERRORS[4]}}
+
+        payload = {}
+        for s in selections:
+            payload.update(fixture["selections"][s])
+        payload = shift(payload, int(time.time()) - fixture["recorded"])
+
+        # payload of the requested user or faction
+        if id.isdigit() and section == "user" and "player_id" in payload:
+            payload["player_id"] = int(id)
+        if id.isdigit() and section == "faction" and "ID" in payload:
+            payload["ID"] = int(id)
+
+        return payload
+
+    async def yata(self, request, name):
+        response = await self.fault()
+        if response is not None:
+            return response
+
+        return web.json_response(self.yata_payload(name))
+
+    def yata_payload(self, name):
+        """ recorded payload of YATA's API (timestamps moved to now)
+        """
+        fixture = self.fixtures[name]
+        now = int(time.time())
+        payload = shift(fixture["payload"], now - fixture["recorded"])
+
+        # loot timings are given relatively to now
+        if name == "loot_timings":
+            for npc in payload.values():
+                for timing in npc["timings"].values():
+                    timing["due"] = timing["ts"] - now
+
+        return payload
+
+    async def sim_stats(self, request):
+        return web.json_response(dict(self.stats, keys=len(self.calls)))
+
+    async def sim_config(self, request):
+        if request.method == "POST":
+            self.set_config(**await request.json())
+            logging.info(f'[torn_sim] new configuration {self.config}')
+        return web.json_response(self.config)
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get("/loot/timings/", lambda r: self.yata(r, "loot_timings"))
+        app.router.add_get("/stock/alerts/", lambda r: self.yata(r, "stock_alerts"))
+        app.router.add_get("/_sim/stats", self.sim_stats)
+        app.router.add_route("*", "/_sim/config", self.sim_config)
+        app.router.add_get(r"/{section:user|faction|torn}/{id:[0-9]*}", self.api)
+        app.router.add_get(r"/{section:user|faction|torn}", self.api)
+        return app
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Torn API and YATA's API simulator")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", default="lognormal:0.3,0.5", help="fixed:s, uniform:a,b, lognormal:median,sigma or pareto:minimum,shape")
+    parser.add_argument("--rate", type=int, default=100, help="calls per key per period before error code 5")
+    parser.add_argument("--period", type=float, default=60)
+    parser.add_argument("--error-rate", type=float, default=0, help="probability of a Torn API error")
+    parser.add_argument("--error-codes", default="0,9", help="codes of the injected errors")
+    parser.add_argument("--http-error-rate", type=float, default=0, help="probability of an HTTP 5xx")
+    parser.add_argument("--hang-rate", type=float, default=0, help="probability of a hanging call")
+    parser.add_argument("--hang", type=float, default=600, help="duration of a hanging call")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    sim = TornSimulator(latency=args.latency, rate=args.rate, period=args.period, error_rate=args.error_rate, error_codes=args.error_codes,
+                        http_error_rate=args.http_error_rate, hang_rate=args.hang_rate, hang=args.hang)
+    web.run_app(sim.app(), host=args.host, port=args.port)
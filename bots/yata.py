@@ -34,30 +34,74 @@ from discord.utils import get
 
 # import bot functions and classes
 # from includes.yata_db import get_member_key
-from inc.yata_db import set_configuration
 from inc.yata_db import get_yata_user
+from inc.yata_db import init_pool
+from inc.yata_db import close_pool
+from inc.yata_db import pool_stats
+from inc.yata_db import users_stats
+from inc.yata_db import factions_stats
+from inc.yata_db import load_configurations
+from inc.yata_db import configurations_stats
+from inc.yata_db import forget_server_admins
+from inc.torn_api import TornClient
+from inc.torn_api import TORN_API_URL
+from inc.torn_api import YATA_URL
+from inc.keys import KeyPool
+from inc.config_writer import ConfigWriter
+from inc.config_writer import FLUSH_INTERVAL
+from inc.config_feed import ConfigFeed
+from inc.config_feed import POLL_INTERVAL
+from inc.loop_lag import LoopLag
+from inc.guild_config import GuildConfig
+from inc.guild_config import ModuleConfig
+from inc.guild_config import EMPTY
+from inc.resolver import GuildResolver
 from inc.handy import *
 
 
 # Child class of Bot with extra configuration variables
 class YataBot(Bot):
-    def __init__(self, configurations=None, main_server_id=0, bot_id=0, github_token=None, **args):
+    def __init__(self, configurations=None, main_server_id=0, bot_id=0, github_token=None, torn_api_url=TORN_API_URL, yata_url=YATA_URL, flush_interval=FLUSH_INTERVAL, poll_interval=POLL_INTERVAL, snapshot=None, reconcile=False, **args):
         Bot.__init__(self, **args)
         self.configurations = configurations
         self.bot_id = int(bot_id)
         self.github_token = github_token
         self.main_server_id = int(main_server_id)
 
+        # master keys of the server admins and shared http client for the Torn API calls
+        self.keys = KeyPool()
+        self.torn = TornClient(base_url=torn_api_url, yata_url=yata_url, key_pool=self.keys)
+
+        # configurations changes written to the database every flush_interval seconds
+        self.config_writer = ConfigWriter(self.bot_id, lambda guild_id: self.configurations.get(guild_id, {}), interval=flush_interval, snapshot=snapshot)
+
+        # compiled configurations by guild id (see get_guild_config)
+        self._guild_configs = {}
+
+        # roles and channels by name by guild id (see get_resolver)
+        self._resolvers = {}
+
+        # guilds ids by enabled module and enabled modules by guild id (see get_guilds_by_module)
+        self._module_guilds = None
+        self._guild_modules = {}
+
+        # configurations changed in the database (dashboard) reloaded
+        self.config_feed = ConfigFeed(self.bot_id, self.set_guild_configuration, interval=poll_interval)
+
+        # local copy of the configurations (reconcile: started from it, to check against the database)
+        self.snapshot = snapshot
+        self.reconcile = reconcile
+
+        # delays of the event loop (blocking calls)
+        self.loop_lag = LoopLag()
+
     async def discord_to_torn(self, member, key):
         """ get a torn id form discord id
             return tornId, None: okay
             return -1, error: api error
             return -2, None: not verified on discord
         """
-        url = f"https://api.torn.com/user/{member.id}?selections=discord&key={key}"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as r:
-                req = await r.json()
+        req = await self.torn.get("user", member.id, "discord", key)
 
         if 'error' in req:
             # logging.info(f'[DISCORD TO TORN] api error "{key}": {req["error"]["error"]}')
@@ -71,26 +115,25 @@ class YataBot(Bot):
             return int(req['discord'].get("userID")), None
 
     async def get_master_key(self, guild):
-        """ gets a random master key from configuration
-            return 0, id, Name, Key: All good
-            return -1, None, None, None: no key given
+        """ gets a master key from the server admins keys pool
+            (least recently used key not in quarantine)
+            return 0, id, Key: All good
+            return -1, None, None: no key given
         """
-        import random
         c = self.configurations.get(guild.id)
         if c is None:
             return -1, None, None
 
         torn_ids = [v["torn_id"] for k, v in c.get("admin", {}).get("server_admins", {}).items()]
-        if len(torn_ids):
-            user = await get_yata_user(random.choice(torn_ids), type="T")
-            if not len(user):
-                return -1, None, None
-            else:
-                user = tuple(user[0])
-                return 0, user[0], user[2]
-        else:
+        if not len(torn_ids):
+            return -1, None, None
+
+        master = await self.keys.get(guild.id, torn_ids)
+        if master is None:
             return -1, None, None
 
+        return 0, master[0], master[1]
+
     async def get_user_key(self, ctx, member, needPerm=True, returnMaster=False, delError=False, guild=False):
         """ gets a key from discord member
             return status, tornId, Name, key
@@ -174,31 +217,190 @@ class YataBot(Bot):
         # activity = discord.Activity(name="TORN", type=discord.ActivityType.playing)
         # await self.change_presence(activity=activity)
 
+        # new guilds objects (the events might have been missed while disconnected)
+        self._resolvers.clear()
+
         logging.info("[SETUP] Ready...")
 
+    async def start(self, *args, **kwargs):
+        # database connection pool shared by all the cogs (created on first use if the database is down)
+        # started from the snapshot: the database is only used in the background (reconcile)
+        if self.reconcile:
+            asyncio.ensure_future(self.reconcile_configurations())
+        else:
+            try:
+                await init_pool()
+            except Exception as e:
+                logging.warning(f'[YataBot/start] database unavailable: {hide_key(e)}')
+        self.config_writer.start()
+        self.config_feed.start()
+        self.loop_lag.start()
+        await Bot.start(self, *args, **kwargs)
+
+    async def close(self):
+        self.loop_lag.stop()
+        self.config_feed.stop()
+        await self.torn.close()
+        await Bot.close(self)
+        await self.config_writer.close()
+        await close_pool()
+
+    async def reconcile_configurations(self, retry=10):
+        """ replaces the configurations loaded from the snapshot by the ones of the database
+            (the ones with changes not written yet are reloaded once written)
+        """
+        while True:
+            try:
+                # loaded again if configurations were written meanwhile (the loaded ones can be older)
+                flushes = self.config_writer.stats()["flushes"]
+                _, configurations = await load_configurations(self.bot_id)
+                if flushes == self.config_writer.stats()["flushes"]:
+                    break
+                continue
+            except Exception as e:
+                logging.warning(f'[YataBot/reconcile_configurations] database unavailable, retry in {retry}s: {hide_key(e)}')
+                await asyncio.sleep(retry)
+                retry = min(2 * retry, 300)
+
+        changed = 0
+        pending = []
+        for guild_id in set(self.configurations) | set(configurations):
+            if self.configurations.get(guild_id) != configurations.get(guild_id):
+                if self.set_guild_configuration(guild_id, configurations.get(guild_id), keep_currents=False, save=False):
+                    changed += 1
+                else:
+                    pending.append(guild_id)
+
+        logging.info(f'[YataBot/reconcile_configurations] {len(configurations)} configurations from the database, {changed} changed since the snapshot, {len(pending)} pending')
+
+        # changes of the bot written first then reloaded from the database (retried by the feed while still pending)
+        if len(pending):
+            await self.config_writer.flush()
+            for guild_id in pending:
+                self.config_feed.reload(guild_id)
+
+        if self.snapshot is not None:
+            await self.snapshot.save_async(self.configurations, full=True)
+
+    def set_guild_configuration(self, guild_id, configuration, keep_currents=True, save=True):
+        """ replaces the configuration of a guild by the one of the database (None to remove it)
+            keep_currents: keeps the modules currents of the bot (its state, only changed by the bot)
+            save: saves the configuration in the snapshot
+            return: False if not replaced (changes not written yet), True otherwise
+        """
+        if self.config_writer.pending(guild_id):
+            return False
+
+        current = self.configurations.get(guild_id)
+        if keep_currents and configuration is not None and current is not None:
+            for module, c in current.items():
+                if isinstance(c, dict) and "currents" in c and isinstance(configuration.get(module), dict):
+                    configuration[module]["currents"] = c["currents"]
+
+        if configuration == current:
+            return True
+
+        # swapped: the configurations read in a command or a loop stay consistent
+        if configuration is None:
+            self.configurations.pop(guild_id, None)
+        else:
+            self.configurations[guild_id] = configuration
+            if save and self.snapshot is not None:
+                asyncio.ensure_future(self.snapshot.save_async({guild_id: configuration}))
+        forget_server_admins(self.bot_id, guild_id)
+        self.keys.invalidate(guild_id)
+        self._configuration_changed(guild_id)
+        logging.debug(f'[YataBot/set_guild_configuration] {guild_id}: configuration {"removed" if configuration is None else "reloaded"}')
+        return True
+
+    def save_configuration(self, guild, path=None):
+        """ marks the configuration of the guild to be written in the database
+            (written within the flush interval, several changes make one write)
+            path: keys of the changed value to only write this value (eg: ["verify", "other", "daily_verify"])
+        """
+        self._configuration_changed(guild.id)
+        self.config_writer.mark(guild.id, guild.name, path=path)
+
+    def _configuration_changed(self, guild_id):
+        # compiled configuration and modules index of the guild
+        self._guild_configs.pop(guild_id, None)
+        if self._module_guilds is not None:
+            self._index_modules(guild_id)
+
+    def _index_modules(self, guild_id):
+        modules = frozenset([module for module, c in self.configurations.get(guild_id, {}).items() if c])
+        previous = self._guild_modules.get(guild_id, frozenset())
+        if modules == previous:
+            return
+
+        for module in previous - modules:
+            self._module_guilds[module].discard(guild_id)
+        for module in modules - previous:
+            self._module_guilds.setdefault(module, set()).add(guild_id)
+        if len(modules):
+            self._guild_modules[guild_id] = modules
+        else:
+            self._guild_modules.pop(guild_id, None)
+
+    def get_metrics(self):
+        """ gets the metrics of the bot internals as {section: {name: value}}
+        """
+        metrics = {}
+        metrics.update(self.torn.stats())
+        metrics["Master keys pool"] = self.keys.stats()
+        metrics["Database pool"] = pool_stats()
+        metrics["YATA users cache"] = users_stats()
+        metrics["Factions names cache"] = factions_stats()
+        metrics["Configurations writer"] = self.config_writer.stats()
+        metrics["Configurations feed"] = dict(self.config_feed.stats(), **configurations_stats())
+        metrics["Event loop lag"] = self.loop_lag.stats()
+        if self.snapshot is not None:
+            metrics["Configurations snapshot"] = self.snapshot.stats()
+        return metrics
+
     def get_guilds_by_module(self, module):
-        guilds = [g for g in self.guilds if self.configurations.get(g.id, {}).get(module, False)]
-        return guilds
+        # index built on first use and updated with the configurations changes
+        if self._module_guilds is None:
+            self._module_guilds = {}
+            for guild_id in list(self.configurations):
+                self._index_modules(guild_id)
+
+        guilds = [self.get_guild(guild_id) for guild_id in self._module_guilds.get(module, ())]
+        return [g for g in guilds if g is not None]
+
+    def get_guild_config(self, guild_id):
+        """ compiled configuration of a guild (see inc/guild_config.py)
+            compiled again when the configuration is replaced or saved
+        """
+        configuration = self.configurations.get(guild_id, EMPTY)
+        c = self._guild_configs.get(guild_id)
+        if c is None or c.raw is not configuration:
+            c = self._guild_configs[guild_id] = GuildConfig(configuration)
+        return c
 
     def get_guild_configuration_by_module(self, guild, module, check_key=False):
-        c = self.configurations.get(guild.id, {}).get(module, False)
-        if check_key and c:
-            return c if len(c.get(check_key, {})) else False
+        c = self.get_guild_config(guild.id).modules.get(module)
+        if c is None:
+            return False
+        if check_key:
+            return c.raw if len(c.raw.get(check_key, {})) else False
         else:
-            return c
+            return c.raw
 
     def get_guild_admin_channel(self, guild):
-        admin_id = [k for k in self.configurations.get(guild.id, {}).get("admin", {}).get("channels_admin", {})]
-        if len(admin_id) and str(admin_id[0]).isdigit():
-            return get(guild.channels, id=int(admin_id[0]))
-        else:
-            return None
+        admin_id = self.get_guild_config(guild.id).admin_channel_id
+        return None if admin_id is None else guild.get_channel(admin_id)
 
     async def check_channel_allowed(self, ctx, config, channel_key=None):
         channel_key = "channels_allowed" if channel_key is None else channel_key
 
-        if str(ctx.channel.id) not in config.get(channel_key, []):
-            channels = [get(ctx.guild.channels, id=int(k)) for k in config.get(channel_key, {}) if str(k).isdigit()]
+        module = self.get_guild_config(ctx.guild.id).module_of(config)
+        if module is None:
+            # not the configuration of a module of the guild
+            module = ModuleConfig(config)
+
+        if ctx.channel.id not in module.id_sets.get(channel_key, ()):
+            channels = [ctx.guild.get_channel(id) for id in module.ids.get(channel_key, ())]
             allowed_channels = [c.mention for c in channels if c is not None]
             if len(allowed_channels):
                 msg = await ctx.send(f':no_entry: Command not allowed in this channel. Try {", ".join(allowed_channels)}.')
@@ -224,7 +426,7 @@ class YataBot(Bot):
             return True
 
     async def send_log_main(self, log, headers=dict({}), full=False):
-        guild = get(self.guilds, id=self.main_server_id)
+        guild = self.get_guild(self.main_server_id)
         logging.debug(f'[send_log_main] Guild: {guild}')
         channel = self.get_guild_admin_channel(guild)
         logging.debug(f'[send_log_main] channel: {channel}')
@@ -257,7 +459,7 @@ class YataBot(Bot):
             return
 
         logging.debug(f'[send_log] guild_id: {guild_id} channel_id: {channel_id}')
-        guild = get(self.guilds, id=guild_id)
+        guild = self.get_guild(guild_id)
         headers["guild"] = guild
 
         # fallback is guild not found
@@ -266,7 +468,7 @@ class YataBot(Bot):
             await self.send_log_main(log, headers=headers)
             return
 
-        channel = get(guild.channels, id=channel_id)
+        channel = guild.get_channel(channel_id)
         if channel is None:
             headers["note"].append("channel id not provided")
             channel = self.get_guild_admin_channel(guild)
@@ -306,9 +508,9 @@ class YataBot(Bot):
                 await self.send_log_main(log, headers=headers)
                 return
 
-    def get_module_role(self, guild_roles, configuration_roles, all=False):
+    def get_module_role(self, guild, configuration_roles, all=False):
         """ gets the role of a module for a guild:
-            - guild_roles: the list of the roles of the guild
+            - guild: the guild
             - configuration_roles: the list of the roles of the configuration
             - all: return all roles if true, only the first one if False
 
@@ -317,18 +519,58 @@ class YataBot(Bot):
         role_ids = [id for id in configuration_roles if id.isdigit()]
         if len(role_ids):
             if all:
-                return [get(guild_roles, id=int(id)) for id in role_ids]
+                return [guild.get_role(int(id)) for id in role_ids]
             else:
-                return get(guild_roles, id=int(role_ids[0]))
+                return guild.get_role(int(role_ids[0]))
         else:
             if all:
                 return [None]
             else:
                 return None
 
-    def get_module_channel(self, guild_channels, configuration_channels, all=False):
+    def get_guild_module_role(self, guild, module, key, all=False):
+        """ gets the role of a module for a guild from its compiled configuration:
+            - module: name of the module
+            - key: key of the roles in the configuration of the module (eg: roles_alerts)
+            - all: return all roles if true, only the first one if False
+
+            return: role, list of roles or None (if didn't find anything)
+        """
+        role_ids = self.get_guild_config(guild.id).ids(module, key)
+        if len(role_ids):
+            if all:
+                return [guild.get_role(id) for id in role_ids]
+            else:
+                return guild.get_role(role_ids[0])
+        else:
+            if all:
+                return [None]
+            else:
+                return None
+
+    def get_guild_module_channel(self, guild, module, key, all=False):
+        """ gets the channel of a module for a guild from its compiled configuration:
+            - module: name of the module
+            - key: key of the channels in the configuration of the module (eg: channels_alerts)
+            - all: return all channels if true, only the first one if False
+
+            return: channel, list of channels or None (if didn't find anything)
+        """
+        channel_ids = self.get_guild_config(guild.id).ids(module, key)
+        if len(channel_ids):
+            if all:
+                return [guild.get_channel(id) for id in channel_ids]
+            else:
+                return guild.get_channel(channel_ids[0])
+        else:
+            if all:
+                return [None]
+            else:
+                return None
+
+    def get_module_channel(self, guild, configuration_channels, all=False):
         """ gets the channel of a module for a guild:
-            - guild_channels: the list of the channels of the guild
+            - guild: the guild
             - configuration_channels: the list of the channels of the configuration
             - all: return all channels if true, only the first one if False
 
@@ -337,21 +579,68 @@ class YataBot(Bot):
         channel_ids = [id for id in configuration_channels if id.isdigit()]
         if len(channel_ids):
             if all:
-                return [get(guild_channels, id=int(id)) for id in channel_ids]
+                return [guild.get_channel(int(id)) for id in channel_ids]
             else:
-                return get(guild_channels, id=int(channel_ids[0]))
+                return guild.get_channel(int(channel_ids[0]))
         else:
             if all:
                 return [None]
             else:
                 return None
 
+    def get_resolver(self, guild):
+        """ roles and channels of a guild by name (see inc/resolver.py)
+            built on first use and maintained with the roles and channels events
+        """
+        resolver = self._resolvers.get(guild.id)
+        if resolver is None:
+            resolver = self._resolvers[guild.id] = GuildResolver(guild)
+        return resolver
+
+    def get_role_by_name(self, guild, name):
+        return self.get_resolver(guild).role(guild, name)
+
+    def get_channel_by_name(self, guild, name):
+        return self.get_resolver(guild).channel(guild, name)
+
+    async def on_guild_role_create(self, role):
+        resolver = self._resolvers.get(role.guild.id)
+        if resolver is not None:
+            resolver.add(resolver.roles, role)
+
+    async def on_guild_role_delete(self, role):
+        resolver = self._resolvers.get(role.guild.id)
+        if resolver is not None:
+            resolver.remove(resolver.roles, role)
+
+    async def on_guild_role_update(self, before, after):
+        resolver = self._resolvers.get(after.guild.id)
+        if resolver is not None:
+            resolver.rename(resolver.roles, before, after)
+
+    async def on_guild_channel_create(self, channel):
+        resolver = self._resolvers.get(channel.guild.id)
+        if resolver is not None:
+            resolver.add(resolver.channels, channel)
+
+    async def on_guild_channel_delete(self, channel):
+        resolver = self._resolvers.get(channel.guild.id)
+        if resolver is not None:
+            resolver.remove(resolver.channels, channel)
+
+    async def on_guild_channel_update(self, before, after):
+        resolver = self._resolvers.get(after.guild.id)
+        if resolver is not None:
+            resolver.rename(resolver.channels, before, after)
+
     async def on_guild_join(self, guild):
 
         await self.send_log_main(f'I **joined** server {guild} [`{guild.id}`] owned by {guild.owner} ')
 
         self.configurations[guild.id] = {}
-        await set_configuration(self.bot_id, guild.id, guild.name, self.configurations[guild.id])
+        self._resolvers.pop(guild.id, None)
+        self.keys.invalidate(guild.id)
+        self.save_configuration(guild)
 
     async def on_guild_remove(self, guild):
 
@@ -359,4 +648,6 @@ class YataBot(Bot):
 
         if guild.id in self.configurations:
             self.configurations.pop(guild.id)
-        await set_configuration(self.bot_id, guild.id, guild.name, {})
+        self._resolvers.pop(guild.id, None)
+        self.keys.invalidate(guild.id)
+        self.save_configuration(guild)
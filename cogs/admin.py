@@ -41,7 +41,7 @@ from inc.yata_db import get_server_admins
 from inc.yata_db import set_configuration
 from inc.yata_db import get_configuration
 from inc.yata_db import set_n_servers
-from inc.yata_db import get_yata_user
+from inc.yata_db import get_yata_users_bulk
 
 from inc.handy import *
 
@@ -75,7 +75,7 @@ class Admin(commands.Cog):
             updates.append("- create server database")
 
         # check if server admin and secret
-        server_admins, server_secret = await get_server_admins(self.bot_id, ctx.guild.id)
+        server_admins, server_secret = await get_server_admins(self.bot_id, ctx.guild.id, refresh=True)
         admins_lst = ["```md", "# Bot admins"]
         if len(server_admins):
             for server_admin_id, server_admin in server_admins.items():
@@ -113,7 +113,7 @@ class Admin(commands.Cog):
         # set admin section of the configuration
         if "admin" not in configuration:
             configuration["admin"] = {}
-        bot = get(ctx.guild.members, id=self.bot.user.id)
+        bot = ctx.guild.get_member(self.bot.user.id)
         configuration["admin"]["joined_at"] = int(datetime.datetime.timestamp(bot.joined_at))
         configuration["admin"]["guild_id"] = str(ctx.guild.id)
         configuration["admin"]["guild_name"] = ctx.guild.name
@@ -164,9 +164,12 @@ class Admin(commands.Cog):
 
         # push configuration
         # print(json.dumps(configuration))
-        await set_configuration(self.bot_id, ctx.guild.id, ctx.guild.name, configuration)
-
         self.bot.configurations[ctx.guild.id] = configuration
+        self.bot.keys.invalidate(ctx.guild.id)
+        self.bot.save_configuration(ctx.guild)
+        if not await self.bot.config_writer.flush():
+            await ctx.send(":x: The configuration couldn't be saved in YATA's database, it will be saved later. Try `!sync` again if your dashboard is not up to date.")
+            return
 
         if len(updates) < 3:
             updates.append("< none >")
@@ -199,6 +202,24 @@ class Admin(commands.Cog):
         for server_id in [s for s in self.bot.configurations if s not in [g.id for g in self.bot.guilds]]:
             await ctx.send(f'```No bot in configuration id {server_id}```')
 
+    @commands.command()
+    async def metrics(self, ctx, *args):
+        """Admin tool for the bot owner"""
+        logging.info(f'[admin/metrics] {ctx.guild}: {ctx.author.nick} / {ctx.author}')
+
+        if ctx.author.id != 227470975317311488:
+            logging.info(f'[admin/metrics] not authorized')
+            return
+
+        lst = []
+        for section, stats in self.bot.get_metrics().items():
+            lst.append(f'# {section}')
+            for k, v in stats.items():
+                lst.append(f'< {k} > {v}')
+            lst.append('')
+
+        await send_tt(ctx, lst)
+
     @commands.command()
     @commands.has_any_role(679669933680230430, 669682126203125760)
     async def info(self, ctx, *args):
@@ -213,13 +234,13 @@ class Admin(commands.Cog):
 
         id = int(args[0])
         if id in configurations:
-            guild = get(self.bot.guilds, id=id)
+            guild = self.bot.get_guild(id)
             server_admins = configurations[id].get("admin", {}).get("server_admins")
 
             lst = [f"```md\n# Admins of server {guild} [{guild.id}]", ""]
             for i, (k, v) in enumerate(server_admins.items()):
                 lst.append(f'<Admin #{i + 1}>')
-                member = get(guild.members, id=int(k))
+                member = guild.get_member(int(k))
                 lst.append(f'< discord > {member} [{member.id}] aka {member.display_name}')
                 lst.append(f'< torn > {v["name"]} [{v["torn_id"]}]')
 
@@ -234,7 +255,7 @@ class Admin(commands.Cog):
             contacts += admins
 
         if str(id) in contacts:
-            member = get(ctx.guild.members, id=id)
+            member = ctx.guild.get_member(id)
             guild_ids = [k for k, v in configurations.items() if str(id) in v.get("admin", {}).get("server_admins", {})]
 
             print(guild_ids)
@@ -244,7 +265,7 @@ class Admin(commands.Cog):
                 lst = [f"```md\n# Discord member {member} [{member.id}] aka {member.display_name}", ""]
 
             for i, k in enumerate(guild_ids):
-                guild = get(self.bot.guilds, id=int(k))
+                guild = self.bot.get_guild(int(k))
                 lst.append(f'<Server #{i + 1}> {guild} [{guild.id}]')
 
             lst.append("```")
@@ -277,7 +298,7 @@ class Admin(commands.Cog):
                 sent = False
 
                 # try and get yata admin
-                channel = get(guild.channels, name="yata-admin")
+                channel = self.bot.get_channel_by_name(guild, "yata-admin")
                 if channel is None:
                     logging.info(f"[admin/talk] Guild {guild}: yata-admin not found")
                 else:
@@ -309,7 +330,7 @@ class Admin(commands.Cog):
                 await ctx.send(":x: You need to enter a channel and a message```!talk #channel < message_id >```Error: channel id = {}".format(channel_id))
                 return
 
-            channel = get(ctx.guild.channels, id=int(channel_id))
+            channel = ctx.guild.get_channel(int(channel_id))
             if channel is None:
                 await ctx.send(":x: You need to enter a channel and a message```!talk #channel < message_id >```Error: channel = {}".format(channel))
                 return
@@ -396,11 +417,11 @@ class Admin(commands.Cog):
 
         if len(args) and args[0].lower() == "host":
             # return if not admin
-            admin_role = get(ctx.guild.roles, id=669682126203125760)
+            admin_role = ctx.guild.get_role(669682126203125760)
             if admin_role not in ctx.author.roles:
                 return
 
-            r = get(ctx.guild.roles, id=657131110077169664)
+            r = ctx.guild.get_role(657131110077169664)
             if r is None:
                 await ctx.send(f":x: no role {args[0]}")
                 return
@@ -436,11 +457,11 @@ class Admin(commands.Cog):
 
         elif len(args) and args[0].lower() == "yata":
             # return if not admin
-            admin_role = get(ctx.guild.roles, id=669682126203125760)
+            admin_role = ctx.guild.get_role(669682126203125760)
             if admin_role not in ctx.author.roles:
                 return
 
-            r = get(ctx.guild.roles, id=703674852476846171)
+            r = ctx.guild.get_role(703674852476846171)
 
             # loop over member
             if r is None:
@@ -449,12 +470,13 @@ class Admin(commands.Cog):
                 msg = await ctx.send(f":clock1: Assigning {r}")
 
             n = len(ctx.guild.members)
+            yata_users = await get_yata_users_bulk(discord_ids=[member.id for member in ctx.guild.members])
             for i, member in enumerate(ctx.guild.members):
-                if len(await get_yata_user(member.id, type="D")) and r not in member.roles:
+                if member.id in yata_users and r not in member.roles:
                     logging.info(f"[admin/assign] {member.display_name} add {r}")
                     await member.add_roles(r)
 
-                elif not len(await get_yata_user(member.id, type="D")) and r in member.roles:
+                elif member.id not in yata_users and r in member.roles:
                     logging.info(f"[admin/assign] {member.display_name} remove {r}")
                     await member.remove_roles(r)
 
@@ -484,7 +506,7 @@ class Admin(commands.Cog):
             return
 
         # get role
-        role = self.bot.get_module_role(ctx.guild.roles, config.get("roles_alerts", {}))
+        role = self.bot.get_guild_module_role(ctx.guild, module, "roles_alerts")
 
         if role is None:
             # not role
@@ -522,7 +544,7 @@ class Admin(commands.Cog):
             return
 
         # get welcome channel
-        welcome_channel = self.bot.get_module_channel(member.guild.channels, config.get("channels_welcome", {}))
+        welcome_channel = self.bot.get_guild_module_channel(member.guild, "admin", "channels_welcome")
 
         # fall back to system channel
         if welcome_channel is None:
@@ -551,8 +573,8 @@ class Admin(commands.Cog):
                         ponc = ''
                         word = w[1:]
 
-                    lookup = member.guild.channels if w[0] == '#' else member.guild.roles
-                    obj = member if word == "new_member" else get(lookup, name=word.replace("_", " "))
+                    lookup = self.bot.get_channel_by_name if w[0] == '#' else self.bot.get_role_by_name
+                    obj = member if word == "new_member" else lookup(member.guild, word.replace("_", " "))
                     if obj is not None:
                         discord_line.append(f'{obj.mention}{ponc}')
                     else:
@@ -638,11 +660,11 @@ class Admin(commands.Cog):
     async def assignRoles(self):
         logging.debug("[admin/assignRoles] start task")
 
-        guild = get(self.bot.guilds, id=self.bot.main_server_id)
+        guild = self.bot.get_guild(self.bot.main_server_id)
 
         # assign @host and @yata
-        host = get(guild.roles, id=657131110077169664)
-        yata = get(guild.roles, id=703674852476846171)
+        host = guild.get_role(657131110077169664)
+        yata = guild.get_role(703674852476846171)
         if host is None or yata is None:
             return
 
@@ -652,6 +674,9 @@ class Admin(commands.Cog):
             admins = [discord_id for discord_id in v.get("admin", {}).get("server_admins", {})]
             contacts += admins
 
+        # get all YATA users
+        yata_users = await get_yata_users_bulk(discord_ids=[member.id for member in guild.members])
+
         # loop over member and toggle roles
         for member in guild.members:
 
@@ -662,12 +687,12 @@ class Admin(commands.Cog):
                 logging.info(f"[admin/assignRoles] {member.display_name} remove {host}")
                 await member.remove_roles(host)
 
-            is_yata = await get_yata_user(member.id, type="D")
-            if len(is_yata) and yata not in member.roles:
+            is_yata = member.id in yata_users
+            if is_yata and yata not in member.roles:
                 logging.info(f"[admin/assignRoles] {member.display_name} add {yata}")
                 await member.add_roles(yata)
 
-            elif not len(is_yata) and yata in member.roles:
+            elif not is_yata and yata in member.roles:
                 logging.info(f"[admin/assignRoles] {member.display_name} remove {yata}")
                 await member.remove_roles(yata)
 
@@ -18,12 +18,9 @@ This file is part of yata-bot.
 """
 
 # import standard modules
-import aiohttp
 import asyncio
-import asyncpg
 import json
 import re
-import os
 import html
 import logging
 
@@ -35,6 +32,9 @@ from discord.utils import get
 
 # import bot functions and classes
 from inc.yata_db import reset_notifications
+from inc.yata_db import set_notifications
+from inc.yata_db import connection
+from inc.ratelimit import BACKGROUND
 from inc.handy import *
 
 
@@ -61,10 +61,7 @@ class API(commands.Cog):
             return
 
         # make api call
-        url = f"https://api.torn.com/user/?selections=discord,weaponexp&key={key}"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as r:
-                req = await r.json()
+        req = await self.bot.torn.get("user", "", "discord,weaponexp", key)
 
         # handle API error
         if "error" in req:
@@ -114,10 +111,7 @@ class API(commands.Cog):
             return
 
         # make api call
-        url = f"https://api.torn.com/user/?selections=discord,personalstats&key={key}"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as r:
-                req = await r.json()
+        req = await self.bot.torn.get("user", "", "discord,personalstats", key)
 
         # handle API error
         if "error" in req:
@@ -163,10 +157,7 @@ class API(commands.Cog):
             return
 
         # make api call
-        url = f"https://api.torn.com/user/?selections=discord,networth&key={key}"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as r:
-                req = await r.json()
+        req = await self.bot.torn.get("user", "", "discord,networth", key)
 
         # handle API error
         if "error" in req:
@@ -250,10 +241,7 @@ class API(commands.Cog):
             return
 
         # Torn API call
-        url = f'https://api.torn.com/user/{tornId}?selections=profile,personalstats&key={key}'
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as r:
-                r = await r.json()
+        r = await self.bot.torn.get("user", tornId, "profile,personalstats", key)
 
         if 'error' in r:
             await ctx.send(f'Error code {r["error"]["code"]}: {r["error"]["error"]}')
@@ -327,216 +315,233 @@ class API(commands.Cog):
     async def notify(self):
         logging.debug("[api/notifications] start task")
 
+        if not self.bot.torn.available():
+            logging.debug("[api/notifications] Torn API unavailable, skip task")
+            return
+
         # main guild
-        guild = get(self.bot.guilds, id=self.bot.main_server_id)
+        guild = self.bot.get_guild(self.bot.main_server_id)
 
-        # connect to YATA database of notifiers
-        db_cred = json.loads(os.environ.get("DB_CREDENTIALS"))
-        dbname = db_cred["dbname"]
-        del db_cred["dbname"]
+        # get notifiers from YATA database
         sql = 'SELECT "tId", "dId", "notifications", "value" FROM player_view_player_key WHERE "activateNotifications" = True;'
-        con = await asyncpg.connect(database=dbname, **db_cred)
-
-        # async loop over notifiers
-        async with con.transaction():
-            async for record in con.cursor(sql, prefetch=100, timeout=2):
-                # get corresponding discord member
-                member = get(guild.members, id=record["dId"])
-                if member is None:
-                    logging.warning(f'[api/notifications] reset notifications for discord [{record["dId"]}] torn [{record["tId"]}]')
-                    # headers = {"error": "notifications", "discord": record["dId"], "torn": record["tId"]}
-                    # await self.bot.send_log_main("member not found", headers=headers)
-                    await reset_notifications(record["tId"])
+        async with connection() as con:
+            records = await con.fetch(sql, timeout=10)
+
+        # loop over notifiers (database written once at the end with what changed)
+        changed = []
+        resets = []
+        for record in records:
+            # get corresponding discord member
+            member = guild.get_member(record["dId"])
+            if member is None:
+                logging.warning(f'[api/notifications] reset notifications for discord [{record["dId"]}] torn [{record["tId"]}]')
+                # headers = {"error": "notifications", "discord": record["dId"], "torn": record["tId"]}
+                # await self.bot.send_log_main("member not found", headers=headers)
+                resets.append(record["tId"])
+                continue
+
+            try:
+
+                # get notifications preferences
+                logging.debug(f'[api/notifications] {member.nick} / {member}')
+                notifications = json.loads(record["notifications"])
+                previous = json.loads(record["notifications"])
+
+                if not await self._notify(member, notifications, record["value"]):
                     continue
 
-                try:
-
-                    # get notifications preferences
-                    logging.debug(f'[api/notifications] {member.nick} / {member}')
-                    notifications = json.loads(record["notifications"])
-
-                    # get selections for Torn API call
-                    keys = []
-                    if "event" in notifications:
-                        keys.append("events")
-                        keys.append("notifications")
-                    if "message" in notifications:
-                        keys.append("messages")
-                        keys.append("notifications")
-                    if "award" in notifications:
-                        keys.append("notifications")
-                    if "energy" in notifications:
-                        keys.append("bars")
-                    if "nerve" in notifications:
-                        keys.append("bars")
-                    if "chain" in notifications:
-                        keys.append("bars")
-                    if "education" in notifications:
-                        keys.append("education")
-                    if "bank" in notifications:
-                        keys.append("money")
-                    if "drug" in notifications:
-                        keys.append("cooldowns")
-                    if "medical" in notifications:
-                        keys.append("cooldowns")
-                    if "booster" in notifications:
-                        keys.append("cooldowns")
-                    if "travel" in notifications:
-                        keys.append("travel")
-
-                    # make Torn API call
-                    url = f'https://api.torn.com/user/?selections={",".join(list(set(keys)))}&key={record["value"]}'
-                    async with aiohttp.ClientSession() as session:
-                        async with session.get(url) as r:
-                            req = await r.json()
-
-                    if 'error' in req:
-                        logging.warning(f'[api/notifications] {member.nick} / {member} error in api payload: {req["error"]["code"]}: {req["error"]["error"]}')
-                        continue
-
-                    # notify event
-                    if "event" in notifications:
-                        if not req["notifications"]["events"]:
-                            notifications["event"] = dict({})
-                        else:
-                            # loop over events
-                            for k, v in req["events"].items():
-                                # if new event not notified -> notify
-                                if not v["seen"] and k not in notifications["event"]:
-                                    await member.send(cleanhtml(v["event"]).replace(" [View]", ""))
-                                    notifications["event"][k] = True
-
-                                # if seen even already notified -> clean table
-                                elif v["seen"] and k in notifications["event"]:
-                                    del notifications["event"][k]
-
-                    # notify message
-                    if "message" in notifications:
-                        if not req["notifications"]["messages"]:
-                            notifications["messages"] = dict({})
-                        else:
-                            # loop over messages
-                            for k, v in req["messages"].items():
-                                # if new event not notified -> notify
-                                if not v["seen"] and k not in notifications["message"]:
-                                    await member.send(f'New message from {v["name"]}: {v["title"]}')
-                                    notifications["message"][k] = True
-
-                                # if seen even already notified -> clean table
-                                elif v["seen"] and k in notifications["message"]:
-                                    del notifications["message"][k]
-
-                    # notify awards
-                    if "award" in notifications:
-                        if req["notifications"]["awards"]:
-                            # if new award or different number of awards
-                            if not notifications["award"].get("notified", False) or notifications["award"].get("notified") != req["notifications"]["awards"]:
-                                s = "s" if req["notifications"]["awards"] > 1 else ""
-                                await member.send(f'You have {req["notifications"]["awards"]} new award{s}')
-                                notifications["award"]["notified"] = req["notifications"]["awards"]
-
-                        else:
-                            notifications["award"] = dict({})
-
-                    # notify energy
-                    if "energy" in notifications:
-                        if req["energy"]["fulltime"] < 90:
-                            if not notifications["energy"].get("notified", False):
-                                await member.send(f'Energy at {req["energy"]["current"]} / {req["energy"]["maximum"]}')
-                            notifications["energy"]["notified"] = True
-
-                        else:
-                            notifications["energy"] = dict({})
-
-                    # notify nerve
-                    if "nerve" in notifications:
-                        if req["nerve"]["fulltime"] < 90:
-                            if not notifications["nerve"].get("notified", False):
-                                await member.send(f'Nerve at {req["nerve"]["current"]} / {req["nerve"]["maximum"]}')
-                            notifications["nerve"]["notified"] = True
-
-                        else:
-                            notifications["nerve"] = dict({})
-
-                    # notify chain
-                    if "chain" in notifications:
-                        if req["chain"]["timeout"] < 90 and req["chain"]["current"] > 10:
-                            if not notifications["chain"].get("notified", False):
-                                await member.send(f'Chain timeout in {req["chain"]["timeout"]} seconds')
-                            notifications["chain"]["notified"] = True
-
-                        else:
-                            notifications["chain"] = dict({})
-
-                    # notify education
-                    if "education" in notifications:
-                        if req["education_timeleft"] < 90:
-                            if not notifications["education"].get("notified", False):
-                                await member.send(f'Education ends in {req["education_timeleft"]} seconds')
-                            notifications["education"]["notified"] = True
-
-                        else:
-                            notifications["education"] = dict({})
-
-                    # notify bank
-                    if "bank" in notifications:
-                        if req["city_bank"]["time_left"] < 90:
-                            if not notifications["bank"].get("notified", False):
-                                await member.send(f'Bank investment ends in {req["city_bank"]["time_left"]} seconds (${req["city_bank"]["amount"]:,.0f})')
-                            notifications["bank"]["notified"] = True
-
-                        else:
-                            notifications["bank"] = dict({})
-
-                    # notify drug
-                    if "drug" in notifications:
-                        if req["cooldowns"]["drug"] < 90:
-                            if not notifications["drug"].get("notified", False):
-                                await member.send(f'Drug cooldown ends in {req["cooldowns"]["drug"]} seconds')
-                            notifications["drug"]["notified"] = True
-
-                        else:
-                            notifications["drug"] = dict({})
-
-                    # notify medical
-                    if "medical" in notifications:
-                        if req["cooldowns"]["medical"] < 90:
-                            if not notifications["medical"].get("notified", False):
-                                await member.send(f'Medical cooldown ends in {req["cooldowns"]["medical"]} seconds')
-                            notifications["medical"]["notified"] = True
-
-                        else:
-                            notifications["medical"] = dict({})
-
-                    # notify booster
-                    if "booster" in notifications:
-                        if req["cooldowns"]["booster"] < 90:
-                            if not notifications["booster"].get("notified", False):
-                                await member.send(f'Booster cooldown ends in {req["cooldowns"]["booster"]} seconds')
-                            notifications["booster"]["notified"] = True
-
-                        else:
-                            notifications["booster"] = dict({})
-
-                    # notify travel
-                    if "travel" in notifications:
-                        if req["travel"]["time_left"] < 90:
-                            if not notifications["travel"].get("destination", False):
-                                await member.send(f'Landing in {req["travel"]["destination"]} in {req["travel"]["time_left"]} seconds')
-                            notifications["travel"] = req["travel"]
-
-                        else:
-                            notifications["travel"] = dict({})
-
-                    # update notifications in YATA's database
-                    await con.execute('UPDATE player_player SET "notifications"=$1 WHERE "dId"=$2', json.dumps(notifications), member.id)
-
-                except BaseException as e:
-                    logging.error(f'[api/notifications] {member.nick} / {member}: {hide_key(e)}')
-                    # headers = {"guild": guild, "guild_id": guild.id, "member": f'{member.nick} / {member}', "error": "personal notification error"}
-                    # await self.bot.send_log_main(e, headers=headers, full=True)
-
-        await con.close()
+                # update notifications in YATA's database if changed
+                if notifications != previous:
+                    changed.append((member.id, notifications))
+
+            except BaseException as e:
+                logging.error(f'[api/notifications] {member.nick} / {member}: {hide_key(e)}')
+                # headers = {"guild": guild, "guild_id": guild.id, "member": f'{member.nick} / {member}', "error": "personal notification error"}
+                # await self.bot.send_log_main(e, headers=headers, full=True)
+
+        logging.debug(f'[api/notifications] {len(records)} notifiers: {len(changed)} changed, {len(resets)} reset')
+        await set_notifications(changed)
+        await reset_notifications(resets)
+
+    async def _notify(self, member, notifications, key):
+        """ sends the personal notifications of a member
+            - notifications: notifications preferences (updated with what has been notified)
+            - key: API key of the member
+
+            return: False on API error (notifications unchanged), True otherwise
+        """
+
+        # get selections for Torn API call
+        keys = []
+        if "event" in notifications:
+            keys.append("events")
+            keys.append("notifications")
+        if "message" in notifications:
+            keys.append("messages")
+            keys.append("notifications")
+        if "award" in notifications:
+            keys.append("notifications")
+        if "energy" in notifications:
+            keys.append("bars")
+        if "nerve" in notifications:
+            keys.append("bars")
+        if "chain" in notifications:
+            keys.append("bars")
+        if "education" in notifications:
+            keys.append("education")
+        if "bank" in notifications:
+            keys.append("money")
+        if "drug" in notifications:
+            keys.append("cooldowns")
+        if "medical" in notifications:
+            keys.append("cooldowns")
+        if "booster" in notifications:
+            keys.append("cooldowns")
+        if "travel" in notifications:
+            keys.append("travel")
+
+        # make Torn API call
+        req = await self.bot.torn.get("user", "", list(set(keys)), key, priority=BACKGROUND)
+
+        if 'error' in req:
+            logging.warning(f'[api/notifications] {member.nick} / {member} error in api payload: {req["error"]["code"]}: {req["error"]["error"]}')
+            return False
+
+        # notify event
+        if "event" in notifications:
+            if not req["notifications"]["events"]:
+                notifications["event"] = dict({})
+            else:
+                # loop over events
+                for k, v in req["events"].items():
+                    # if new event not notified -> notify
+                    if not v["seen"] and k not in notifications["event"]:
+                        await member.send(cleanhtml(v["event"]).replace(" [View]", ""))
+                        notifications["event"][k] = True
+
+                    # if seen even already notified -> clean table
+                    elif v["seen"] and k in notifications["event"]:
+                        del notifications["event"][k]
+
+        # notify message
+        if "message" in notifications:
+            if not req["notifications"]["messages"]:
+                notifications["messages"] = dict({})
+            else:
+                # loop over messages
+                for k, v in req["messages"].items():
+                    # if new event not notified -> notify
+                    if not v["seen"] and k not in notifications["message"]:
+                        await member.send(f'New message from {v["name"]}: {v["title"]}')
+                        notifications["message"][k] = True
+
+                    # if seen even already notified -> clean table
+                    elif v["seen"] and k in notifications["message"]:
+                        del notifications["message"][k]
+
+        # notify awards
+        if "award" in notifications:
+            if req["notifications"]["awards"]:
+                # if new award or different number of awards
+                if not notifications["award"].get("notified", False) or notifications["award"].get("notified") != req["notifications"]["awards"]:
+                    s = "s" if req["notifications"]["awards"] > 1 else ""
+                    await member.send(f'You have {req["notifications"]["awards"]} new award{s}')
+                    notifications["award"]["notified"] = req["notifications"]["awards"]
+
+            else:
+                notifications["award"] = dict({})
+
+        # notify energy
+        if "energy" in notifications:
+            if req["energy"]["fulltime"] < 90:
+                if not notifications["energy"].get("notified", False):
+                    await member.send(f'Energy at {req["energy"]["current"]} / {req["energy"]["maximum"]}')
+                notifications["energy"]["notified"] = True
+
+            else:
+                notifications["energy"] = dict({})
+
+        # notify nerve
+        if "nerve" in notifications:
+            if req["nerve"]["fulltime"] < 90:
+                if not notifications["nerve"].get("notified", False):
+                    await member.send(f'Nerve at {req["nerve"]["current"]} / {req["nerve"]["maximum"]}')
+                notifications["nerve"]["notified"] = True
+
+            else:
+                notifications["nerve"] = dict({})
+
+        # notify chain
+        if "chain" in notifications:
+            if req["chain"]["timeout"] < 90 and req["chain"]["current"] > 10:
+                if not notifications["chain"].get("notified", False):
+                    await member.send(f'Chain timeout in {req["chain"]["timeout"]} seconds')
+                notifications["chain"]["notified"] = True
+
+            else:
+                notifications["chain"] = dict({})
+
+        # notify education
+        if "education" in notifications:
+            if req["education_timeleft"] < 90:
+                if not notifications["education"].get("notified", False):
+                    await member.send(f'Education ends in {req["education_timeleft"]} seconds')
+                notifications["education"]["notified"] = True
+
+            else:
+                notifications["education"] = dict({})
+
+        # notify bank
+        if "bank" in notifications:
+            if req["city_bank"]["time_left"] < 90:
+                if not notifications["bank"].get("notified", False):
+                    await member.send(f'Bank investment ends in {req["city_bank"]["time_left"]} seconds (${req["city_bank"]["amount"]:,.0f})')
+                notifications["bank"]["notified"] = True
+
+            else:
+                notifications["bank"] = dict({})
+
+        # notify drug
+        if "drug" in notifications:
+            if req["cooldowns"]["drug"] < 90:
+                if not notifications["drug"].get("notified", False):
+                    await member.send(f'Drug cooldown ends in {req["cooldowns"]["drug"]} seconds')
+                notifications["drug"]["notified"] = True
+
+            else:
+                notifications["drug"] = dict({})
+
+        # notify medical
+        if "medical" in notifications:
+            if req["cooldowns"]["medical"] < 90:
+                if not notifications["medical"].get("notified", False):
+                    await member.send(f'Medical cooldown ends in {req["cooldowns"]["medical"]} seconds')
+                notifications["medical"]["notified"] = True
+
+            else:
+                notifications["medical"] = dict({})
+
+        # notify booster
+        if "booster" in notifications:
+            if req["cooldowns"]["booster"] < 90:
+                if not notifications["booster"].get("notified", False):
+                    await member.send(f'Booster cooldown ends in {req["cooldowns"]["booster"]} seconds')
+                notifications["booster"]["notified"] = True
+
+            else:
+                notifications["booster"] = dict({})
+
+        # notify travel
+        if "travel" in notifications:
+            if req["travel"]["time_left"] < 90:
+                if not notifications["travel"].get("destination", False):
+                    await member.send(f'Landing in {req["travel"]["destination"]} in {req["travel"]["time_left"]} seconds')
+                notifications["travel"] = req["travel"]
+
+            else:
+                notifications["travel"] = dict({})
+
+        return True
 
     @notify.before_loop
     async def before_notify(self):
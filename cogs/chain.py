@@ -19,7 +19,6 @@ This file is part of yata-bot.
 
 # import standard modules
 import asyncio
-import aiohttp
 import datetime
 import json
 import re
@@ -33,7 +32,10 @@ from discord.ext import tasks
 from discord import Embed
 
 # import bot functions and classes
-from inc.yata_db import set_configuration
+from inc.torn_api import ERROR_SHED
+from inc.torn_api import ERROR_CIRCUIT
+from inc.torn_api import ERROR_TIMEOUT
+from inc.ratelimit import BACKGROUND
 from inc.handy import *
 
 
@@ -88,16 +90,7 @@ class Chain(commands.Cog):
         if status < 0:
             return
 
-        url = f'https://api.torn.com/faction/{faction}?selections=basic,chain&key={key}'
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as r:
-                try:
-                    req = await r.json()
-                except BaseException:
-                    req = {'error': {'error': 'API is talking shit... #blameched', 'code': -1}}
-
-        if not isinstance(req, dict):
-            req = {'error': {'error': 'API is talking shit... #blameched', 'code': -1}}
+        req = await self.bot.torn.get("faction", faction, "basic,chain", key)
 
         # handle API error
         if 'error' in req:
@@ -122,6 +115,9 @@ class Chain(commands.Cog):
             await ctx.send(f":chains: `{factionName}` Start watching")
         else:
             await ctx.send(f":chains: `{factionName}` Start watching. Will notify {role} on timeout.")
+        # public payload: the hedged calls use a master key (picked once for the whole watch)
+        _, _, master_key = await self.bot.get_master_key(ctx.guild)
+
         lastNotified = datetime.datetime(1970, 1, 1, 0, 0, 0)
         while True:
 
@@ -144,16 +140,13 @@ class Chain(commands.Cog):
             if status < 0:
                 return
 
-            url = f'https://api.torn.com/faction/{fId}?selections=chain,timestamp&key={key}'
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as r:
-                    try:
-                        req = await r.json()
-                    except BaseException:
-                        req = {'error': {'error': 'API is talking shit... #blameched', 'code': -1}}
+            req = await self.bot.torn.get("faction", fId, "chain,timestamp", key, timeout=15, hedge=True, hedge_key=master_key)
 
-            if not isinstance(req, dict):
-                req = {'error': {'error': 'API is talking shit... #blameched', 'code': -1}}
+            # slow API, rate limited key or API down: try again on next poll
+            if 'error' in req and req["error"]["code"] in [ERROR_TIMEOUT, ERROR_SHED, ERROR_CIRCUIT]:
+                logging.debug(f"[chain/chain] {ctx.guild} {req['error']['error']}")
+                await asyncio.sleep(30)
+                continue
 
             # handle API error
             if 'error' in req:
@@ -262,10 +255,7 @@ class Chain(commands.Cog):
             return
 
         # Torn API call
-        url = f'https://api.torn.com/faction/{factionId}?selections=basic&key={key}'
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as r:
-                r = await r.json()
+        r = await self.bot.torn.get("faction", factionId, "basic", key)
 
         if 'error' in r:
             await ctx.send(f'Error code {r["error"]["code"]}: {r["error"]["error"]}')
@@ -328,10 +318,7 @@ class Chain(commands.Cog):
             return
 
         # Torn API call
-        url = f'https://api.torn.com/faction/{factionId}?selections=basic&key={key}'
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as r:
-                r = await r.json()
+        r = await self.bot.torn.get("faction", factionId, "basic", key)
 
         if 'error' in r:
             await ctx.send(f':x: Error code {r["error"]["code"]}: {r["error"]["error"]}')
@@ -391,10 +378,7 @@ class Chain(commands.Cog):
             return
 
         # Torn API call
-        url = f'https://api.torn.com/faction/{factionId}?selections=basic&key={key}'
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as r:
-                r = await r.json()
+        r = await self.bot.torn.get("faction", factionId, "basic", key)
 
         if 'error' in r:
             await ctx.send(f':x: Error code {r["error"]["code"]}: {r["error"]["error"]}')
@@ -447,16 +431,7 @@ class Chain(commands.Cog):
         if status != 0:
             return
 
-        url = f'https://api.torn.com/faction/?selections=basic,donations&key={key}'
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as r:
-                try:
-                    req = await r.json()
-                except BaseException:
-                    req = {'error': {'error': 'API is talking shit... #blameched', 'code': -1}}
-
-        if not isinstance(req, dict):
-            req = {'error': {'error': 'API is talking shit... #blameched', 'code': -1}}
+        req = await self.bot.torn.get("faction", "", "basic,donations", key)
 
         if 'error' in req:
             await ctx.send(f':x: Error code {req["error"]["code"]}: {req["error"]["error"]}')
@@ -516,7 +491,7 @@ class Chain(commands.Cog):
             lst += ['', '<STOP>', "```"]
             await ctx.channel.send("\n".join(lst))
             del self.bot.configurations[ctx.guild.id]["chain"]["currents"][str(ctx.author.id)]
-            await set_configuration(self.bot.bot_id, ctx.guild.id, ctx.guild.name, self.bot.configurations[ctx.guild.id])
+            self.bot.save_configuration(ctx.guild, ["chain", "currents", str(ctx.author.id)])
             return
 
         current = {"channel": [str(ctx.channel.id), f'{ctx.channel.name}', '#'],
@@ -532,7 +507,7 @@ class Chain(commands.Cog):
 
         # get role
         if len(args) and args[0].replace("<@&", "").replace(">", "").isdigit():
-            role = get(ctx.guild.roles, id=int(int(args[0].replace("<@&", "").replace(">", ""))))
+            role = ctx.guild.get_role(int(int(args[0].replace("<@&", "").replace(">", ""))))
         else:
             role = None
 
@@ -545,19 +520,19 @@ class Chain(commands.Cog):
         lst += ['', '<START>', "```"]
         await ctx.channel.send("\n".join(lst))
         self.bot.configurations[ctx.guild.id]["chain"]["currents"][str(ctx.author.id)] = current
-        await set_configuration(self.bot.bot_id, ctx.guild.id, ctx.guild.name, self.bot.configurations[ctx.guild.id])
+        self.bot.save_configuration(ctx.guild, ["chain", "currents", str(ctx.author.id)])
 
     async def _retal(self, guild, retal):
 
         # get channel
         channelId = retal.get("channel")[0] if len(retal.get("channel", {})) else None
-        channel = get(guild.channels, id=int(channelId))
+        channel = guild.get_channel(int(channelId))
         if channel is None:
             return False
 
         # get discord member
         discord_id = retal.get("discord_user")[0] if len(retal.get("discord_user", {})) else "0"
-        discord_member = get(guild.members, id=int(discord_id))
+        discord_member = guild.get_member(int(discord_id))
         if discord_member is None:
             await channel.send(f'```md\n# Tracking retals\n< error > discord member {discord_member} not found\n\n<STOP>```')
             return False
@@ -580,16 +555,15 @@ class Chain(commands.Cog):
         roleId = retal.get("role")[0] if len(retal.get("role", {})) else None
         notified = " " if roleId is None else f" <@&{roleId}> "
 
-        url = f'https://api.torn.com/faction/?selections=basic,attacks&key={key}'
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as r:
-                req = await r.json()
-
-        if not isinstance(req, dict):
-            req = {'error': {'error': 'API is talking shit... #blameched', 'code': -1}}
+        # private payload: the hedged call uses the same key
+        req = await self.bot.torn.get("faction", "", "basic,attacks", key, priority=BACKGROUND, timeout=30, hedge=True)
 
         # handle API error
         if 'error' in req:
+            if req["error"]["code"] in [ERROR_SHED, ERROR_CIRCUIT, ERROR_TIMEOUT]:
+                # skip this tick silently
+                return True
+
             lst = [f'```md', f'# Tracking retals\n< error > Problem with {name} [{tornId}]\'s key: {req["error"]["error"]}']
             if req["error"]["code"] in [7]:
                 lst.append("It means that you don't have the required AA permission (AA for API access) for this API request")
@@ -676,6 +650,10 @@ class Chain(commands.Cog):
     async def retalTask(self):
         logging.debug("[chain/retal-notifications] start task")
 
+        if not self.bot.torn.available():
+            logging.debug("[chain/retal-notifications] Torn API unavailable, skip task")
+            return
+
         # iteration over all guilds
         for guild in self.bot.get_guilds_by_module("chain"):
             try:
@@ -706,14 +684,15 @@ class Chain(commands.Cog):
                 changes = False
                 for d in todel:
                     del self.bot.configurations[guild.id]["chain"]["currents"][d]
+                    self.bot.save_configuration(guild, ["chain", "currents", d])
                     changes = True
 
                 for discord_user_id, retal in tochange.items():
                     self.bot.configurations[guild.id]["chain"]["currents"][discord_user_id] = retal
+                    self.bot.save_configuration(guild, ["chain", "currents", discord_user_id])
                     changes = True
 
                 if changes:
-                    await set_configuration(self.bot.bot_id, guild.id, guild.name, self.bot.configurations[guild.id])
                     logging.debug(f"[chain/retal-notifications] push notifications for {guild}")
                 else:
                     logging.debug(f"[chain/retal-notifications] don't push notifications for {guild}")
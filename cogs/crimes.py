@@ -19,7 +19,6 @@ This file is part of yata-bot.
 
 # import standard modules
 import asyncio
-import aiohttp
 import datetime
 import json
 import re
@@ -32,7 +31,10 @@ from discord.utils import get
 from discord.ext import tasks
 
 # import bot functions and classes
-from inc.yata_db import set_configuration
+from inc.torn_api import ERROR_SHED
+from inc.torn_api import ERROR_CIRCUIT
+from inc.torn_api import ERROR_TIMEOUT
+from inc.ratelimit import BACKGROUND
 from inc.handy import *
 
 
@@ -68,16 +70,7 @@ class Crimes(commands.Cog):
             return
 
         # make api call
-        url = f"https://api.torn.com/faction/?selections=basic,crimes&key={key}"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as r:
-                try:
-                    req = await r.json()
-                except BaseException:
-                    req = {'error': {'error': 'API is talking shit... #blameched', 'code': -1}}
-
-        if not isinstance(req, dict):
-            req = {'error': {'error': 'API is talking shit... #blameched', 'code': -1}}
+        req = await self.bot.torn.get("faction", "", "basic,crimes", key)
 
         # handle API error
         if "error" in req:
@@ -132,7 +125,7 @@ class Crimes(commands.Cog):
             lst += ['', '<STOP>', "```"]
             await ctx.channel.send("\n".join(lst))
             del self.bot.configurations[ctx.guild.id]["oc"]["currents"][str(ctx.author.id)]
-            await set_configuration(self.bot.bot_id, ctx.guild.id, ctx.guild.name, self.bot.configurations[ctx.guild.id])
+            self.bot.save_configuration(ctx.guild, ["oc", "currents", str(ctx.author.id)])
             return
 
         current = {"channel": [str(ctx.channel.id), f'{ctx.channel.name}', '#'],
@@ -148,7 +141,7 @@ class Crimes(commands.Cog):
 
         # get role
         if len(args) and args[0].replace("<@&", "").replace(">", "").isdigit():
-            role = get(ctx.guild.roles, id=int(int(args[0].replace("<@&", "").replace(">", ""))))
+            role = ctx.guild.get_role(int(int(args[0].replace("<@&", "").replace(">", ""))))
         else:
             role = None
 
@@ -161,19 +154,19 @@ class Crimes(commands.Cog):
         lst += ['', '<START>', "```"]
         await ctx.channel.send("\n".join(lst))
         self.bot.configurations[ctx.guild.id]["oc"]["currents"][str(ctx.author.id)] = current
-        await set_configuration(self.bot.bot_id, ctx.guild.id, ctx.guild.name, self.bot.configurations[ctx.guild.id])
+        self.bot.save_configuration(ctx.guild, ["oc", "currents", str(ctx.author.id)])
 
     async def _oc(self, guild, oc):
 
         # get channel
         channelId = oc.get("channel")[0] if len(oc.get("channel", {})) else None
-        channel = get(guild.channels, id=int(channelId))
+        channel = guild.get_channel(int(channelId))
         if channel is None:
             return False
 
         # get discord member
         discord_id = oc.get("discord_user")[0] if len(oc.get("discord_user", {})) else "0"
-        discord_member = get(guild.members, id=int(discord_id))
+        discord_member = guild.get_member(int(discord_id))
         if discord_member is None:
             await channel.send(f'```md\n# Tracking organized crimes\n< error > discord member {discord_member} not found\n\n<STOP>```')
             return False
@@ -196,19 +189,14 @@ class Crimes(commands.Cog):
         roleId = oc.get("role")[0] if len(oc.get("role", {})) else None
         notified = "**OC Tracking**\n" if roleId is None else f"<@&{roleId}>\n"
 
-        url = f'https://api.torn.com/faction/?selections=basic,crimes&key={key}'
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as r:
-                try:
-                    req = await r.json()
-                except BaseException:
-                    req = {'error': {'error': 'API is talking shit... #blameched', 'code': -1}}
-
-        if not isinstance(req, dict):
-            req = {'error': {'error': 'API is talking shit... #blameched', 'code': -1}}
+        req = await self.bot.torn.get("faction", "", "basic,crimes", key, priority=BACKGROUND, timeout=60)
 
         # handle API error
         if 'error' in req:
+            if req["error"]["code"] in [ERROR_SHED, ERROR_CIRCUIT, ERROR_TIMEOUT]:
+                # skip this tick silently
+                return True
+
             lst = [f'```md', f'# Tracking organized crimes\n< error > Problem with {name} [{tornId}]\'s key: {req["error"]["error"]}']
             if req["error"]["code"] in [7]:
                 lst.append("It means that you don't have the required AA permission (AA for API access) for this API request")
@@ -319,6 +307,10 @@ class Crimes(commands.Cog):
     async def ocTask(self):
         logging.debug(f"[oc/notifications] start task")
 
+        if not self.bot.torn.available():
+            logging.debug(f"[oc/notifications] Torn API unavailable, skip task")
+            return
+
         # iteration over all guilds
         for guild in self.bot.get_guilds_by_module("oc"):
             try:
@@ -349,15 +341,16 @@ class Crimes(commands.Cog):
                 for d in todel:
                     logging.debug(f"[oc/notifications] <{guild}> delete current {d}")
                     del self.bot.configurations[guild.id]["oc"]["currents"][d]
+                    self.bot.save_configuration(guild, ["oc", "currents", d])
                     changes = True
 
                 for discord_user_id, oc in tochange.items():
                     logging.debug(f"[oc/notifications] <{guild}> change current {discord_user_id}")
                     self.bot.configurations[guild.id]["oc"]["currents"][discord_user_id] = oc
+                    self.bot.save_configuration(guild, ["oc", "currents", discord_user_id])
                     changes = True
 
                 if changes:
-                    await set_configuration(self.bot.bot_id, guild.id, guild.name, self.bot.configurations[guild.id])
                     logging.debug(f"[oc/notifications] <{guild}> push notifications")
                 else:
                     logging.debug(f"[oc/notifications] <{guild}> don't push notifications")
@@ -19,7 +19,6 @@ This file is part of yata-bot.
 
 # import standard modules
 import asyncio
-import aiohttp
 import time
 import datetime
 import json
@@ -70,13 +69,7 @@ class Loot(commands.Cog):
         msg = [f'NPC report of {ts_to_datetime(now).strftime("%y/%m/%d %H:%M:%S")} TCT for {ctx.author.display_name}\n']
 
         # YATA api
-        url = "https://yata.alwaysdata.net/loot/timings/"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as r:
-                try:
-                    req = await r.json()
-                except BaseException:
-                    req = {'error': {'error': 'YATA\'s API is talking shit... #blamekivou', 'code': -1}}
+        req = await self.bot.torn.yata("/loot/timings/")
 
         if 'error' in req:
             await ctx.send("```ARM\nError code {}\n{}```Have a look a the timings here: https://yata.alwaysdata.net/loot/".format(req['error']['code'], req['error']['error']))
@@ -109,6 +102,10 @@ class Loot(commands.Cog):
     async def notify(self):
         logging.debug("[loot/notifications] start task")
 
+        if not self.bot.torn.available("yata"):
+            logging.debug("[loot/notifications] YATA API unavailable, skip task")
+            return
+
         # images and items
         thumbs = {
             '4': "https://yata.alwaysdata.net/static/images/loot/npc_4.png",
@@ -122,11 +119,11 @@ class Loot(commands.Cog):
             '15': ["Nock Gun", "Beretta Pico", "Riding Crop", "Sand"],
             '19': ["Bread Knife"]}
 
-        # YATA api
-        url = "https://yata.alwaysdata.net/loot/timings/"
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as r:
-                req = await r.json()
+        # YATA api (called every 5s)
+        req = await self.bot.torn.yata("/loot/timings/", timeout=5)
+        if 'error' in req:
+            logging.warning(f'[loot/notifications] error {req["error"]["code"]}: {req["error"]["error"]}')
+            return
 
         # loop over NPCs
         mentions = []
@@ -180,8 +177,8 @@ class Loot(commands.Cog):
                     continue
 
                 # get role & channel
-                role = self.bot.get_module_role(guild.roles, config.get("roles_alerts", {}))
-                channel = self.bot.get_module_channel(guild.channels, config.get("channels_alerts", {}))
+                role = self.bot.get_guild_module_role(guild, "loot", "roles_alerts")
+                channel = self.bot.get_guild_module_channel(guild, "loot", "channels_alerts")
 
                 if channel is None:
                     continue
@@ -19,7 +19,6 @@ This file is part of yata-bot.
 
 # import standard modules
 import asyncio
-import aiohttp
 import datetime
 import json
 import re
@@ -35,7 +34,8 @@ from discord import Embed
 # import bot functions and classes
 from inc.yata_db import get_data
 from inc.yata_db import push_data
-from inc.yata_db import get_faction_name
+from inc.yata_db import get_faction_names
+from inc.ratelimit import BACKGROUND
 from inc.handy import *
 
 
@@ -51,26 +51,32 @@ class Racket(commands.Cog):
     async def racketsTask(self):
         logging.debug("[racket/notifications] start task")
 
+        if not self.bot.torn.available():
+            logging.debug("[racket/notifications] Torn API unavailable, skip task")
+            return
+
         guild = self.bot.get_guild(self.bot.main_server_id)
         _, _, key = await self.bot.get_master_key(guild)
-        url = f'https://api.torn.com/torn/?selections=rackets,territory,timestamp&key={key}'
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url) as r:
-                try:
-                    req = await r.json()
-                except BaseException:
-                    req = {'error': {'error': 'API is talking shit... #blameched', 'code': -1}}
-
-        if not isinstance(req, dict):
-            req = {'error': {'error': 'API is talking shit... #blameched', 'code': -1}}
+        req = await self.bot.torn.get("torn", "", "rackets,territory,timestamp", key, priority=BACKGROUND)
 
         if "error" in req:
             return
 
-        timestamp_p, randt_p = get_data(self.bot.bot_id, "rackets")
+        timestamp_p, randt_p = await get_data(self.bot.bot_id, "rackets")
         rackets_p = randt_p["rackets"]
         territory_p = randt_p["territory"]
 
+        # get the names of all the factions in one query
+        factions = []
+        for k, v in req["rackets"].items():
+            if k not in rackets_p or v["level"] != rackets_p[k]["level"]:
+                factions += [v["faction"], v["war"]["assaulting_faction"]] if v.get("war", False) else [v["faction"]]
+        factions += [v["faction"] for k, v in rackets_p.items() if k not in req["rackets"]]
+        for k, v in req["territory"].items():
+            if v.get("war", False) and v.get("racket", False) and not territory_p[k].get("war", False):
+                factions += [v["faction"], v["war"]["assaulting_faction"]]
+        factions_names = await get_faction_names(factions)
+
         tsnow = int(req["timestamp"])
         mentions = []
         for k, v in req["rackets"].items():
@@ -86,7 +92,7 @@ class Racket(commands.Cog):
                 color = 550000
 
             if title:
-                factionO = await get_faction_name(v["faction"])
+                factionO = factions_names[v["faction"]]
                 embed = Embed(title=title, description=f'[{v["name"]} at {k}](https://www.torn.com/city.php#terrName={k})', color=color)
 
                 embed.add_field(name='Reward', value=f'{v["reward"]}')
@@ -96,7 +102,7 @@ class Racket(commands.Cog):
                 embed.add_field(name='Owner', value=f'[{html.unescape(factionO)}](https://www.torn.com/factions.php?step=profile&ID={v["faction"]})')
                 if war:
                     warId = v["war"]["assaulting_faction"]
-                    factionA = await get_faction_name(warId)
+                    factionA = factions_names[warId]
                     embed.add_field(name='Assaulting', value=f'[{html.unescape(factionA)}](https://www.torn.com/factions.php?step=profile&ID={warId})')
 
                 embed.set_thumbnail(url=f'https://yata.alwaysdata.net/static/images/citymap/territories/50x50/{k}.png')
@@ -107,7 +113,7 @@ class Racket(commands.Cog):
         for k, v in rackets_p.items():
             if k not in req["rackets"]:
                 color = 550000
-                factionO = await get_faction_name(v["faction"])
+                factionO = factions_names[v["faction"]]
                 embed = Embed(title=f'Racket vanished', description=f'[{v["name"]} at {k}](https://www.torn.com/city.php#terrName={k})', color=color)
                 embed.add_field(name='Reward', value=f'{v["reward"]}')
                 embed.add_field(name='Territory', value=f'{k}')
@@ -131,8 +137,8 @@ class Racket(commands.Cog):
 
             # New war
             if not territory_p[k].get("war", False):
-                factionO = await get_faction_name(v["faction"])
-                factionA = await get_faction_name(v["war"]["assaulting_faction"])
+                factionO = factions_names[v["faction"]]
+                factionA = factions_names[v["war"]["assaulting_faction"]]
                 color = 550000
                 title = f'New war for a {racket["name"]}'
                 embed = Embed(title=title, description=f'[{racket["name"]} at {k}](https://www.torn.com/city.php#terrName={k})', color=color)
@@ -174,8 +180,8 @@ class Racket(commands.Cog):
                     continue
 
                 # get role & channel
-                role = self.bot.get_module_role(guild.roles, config.get("roles_alerts", {}))
-                channel = self.bot.get_module_channel(guild.channels, config.get("channels_alerts", {}))
+                role = self.bot.get_guild_module_role(guild, "rackets", "roles_alerts")
+                channel = self.bot.get_guild_module_channel(guild, "rackets", "channels_alerts")
 
                 if channel is None:
                     continue
@@ -19,7 +19,6 @@ This file is part of yata-bot.
 
 # import standard modules
 import asyncio
-import aiohttp
 # import datetime
 # import json
 import logging
@@ -87,12 +86,10 @@ class Revive(commands.Cog):
             else:
                 tornId = id
 
+        req = {}
         if key is not None:
             # api call to get potential status and faction
-            url = f'https://api.torn.com/user/{tornId}?key={key}'
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as r:
-                    req = await r.json()
+            req = await self.bot.torn.get("user", tornId, "", key)
 
             # handle API error
             if 'error' in req:
@@ -124,9 +121,9 @@ class Revive(commands.Cog):
             m = await ctx.send(f'{msg}')
             msgList.append([m, ctx.channel])
         msg = "\n".join(lst)
-        role = self.bot.get_module_role(ctx.guild.roles, config.get("roles_alerts", {}))
+        role = self.bot.get_guild_module_role(ctx.guild, "revive", "roles_alerts")
         mention = '' if role is None else f'{role.mention} '
-        alert_channel = self.bot.get_module_channel(ctx.guild.channels, config.get("channels_alerts", {}))
+        alert_channel = self.bot.get_guild_module_channel(ctx.guild, "revive", "channels_alerts")
         if alert_channel is None:
             m = await ctx.send(f'{mention}{msg}')
         else:
@@ -137,7 +134,7 @@ class Revive(commands.Cog):
         for id in config.get("sending", []):
             try:
                 # get remote server coonfig
-                remote_guild = get(self.bot.guilds, id=int(id))
+                remote_guild = self.bot.get_guild(int(id))
                 logging.debug(f'[revive/revive] Sending call: {ctx.guild} -> {remote_guild}')
                 remote_config = self.bot.get_guild_configuration_by_module(remote_guild, "revive")
 
@@ -146,8 +143,8 @@ class Revive(commands.Cog):
                     msgList.append([m, ctx.channel])
                 else:
                     # get guild, role and channel
-                    remote_role = self.bot.get_module_role(remote_guild.roles, remote_config.get("roles_alerts", {}))
-                    remote_channel = self.bot.get_module_channel(remote_guild.channels, remote_config.get("channels_alerts", {}))
+                    remote_role = self.bot.get_guild_module_role(remote_guild, "revive", "roles_alerts")
+                    remote_channel = self.bot.get_guild_module_channel(remote_guild, "revive", "channels_alerts")
                     mention = '' if remote_role is None else f'{remote_role.mention} '
                     if remote_channel is not None:
                         m = await remote_channel.send('{}{}\n*{}*'.format(mention, msg, sendFrom))
@@ -31,8 +31,10 @@ from discord.utils import get
 from discord.ext import tasks
 
 # import bot functions and classes
-from inc.yata_db import set_configuration
-from inc.yata_db import get_faction_name
+from inc.yata_db import get_faction_names
+from inc.yata_db import get_yata_users_bulk
+from inc.ratelimit import INTERACTIVE
+from inc.ratelimit import BACKGROUND
 from inc.handy import *
 
 
@@ -70,13 +72,13 @@ class Verify(commands.Cog):
             return
 
         # verify member when he join
-        role = self.bot.get_module_role(member.guild.roles, config.get("roles_verified", {}))
+        role = self.bot.get_guild_module_role(member.guild, "verify", "roles_verified")
         if role is None:
             return
         message, success = await self._member(member, role, discordID=member.id, API_KEY=key, context=False)
 
         # send message to welcome channel
-        channel = self.bot.get_module_channel(member.guild.channels, config.get("channels_welcome", {}))
+        channel = self.bot.get_guild_module_channel(member.guild, "verify", "channels_welcome")
         if channel is None:
             return
         await channel.send(f'```md\n# Verify\n {message}```')
@@ -118,7 +120,7 @@ class Verify(commands.Cog):
             return
 
         # Get Verified role
-        role = self.bot.get_module_role(ctx.guild.roles, config.get("roles_verified", {}))
+        role = self.bot.get_guild_module_role(ctx.guild, "verify", "roles_verified")
         if role is None:
             await ctx.send('```md\n# verify\n< error > No verified role given```')
             return
@@ -291,9 +293,10 @@ class Verify(commands.Cog):
 
         await self._loop_check(ctx.guild, ctx.channel, ctx=ctx, force=force)
 
-    async def _member(self, ctx, verified_role, userID=None, discordID=None, API_KEY="", context=True):
+    async def _member(self, ctx, verified_role, userID=None, discordID=None, API_KEY="", context=True, priority=INTERACTIVE, memberID=None):
         """ Verifies one member
             Returns what the bot should say
+            memberID: discord id of the member when userID comes from YATA (Torn's discord id has to match)
         """
         try:
 
@@ -328,16 +331,7 @@ class Verify(commands.Cog):
             # case no userID and no discordID is given (author verify itself)
             if author_verif:
                 author = ctx.author
-                url = f"https://api.torn.com/user/{author.id}?selections=discord&key={API_KEY}"
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url) as r:
-                        try:
-                            req = await r.json()
-                        except BaseException:
-                            req = {'error': {'error': 'API is talking shit... #blameched', 'code': -1}}
-
-                if not isinstance(req, dict):
-                    req = {'error': {'error': 'API is talking shit... #blameched', 'code': -1}}
+                req = await self.bot.torn.get("user", author.id, "discord", API_KEY, priority=priority)
 
                 if 'error' in req:
                     return "< error > There is an API key problem ({}).".format(req['error']['error']), False
@@ -348,16 +342,7 @@ class Verify(commands.Cog):
             # case discordID is given
             # if discordID is not None and userID is None:  # use this condition to skip API call if userID is given
             if discordID is not None:  # use this condition to force API call to check userID even if it is given
-                url = f"https://api.torn.com/user/{discordID}?selections=discord&key={API_KEY}"
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url) as r:
-                        try:
-                            req = await r.json()
-                        except BaseException:
-                            req = {'error': {'error': 'API is talking shit... #blameched', 'code': -1}}
-
-                if not isinstance(req, dict):
-                    req = {'error': {'error': 'API is talking shit... #blameched', 'code': -1}}
+                req = await self.bot.torn.get("user", discordID, "discord", API_KEY, priority=priority)
 
                 if 'error' in req:
                     return ":x: There is an API key problem ({}).".format(req['error']['error']), False
@@ -369,16 +354,7 @@ class Verify(commands.Cog):
             logging.info(f"[verify/_member] verifying userID = {userID}")
 
             # api call request
-            url = f"https://api.torn.com/user/{userID}?selections=profile,discord&key={API_KEY}"
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as r:
-                    try:
-                        req = await r.json()
-                    except BaseException:
-                        req = {'error': {'error': 'API is talking shit... #blameched', 'code': -1}}
-
-            if not isinstance(req, dict):
-                req = {'error': {'error': 'API is talking shit... #blameched', 'code': -1}}
+            req = await self.bot.torn.get("user", userID, "profile,discord", API_KEY, priority=priority)
 
             # check api error
             if 'error' in req:
@@ -394,6 +370,10 @@ class Verify(commands.Cog):
 
             # check if registered in torn discord
             discordID = None if dis.get("discordID") in [''] else int(dis.get("discordID"))
+
+            # torn id given by YATA for another discord account: ask Torn who the member is
+            if memberID is not None and discordID != int(memberID):
+                return await self._member(ctx, verified_role, discordID=memberID, API_KEY=API_KEY, context=context, priority=priority)
             name = req.get("name", "???")
             nickname = f"{name} [{userID}]"
 
@@ -417,7 +397,7 @@ class Verify(commands.Cog):
                 fId = str(req['faction']['faction_id'])
                 fNa = str(req['faction']['faction_name'])
                 faction_roles_id = config.get("factions", {}).get(fId, {})
-                faction_roles = [_ for _ in self.bot.get_module_role(ctx.guild.roles, faction_roles_id, all=True) if _ is not None]
+                faction_roles = [_ for _ in self.bot.get_module_role(ctx.guild, faction_roles_id, all=True) if _ is not None]
 
                 roles_list = [f'@{html.unescape(verified_role.name)}']
                 for faction_role in faction_roles:
@@ -428,10 +408,9 @@ class Verify(commands.Cog):
                 if fId in config.get("factions", {}) and fId in config.get("positions", {}):
                     try:
                         position_name = f'{html.unescape(req.get("faction", {}).get("position"))} of {html.unescape(fNa)}'
-                        position_role = get(ctx.guild.roles, name=position_name)
+                        position_role = self.bot.get_role_by_name(ctx.guild, position_name)
                         if position_role is None:
                             position_role = await ctx.guild.create_role(name=position_name)
-                            position_role = get(ctx.guild.roles, name=position_name)
                         for r in [r for r in author.roles if " of " in r.name and r.name.split(" of ")[-1] == html.unescape(fNa)]:
                             await author.remove_roles(r)
                         await author.add_roles(position_role)
@@ -443,48 +422,47 @@ class Verify(commands.Cog):
                 return f'< {author} >\nYou have been verified and are now known as < {author.display_name} >. You have been given the role{"s" if len(roles_list)>1 else ""}:{nl}{nl.join(roles_list)}', True
 
             else:
-                # loop over all members to check if the id exists
-                for member in ctx.guild.members:
-                    if int(member.id) == discordID:
+                # get the member from its id
+                member = ctx.guild.get_member(discordID)
+                if member is not None:
+                    try:
+                        await member.edit(nick=nickname)
+                    except BaseException:
+                        if context:
+                            # only send this message if ctx is a context (context=True)
+                            # await ctx.send(f":no_entry: I don't have the permission to change {member.display_name}'s nickname.")
+                            pass
+                    await member.add_roles(verified_role)
+
+                    # Get faction roles
+                    fId = str(req['faction']['faction_id'])
+                    fNa = str(req['faction']['faction_name'])
+                    faction_roles_id = config.get("factions", {}).get(fId, {})
+                    faction_roles = [_ for _ in self.bot.get_module_role(ctx.guild, faction_roles_id, all=True) if _ is not None]
+
+                    roles_list = [f'@{verified_role}']
+                    for faction_role in faction_roles:
+                        # add faction role if role exists
+                        await member.add_roles(faction_role)
+                        roles_list.append(f'@{faction_role}')
+
+                    if fId in config.get("factions", {}) and fId in config.get("positions", {}):
                         try:
-                            await member.edit(nick=nickname)
-                        except BaseException:
-                            if context:
-                                # only send this message if ctx is a context (context=True)
-                                # await ctx.send(f":no_entry: I don't have the permission to change {member.display_name}'s nickname.")
-                                pass
-                        await member.add_roles(verified_role)
-
-                        # Get faction roles
-                        fId = str(req['faction']['faction_id'])
-                        fNa = str(req['faction']['faction_name'])
-                        faction_roles_id = config.get("factions", {}).get(fId, {})
-                        faction_roles = [_ for _ in self.bot.get_module_role(ctx.guild.roles, faction_roles_id, all=True) if _ is not None]
-
-                        roles_list = [f'@{verified_role}']
-                        for faction_role in faction_roles:
-                            # add faction role if role exists
-                            await member.add_roles(faction_role)
-                            roles_list.append(f'@{faction_role}')
-
-                        if fId in config.get("factions", {}) and fId in config.get("positions", {}):
-                            try:
-                                position_name = f'{html.unescape(req.get("faction", {}).get("position"))} of {html.unescape(fNa)}'
-                                position_role = get(ctx.guild.roles, name=position_name)
-                                if position_role is None:
-                                    position_role = await ctx.guild.create_role(name=position_name)
-                                    position_role = get(ctx.guild.roles, name=position_name)
-                                for r in [r for r in member.roles if " of " in r.name and r.name.split(" of ")[-1] == html.unescape(fNa)]:
-                                    await member.remove_roles(r)
-                                await member.add_roles(position_role)
-                                roles_list.append(f'@{html.unescape(position_role.name)}')
-                            except BaseException as e:
-                                logging.error(f'[verify/_member] {guild} [{guild.id}]: positions {hide_key(e)}')
-
-                        nl = '\n- '
-                        return f'< {member} >\nThey have been verified and are now known as < {member.display_name} >. They have been given the role{"s" if len(roles_list)>1 else ""}:{nl}{nl.join(roles_list)}', True
-
-                # if no match in this loop it means that the member is not in this server
+                            position_name = f'{html.unescape(req.get("faction", {}).get("position"))} of {html.unescape(fNa)}'
+                            position_role = self.bot.get_role_by_name(ctx.guild, position_name)
+                            if position_role is None:
+                                position_role = await ctx.guild.create_role(name=position_name)
+                            for r in [r for r in member.roles if " of " in r.name and r.name.split(" of ")[-1] == html.unescape(fNa)]:
+                                await member.remove_roles(r)
+                            await member.add_roles(position_role)
+                            roles_list.append(f'@{html.unescape(position_role.name)}')
+                        except BaseException as e:
+                            logging.error(f'[verify/_member] {guild} [{guild.id}]: positions {hide_key(e)}')
+
+                    nl = '\n- '
+                    return f'< {member} >\nThey have been verified and are now known as < {member.display_name} >. They have been given the role{"s" if len(roles_list)>1 else ""}:{nl}{nl.join(roles_list)}', True
+
+                # if no member it means that the member is not in this server
                 return f"You are trying to verify < {nickname} > but they didn't join this server... Maybe they are using a different discord account on the official Torn discord server.", False
 
         except BaseException as e:
@@ -507,7 +485,7 @@ class Verify(commands.Cog):
             return
 
         # Get Verified role
-        role = self.bot.get_module_role(guild.roles, config.get("roles_verified", {}))
+        role = self.bot.get_guild_module_role(guild, "verify", "roles_verified")
         if role is None:
             await channel.send(f'```md\n# Verifying all members of {guild}\n< Force > {force}\n< error > no verified roles set```')
             return
@@ -516,29 +494,36 @@ class Verify(commands.Cog):
 
         # loop over members
         members = guild.members
+        yata_users = await get_yata_users_bulk(discord_ids=[member.id for member in members if not member.bot])
         for i, member in enumerate(members):
             if member.bot:
                 continue
 
-            if force:
-                if ctx:
-                    message, _ = await self._member(ctx, role, discordID=member.id, API_KEY=key)
-                else:
-                    message, _ = await self._member(member, role, discordID=member.id, API_KEY=key, context=False)
-
-                if not _:
-                    await channel.send(f"```md\n< {i+1:03d}/{len(members):03d} > {member.display_name}: {message}```")
+            # members already verified are only checked again with force
+            if not force and role in member.roles:
                 continue
 
-            elif role in member.roles:
-                pass
+            # torn id of YATA users is known (saves the discord API call)
+            # Torn's discord id of the profile is checked against the member in _member
+            user = yata_users.get(member.id)
+            userID, discordID = (user.get("tId"), None) if user is not None else (None, member.id)
+            memberID = member.id if user is not None else None
+
+            # rotate over the master keys to use the budget of all the server admins
+            status, tornId, key = await self.bot.get_master_key(guild)
+            if status == -1:
+                await channel.send(f'```md\n< {i+1:03d}/{len(members):03d} > < error > no master key available, verification stopped```')
+                break
+
+            if ctx:
+                message, _ = await self._member(ctx, role, userID=userID, discordID=discordID, API_KEY=key, priority=BACKGROUND, memberID=memberID)
             else:
-                if ctx:
-                    message, _ = await self._member(ctx, role, discordID=member.id, API_KEY=key)
-                else:
-                    message, _ = await self._member(member, role, discordID=member.id, API_KEY=key, context=False)
+                message, _ = await self._member(member, role, userID=userID, discordID=discordID, API_KEY=key, context=False, priority=BACKGROUND, memberID=memberID)
 
+            if not force:
                 await channel.send(f"```md\n< {i+1:03d}/{len(members):03d} > {message}```")
+            elif not _:
+                await channel.send(f"```md\n< {i+1:03d}/{len(members):03d} > {member.display_name}: {message}```")
 
         await channel.send(f"```md\n# done verifying```")
 
@@ -550,19 +535,22 @@ class Verify(commands.Cog):
             return
 
         # get verified role
-        vrole = self.bot.get_module_role(guild.roles, config.get("roles_verified", {}))
+        vrole = self.bot.get_guild_module_role(guild, "verify", "roles_verified")
 
         # get unique faction_roles
         all_faction_roles = [id for faction_id, faction_roles_id in config.get("factions", {}).items() for id in faction_roles_id]
 
+        # get factions names
+        factions_names = await get_faction_names(list(config.get("factions", {})))
+
         # loop over factions
         for faction_id, faction_roles_id in config.get("factions", {}).items():
 
             # Get faction roles
-            faction_roles = [_ for _ in self.bot.get_module_role(guild.roles, faction_roles_id, all=True) if _ is not None]
+            faction_roles = [_ for _ in self.bot.get_module_role(guild, faction_roles_id, all=True) if _ is not None]
             faction_roles_unique = [_ for _ in faction_roles if all_faction_roles.count(str(_.id)) == 1]
             roles_list = ", ".join([f'@{html.unescape(faction_role.name)}' for faction_role in faction_roles])
-            faction_name = await get_faction_name(faction_id)
+            faction_name = factions_names[faction_id]
 
             if not len(faction_roles_unique):
                 await channel.send(f'```md\n# Checking {faction_name}\n< Force > {force}\n< Roles > {roles_list}\n< error > None of the following roles are unique```')
@@ -577,16 +565,7 @@ class Verify(commands.Cog):
                 await channel.send(f"```md\n< error >{msg}```")
                 continue
 
-            url = f'https://api.torn.com/faction/{faction_id}?selections=basic&key={key}'
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url) as r:
-                    try:
-                        req = await r.json()
-                    except BaseException:
-                        req = {'error': {'error': 'API is talking shit... #blameched', 'code': -1}}
-
-            if not isinstance(req, dict):
-                req = {'error': {'error': 'API is talking shit... #blameched', 'code': -1}}
+            req = await self.bot.torn.get("faction", faction_id, "basic", key, priority=BACKGROUND)
 
             # deal with api error
             if "error" in req:
@@ -623,9 +602,9 @@ class Verify(commands.Cog):
 
                         # verify him again see if he has a new faction on the server
                         if ctx:
-                            message, success = await self._member(ctx, vrole, discordID=m.id, API_KEY=key)
+                            message, success = await self._member(ctx, vrole, discordID=m.id, API_KEY=key, priority=BACKGROUND)
                         else:
-                            message, success = await self._member(m, vrole, discordID=m.id, API_KEY=key, context=False)
+                            message, success = await self._member(m, vrole, discordID=m.id, API_KEY=key, context=False, priority=BACKGROUND)
                         await channel.send(f'```md\n< {i+1:03d}/{len(members_with_role):03d} > {message}```')
 
                     else:
@@ -660,7 +639,7 @@ class Verify(commands.Cog):
                 # update time
                 config["other"]["daily_verify"] = ts_now()
                 self.bot.configurations[guild.id]["verify"] = config
-                await set_configuration(self.bot.bot_id, guild.id, guild.name, self.bot.configurations[guild.id])
+                self.bot.save_configuration(guild, ["verify", "other", "daily_verify"])
 
                 # get full guild (async iterator doesn't return channels)
                 guild = self.bot.get_guild(guild.id)
@@ -710,7 +689,7 @@ class Verify(commands.Cog):
                 # update time
                 config["other"]["weekly_verify"] = ts_now()
                 self.bot.configurations[guild.id]["verify"] = config
-                await set_configuration(self.bot.bot_id, guild.id, guild.name, self.bot.configurations[guild.id])
+                self.bot.save_configuration(guild, ["verify", "other", "weekly_verify"])
 
                 # get full guild (async iterator doesn't return channels)
                 guild = self.bot.get_guild(guild.id)
@@ -759,7 +738,7 @@ class Verify(commands.Cog):
                 # update time
                 config["other"]["daily_check"] = ts_now()
                 self.bot.configurations[guild.id]["verify"] = config
-                await set_configuration(self.bot.bot_id, guild.id, guild.name, self.bot.configurations[guild.id])
+                self.bot.save_configuration(guild, ["verify", "other", "daily_check"])
 
                 # get full guild (async iterator doesn't return channels)
                 guild = self.bot.get_guild(guild.id)
@@ -808,7 +787,7 @@ class Verify(commands.Cog):
                 # update time
                 config["other"]["weekly_check"] = ts_now()
                 self.bot.configurations[guild.id]["verify"] = config
-                await set_configuration(self.bot.bot_id, guild.id, guild.name, self.bot.configurations[guild.id])
+                self.bot.save_configuration(guild, ["verify", "other", "weekly_check"])
 
                 # get full guild (async iterator doesn't return channels)
                 guild = self.bot.get_guild(guild.id)
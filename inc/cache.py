@@ -0,0 +1,103 @@
+"""
+Copyright 2020 kivou.2000607@gmail.com
+
+This file is part of yata-bot.
+
+    yata is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    yata is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with yata-bot. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# import standard modules
+import time
+import pickle
+from collections import OrderedDict
+
+
+class TTLCache:
+    """ In memory LRU cache with a time to live per entry
+        - maxsize: maximum number of entries
+        - max_bytes: maximum total size of the entries (size given when setting a value)
+        - copy: values are stored frozen (pickled) and each get returns a new copy
+          (for mutable values the callers modify, eg: API payloads)
+
+        Without copy, values are returned as stored: use it for immutable values only.
+    """
+
+    def __init__(self, maxsize=1024, max_bytes=None, copy=False):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.copy = copy
+        self.bytes = 0
+        self._data = OrderedDict()  # key -> (expires, size, value)
+        self._stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0}
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        entry = self._data.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    def _pop(self, key):
+        expires, size, value = self._data.pop(key)
+        self.bytes -= size
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            self._stats["misses"] += 1
+            return default
+
+        if entry[0] <= time.monotonic():
+            self._pop(key)
+            self._stats["expired"] += 1
+            self._stats["misses"] += 1
+            return default
+
+        self._data.move_to_end(key)
+        self._stats["hits"] += 1
+        return pickle.loads(entry[2]) if self.copy else entry[2]
+
+    def set(self, key, value, ttl, size=1):
+        if ttl <= 0:
+            return
+
+        if key in self._data:
+            self._pop(key)
+
+        if self.copy:
+            value = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+        self._data[key] = (time.monotonic() + ttl, size, value)
+        self.bytes += size
+
+        # evict least recently used entries
+        while len(self._data) > self.maxsize or (self.max_bytes is not None and self.bytes > self.max_bytes and len(self._data) > 1):
+            oldest = next(iter(self._data))
+            self._pop(oldest)
+            self._stats["evictions"] += 1
+
+    def delete(self, key):
+        if key in self._data:
+            self._pop(key)
+
+    def clear(self):
+        self._data.clear()
+        self.bytes = 0
+
+    def stats(self):
+        s = dict(self._stats)
+        lookups = s["hits"] + s["misses"]
+        s["hit rate"] = f'{100 * s["hits"] / lookups:.1f}%' if lookups else "0.0%"
+        s["entries"] = len(self._data)
+        s["size"] = f'{self.bytes / 1024:.1f}kB'
+        return s
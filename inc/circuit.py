@@ -0,0 +1,129 @@
+"""
+Copyright 2020 kivou.2000607@gmail.com
+
+This file is part of yata-bot.
+
+    yata is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    yata is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with yata-bot. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# import standard modules
+import random
+import time
+import logging
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+def backoff(attempt, base=0.5, cap=4):
+    """ full jitter exponential backoff (seconds) before the retry number attempt (1, 2, ...)
+    """
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """ Circuit breaker of an endpoint
+        - closed: calls go through, opens after `failures` failures in a row
+        - open: calls are rejected for `reset_timeout` seconds
+        - half-open: one probe call goes through, closes on success
+          or opens again with a doubled timeout (up to `max_reset_timeout`)
+    """
+
+    def __init__(self, name, failures=5, reset_timeout=30, max_reset_timeout=300):
+        self.name = name
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.max_reset_timeout = max_reset_timeout
+
+        self.state = CLOSED
+        self._failures = 0
+        self._timeout = reset_timeout
+        self._opened_at = 0
+        self._probing = False
+        self._stats = {"opened": 0, "rejected": 0, "probes": 0}
+
+    def available(self):
+        """ cheap check for the tasks loops (doesn't take the probe)
+        """
+        if self.state == OPEN:
+            return time.monotonic() - self._opened_at >= self._timeout
+        if self.state == HALF_OPEN:
+            return not self._probing
+        return True
+
+    def is_open(self):
+        """ True while the calls are rejected (open and before the probe time)
+        """
+        return self.state == OPEN and time.monotonic() - self._opened_at < self._timeout
+
+    def allow(self):
+        """ checks if a call can be made
+            return: allowed, probe (the call is the half-open probe)
+        """
+        if self.state == OPEN:
+            if time.monotonic() - self._opened_at < self._timeout:
+                self._stats["rejected"] += 1
+                return False, False
+            self._set_state(HALF_OPEN)
+
+        if self.state == HALF_OPEN:
+            if self._probing:
+                self._stats["rejected"] += 1
+                return False, False
+            self._probing = True
+            self._stats["probes"] += 1
+            return True, True
+
+        return True, False
+
+    def release(self, probe):
+        """ the call has not been made (dropped by the rate limiter or cancelled)
+        """
+        if probe:
+            self._probing = False
+
+    def record(self, success, probe=False):
+        if probe:
+            self._probing = False
+
+        if success:
+            self._failures = 0
+            if self.state != CLOSED:
+                self._timeout = self.reset_timeout
+                self._set_state(CLOSED)
+            return
+
+        self._failures += 1
+        if probe and self.state == HALF_OPEN:
+            self._timeout = min(2 * self._timeout, self.max_reset_timeout)
+            self._open()
+        elif self.state == CLOSED and self._failures >= self.failures:
+            self._open()
+
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self._stats["opened"] += 1
+        self._set_state(OPEN)
+
+    def _set_state(self, state):
+        logging.warning(f'[circuit/{self.name}] {self.state} -> {state} ({self._failures} failures in a row, reset timeout {self._timeout}s)')
+        self.state = state
+
+    def stats(self):
+        s = {"state": self.state, "failures in a row": self._failures}
+        s.update(self._stats)
+        if self.state == OPEN:
+            s["retry in"] = f'{max(0, self._timeout - (time.monotonic() - self._opened_at)):.0f}s'
+        return s
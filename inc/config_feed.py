@@ -0,0 +1,130 @@
+"""
+Copyright 2020 kivou.2000607@gmail.com
+
+This file is part of yata-bot.
+
+    yata is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    yata is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with yata-bot. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# import standard modules
+import asyncio
+import logging
+
+# import bot functions and classes
+from inc.yata_db import get_configuration
+from inc.yata_db import get_configuration_hashes
+from inc.yata_db import on_configuration_change
+from inc.yata_db import listening
+from inc.handy import hide_key
+
+POLL_INTERVAL = 60  # seconds between two polls without notifications
+POLL_INTERVAL_LISTENING = 3600  # seconds between two polls with notifications (in case some are lost)
+RETRY = 10  # seconds before reloading a configuration with pending changes
+
+
+class ConfigFeed:
+    """ Reloads the servers configurations changed in the database (YATA's dashboard)
+        - changes are notified by the yata_configurations trigger (see yata_db)
+        - without notifications the md5 of the configurations are polled
+        - changed configurations are reloaded one by one and given to `apply(guild_id, configuration)`
+          (configuration is None if the server has been removed)
+        - `apply` returns False if the configuration can't be changed yet (pending changes of the bot)
+    """
+
+    def __init__(self, bot_id, apply, interval=POLL_INTERVAL):
+        self.bot_id = bot_id
+        self.apply = apply
+        self.interval = interval
+
+        self._hashes = None  # guild id -> md5 of the configuration at the last poll
+        self._reloading = {}  # guild id -> changed again while reloading
+        self._task = None
+        self._poll_now = asyncio.Event()
+        self._stats = {"notified": 0, "polls": 0, "reloads": 0, "deferred": 0, "errors": 0}
+
+    def start(self):
+        if self._task is None:
+            on_configuration_change(self._on_change)
+            self._task = asyncio.ensure_future(self._run())
+
+    def _on_change(self, bot_id, discord_id):
+        if discord_id is None:
+            self._poll_now.set()
+        elif bot_id == int(self.bot_id):
+            self._stats["notified"] += 1
+            self.reload(discord_id)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.poll()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._stats["errors"] += 1
+                logging.error(f'[config_feed/poll] {hide_key(e)}')
+
+            self._poll_now.clear()
+            try:
+                await asyncio.wait_for(self._poll_now.wait(), POLL_INTERVAL_LISTENING if listening() else self.interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def poll(self):
+        """ reloads the configurations changed since the last poll (the first one only takes the hashes)
+        """
+        hashes = await get_configuration_hashes(self.bot_id)
+        self._stats["polls"] += 1
+        if self._hashes is not None:
+            for guild_id in set(hashes) | set(self._hashes):
+                if hashes.get(guild_id) != self._hashes.get(guild_id):
+                    self.reload(guild_id)
+        self._hashes = hashes
+
+    def reload(self, guild_id):
+        """ reloads the configuration of a server in the background
+            (once for all the changes notified meanwhile)
+        """
+        if guild_id in self._reloading:
+            self._reloading[guild_id] = True
+        else:
+            self._reloading[guild_id] = False
+            asyncio.ensure_future(self._reload(guild_id))
+
+    async def _reload(self, guild_id):
+        try:
+            while True:
+                self._reloading[guild_id] = False
+                configuration = await get_configuration(self.bot_id, guild_id)
+                self._stats["reloads"] += 1
+                if self.apply(guild_id, None if configuration is False else configuration) is False:
+                    self._stats["deferred"] += 1
+                    await asyncio.sleep(RETRY)
+                elif not self._reloading[guild_id]:
+                    break
+            self._reloading.pop(guild_id)
+        except Exception as e:
+            self._reloading.pop(guild_id, None)
+            self._stats["errors"] += 1
+            logging.error(f'[config_feed/reload] {guild_id}: {hide_key(e)}')
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def stats(self):
+        s = {"reloading": len(self._reloading)}
+        s.update(self._stats)
+        return s
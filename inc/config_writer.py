@@ -0,0 +1,168 @@
+"""
+Copyright 2020 kivou.2000607@gmail.com
+
+This file is part of yata-bot.
+
+    yata is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    yata is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with yata-bot. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# import standard modules
+import json
+import asyncio
+import logging
+
+# import bot functions and classes
+from inc.yata_db import set_configurations
+from inc.handy import hide_key
+
+FLUSH_INTERVAL = 10  # seconds
+MAX_PATCHES = 16  # changed keys of a server above which the whole configuration is written
+
+
+def lookup(configuration, path):
+    """ value of configuration at path
+        return: found, value
+    """
+    value = configuration
+    for key in path:
+        if not isinstance(value, dict) or key not in value:
+            return False, None
+        value = value[key]
+    return True, value
+
+
+class ConfigWriter:
+    """ Write behind of the servers configurations
+        - changes only mark the server as dirty
+        - dirty configurations are written every `interval` seconds
+          (all the changes of a server within an interval make one write)
+        - the configurations are read with `get_configuration(guild_id)` when written
+        - changes of a few keys are written as patches of these keys only
+        - the written configurations are also saved in the local snapshot (if any)
+    """
+
+    def __init__(self, bot_id, get_configuration, interval=FLUSH_INTERVAL, snapshot=None):
+        self.bot_id = bot_id
+        self.get_configuration = get_configuration
+        self.interval = interval
+        self.snapshot = snapshot
+
+        self._dirty = {}  # guild id -> [guild name, set of changed paths or None for the whole configuration]
+        self._flushing = {}  # dirty configurations being written
+        self._task = None
+        self._lock = asyncio.Lock()
+        self._stats = {"changes": 0, "writes": 0, "patches": 0, "flushes": 0, "errors": 0}
+
+    def mark(self, guild_id, guild_name, path=None):
+        """ path: keys of the changed value (eg: ["verify", "other", "daily_verify"]), None for the whole configuration
+        """
+        self._stats["changes"] += 1
+        self._mark(guild_id, guild_name, path)
+
+    def _mark(self, guild_id, guild_name, path):
+        dirty = self._dirty.get(guild_id)
+        if dirty is None:
+            self._dirty[guild_id] = [guild_name, None if path is None else {tuple(path)}]
+            return
+
+        dirty[0] = guild_name
+        if dirty[1] is None:
+            return
+        if path is None or len(dirty[1]) >= MAX_PATCHES:
+            dirty[1] = None
+        else:
+            dirty[1].add(tuple(path))
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    async def flush(self):
+        """ writes the dirty configurations
+            return: False if they couldn't be written (kept for the next flush), True otherwise
+        """
+        async with self._lock:
+            if not len(self._dirty):
+                return True
+
+            dirty = self._flushing = self._dirty
+            self._dirty = {}
+            servers = []
+            patches = []
+            for guild_id, (guild_name, paths) in dirty.items():
+                configuration = self.get_configuration(guild_id)
+                if paths is None:
+                    servers.append((guild_id, guild_name, configuration))
+                    continue
+                changes = []
+                for path in sorted(paths):
+                    found, value = lookup(configuration, path)
+                    changes.append((list(path), json.dumps(value) if found else None))
+                patches.append((guild_id, guild_name, changes, configuration))
+
+            try:
+                await set_configurations(self.bot_id, servers, patches)
+            except asyncio.CancelledError:
+                self._keep_dirty(dirty)
+                raise
+            except Exception as e:
+                self._keep_dirty(dirty)
+                self._stats["errors"] += 1
+                logging.error(f'[config_writer/flush] {len(dirty)} configurations not written: {hide_key(e)}')
+                return False
+            finally:
+                self._flushing = {}
+
+            self._stats["writes"] += len(servers)
+            self._stats["patches"] += sum([len(changes) for _, _, changes, _ in patches])
+            self._stats["flushes"] += 1
+            logging.debug(f'[config_writer/flush] {len(servers)} configurations written and {len(patches)} patched')
+
+            if self.snapshot is not None:
+                await self.snapshot.save_async({guild_id: self.get_configuration(guild_id) for guild_id in dirty})
+
+            return True
+
+    def pending(self, guild_id):
+        """ True if the guild has changes not written yet
+        """
+        return guild_id in self._dirty or guild_id in self._flushing
+
+    def _keep_dirty(self, dirty):
+        # for the next flush (merged with the changes made meanwhile)
+        for guild_id, (guild_name, paths) in dirty.items():
+            for path in [None] if paths is None else paths:
+                self._mark(guild_id, guild_name, path)
+
+    async def close(self):
+        """ stops the flush loop and writes the pending changes
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    def stats(self):
+        s = {"pending": len(self._dirty)}
+        s.update(self._stats)
+        return s
@@ -0,0 +1,80 @@
+"""
+Copyright 2020 kivou.2000607@gmail.com
+
+This file is part of yata-bot.
+
+    yata is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    yata is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with yata-bot. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# configuration of a server without configuration (never modified)
+EMPTY = {}
+
+
+def to_ids(configuration_ids):
+    """ ids of the roles or channels of a configuration ({"id": "name"}) as integers
+    """
+    return tuple([int(id) for id in configuration_ids if str(id).isdigit()])
+
+
+class ModuleConfig:
+    """ Compiled configuration of a module of a server
+        - raw: the configuration (dict)
+        - ids: roles and channels ids as tuples of integers by key (eg: ids["roles_alerts"])
+        - id_sets: same as sets (channels allowed)
+    """
+    __slots__ = ("raw", "ids", "id_sets")
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.ids = {}
+        self.id_sets = {}
+        for key, value in raw.items():
+            if isinstance(value, (dict, list)) and key.startswith(("roles_", "channels_")):
+                self.ids[key] = to_ids(value)
+                self.id_sets[key] = frozenset(self.ids[key])
+
+
+class GuildConfig:
+    """ Compiled configuration of a server (read by the commands and the loops)
+        Compiled again when the configuration is replaced or saved (see YataBot.get_guild_config)
+        - raw: the configuration (dict)
+        - prefix: commands prefix
+        - modules: compiled configurations of the enabled modules by name
+        - admin_channel_id: id of the admin channel or None
+    """
+    __slots__ = ("raw", "prefix", "modules", "admin_channel_id")
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.modules = {module: ModuleConfig(c) for module, c in raw.items() if isinstance(c, dict) and len(c)}
+
+        admin = raw.get("admin", {})
+        prefix = admin.get("prefix", "!")
+        self.prefix = prefix if isinstance(prefix, str) else tuple(prefix)
+        admin_channels = [k for k in admin.get("channels_admin", {})]
+        self.admin_channel_id = int(admin_channels[0]) if len(admin_channels) and str(admin_channels[0]).isdigit() else None
+
+    def module_of(self, raw):
+        """ compiled configuration of a module from its configuration (None if not a module of the server)
+        """
+        for module in self.modules.values():
+            if module.raw is raw:
+                return module
+        return None
+
+    def ids(self, module, key):
+        """ roles or channels ids of a module (empty tuple if none)
+        """
+        module = self.modules.get(module)
+        return () if module is None else module.ids.get(key, ())
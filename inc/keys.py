@@ -0,0 +1,124 @@
+"""
+Copyright 2020 kivou.2000607@gmail.com
+
+This file is part of yata-bot.
+
+    yata is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    yata is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with yata-bot. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# import standard modules
+import time
+import logging
+
+# import bot functions and classes
+from inc.yata_db import get_yata_users_bulk
+from inc.yata_db import forget_yata_user
+from inc.ratelimit import mask_key
+
+# cool down of a key by Torn API error code (seconds)
+# errors of a request (7: incorrect ID-entity relation, 16: access level) don't put the key in quarantine
+QUARANTINE = {
+    2: 3600,  # incorrect key
+    5: 60,  # too many requests
+    10: 3600,  # key owner is in federal jail
+    13: 3600,  # key disabled due to owner inactivity
+}
+
+
+class KeyPool:
+    """ Master keys of the server admins of each guild
+        - the keys are resolved on each get through the YATA users cache
+          (invalidated by the database notifications when a key changes)
+        - the least recently used key is given first
+        - keys with errors are put in quarantine for a cool down
+        - an incorrect key is read again from the database (the owner might have changed it)
+    """
+
+    def __init__(self):
+        self._guilds = {}  # guild id -> [(torn id, key)] last resolved
+        self._owners = {}  # key -> torn id
+        self._last_used = {}  # key -> time
+        self._quarantine = {}  # key -> (until, code)
+        self._stats = {"loads": 0, "picks": 0, "quarantined": 0, "refreshed": 0, "empty": 0}
+
+    async def load(self, guild_id, torn_ids):
+        """ resolves the keys of the server admins (YATA users cache or database)
+        """
+        users = await get_yata_users_bulk(torn_ids=torn_ids)
+        keys = []
+        for torn_id in torn_ids:
+            user = users.get(int(torn_id))
+            if user is not None:
+                user = tuple(user)
+                keys.append((user[0], user[2]))
+                self._owners[user[2]] = user[0]
+
+        self._guilds[guild_id] = keys
+        self._stats["loads"] += 1
+        return keys
+
+    async def get(self, guild_id, torn_ids):
+        """ gets a key of the guild
+            return: torn id, key or None if no key available
+        """
+        await self.load(guild_id, torn_ids)
+        return self.pick(guild_id)
+
+    def pick(self, guild_id):
+        keys = self._guilds.get(guild_id, [])
+        now = time.monotonic()
+        available = [k for k in keys if self._quarantine.get(k[1], (0, 0))[0] <= now]
+
+        # fallback on rate limited keys (the rate limiter will make them wait)
+        if not len(available):
+            available = [k for k in keys if self._quarantine.get(k[1], (0, 0))[1] == 5]
+
+        if not len(available):
+            self._stats["empty"] += 1
+            return None
+
+        torn_id, key = min(available, key=lambda k: self._last_used.get(k[1], 0))
+        self._last_used[key] = now
+        self._stats["picks"] += 1
+        return torn_id, key
+
+    def invalidate(self, guild_id):
+        self._guilds.pop(guild_id, None)
+
+    def report(self, key, code):
+        """ puts a key in quarantine based on the API error code
+            an incorrect key is forgotten from the users cache to get the new one of its owner
+        """
+        cool_down = QUARANTINE.get(code)
+        if cool_down is None:
+            return
+
+        if code == 2 and key in self._owners:
+            forget_yata_user(self._owners.pop(key))
+            self._stats["refreshed"] += 1
+
+        self._quarantine[key] = (time.monotonic() + cool_down, code)
+        self._stats["quarantined"] += 1
+        logging.warning(f'[keys/report] key {mask_key(key)} in quarantine for {cool_down}s (error code {code})')
+
+    def stats(self):
+        now = time.monotonic()
+        s = dict(self._stats)
+        s["guilds"] = len(self._guilds)
+        s["keys"] = len(set([k[1] for keys in self._guilds.values() for k in keys]))
+        in_quarantine = [code for until, code in self._quarantine.values() if until > now]
+        s["in quarantine"] = len(in_quarantine)
+        for code in sorted(set(in_quarantine)):
+            s[f'in quarantine code {code}'] = in_quarantine.count(code)
+        return s
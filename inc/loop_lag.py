@@ -0,0 +1,66 @@
+"""
+Copyright 2020 kivou.2000607@gmail.com
+
+This file is part of yata-bot.
+
+    yata is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    yata is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with yata-bot. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# import standard modules
+import time
+import asyncio
+import logging
+from collections import deque
+
+
+class LoopLag:
+    """ Event loop lag: delay of a sleep of `interval` seconds over its duration
+        (blocking code in a coroutine delays everything else, including the gateway heartbeats)
+    """
+
+    def __init__(self, interval=0.5, samples=1000, warning=1):
+        self.interval = interval
+        self.warning = warning  # lag logged as a warning (seconds)
+        self._lags = deque(maxlen=samples)
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def _run(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            lag = max(0, time.monotonic() - start - self.interval)
+            self._lags.append(lag)
+            if lag > self.warning:
+                logging.warning(f'[loop_lag] event loop blocked for {lag:.2f}s')
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def reset(self):
+        self._lags.clear()
+
+    def stats(self):
+        if not len(self._lags):
+            return {"samples": 0}
+        lags = sorted(self._lags)
+        return {"samples": len(lags),
+                "mean": f'{1000 * sum(lags) / len(lags):.2f}ms',
+                "p95": f'{1000 * lags[int(0.95 * (len(lags) - 1))]:.2f}ms',
+                "max": f'{1000 * lags[-1]:.2f}ms'}
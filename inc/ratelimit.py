@@ -0,0 +1,166 @@
+"""
+Copyright 2020 kivou.2000607@gmail.com
+
+This file is part of yata-bot.
+
+    yata is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    yata is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with yata-bot. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# import standard modules
+import asyncio
+import heapq
+import itertools
+import logging
+
+# priority classes (lower is served first)
+INTERACTIVE = 0  # commands typed by members
+BACKGROUND = 1  # tasks loops (retal, oc, notifications, daily verify...)
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+
+def mask_key(key):
+    return f'{str(key)[:3]}***' if key else "none"
+
+
+class _Bucket:
+    __slots__ = ("tokens", "last", "queue", "timer")
+
+    def __init__(self, tokens, last):
+        self.tokens = tokens
+        self.last = last
+        self.queue = []  # heap of [priority, seq, future]
+        self.timer = None
+
+
+class RateLimiter:
+    """ Token bucket per API key shared by the whole process
+        - rate: number of calls per period (Torn allows ~100 calls per minute per key)
+        - burst: size of the bucket (number of calls that can be made at once)
+
+        Waiters are served by priority class then by arrival order.
+        Buckets back to full with nobody waiting are removed (same as a new bucket).
+    """
+
+    def __init__(self, rate=90, period=60, burst=30):
+        self.rate = rate
+        self.period = float(period)
+        self.burst = burst
+        self._buckets = {}
+        self._last_prune = 0
+        self._seq = itertools.count()
+        self._stats = {p: {"calls": 0, "waited": 0, "wait_time": 0.0, "max_wait": 0.0, "shed": 0} for p in PRIORITY_NAMES}
+
+    def _refill(self, bucket, now):
+        bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.last) * self.rate / self.period)
+        bucket.last = now
+
+    def _bucket(self, key, now):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = _Bucket(self.burst, now)
+            self._buckets[key] = bucket
+        else:
+            self._refill(bucket, now)
+        return bucket
+
+    def _prune(self, now):
+        """ removes the buckets of the keys not used for a while
+        """
+        self._last_prune = now
+        for key, bucket in list(self._buckets.items()):
+            if not bucket.queue and bucket.timer is None and bucket.tokens + (now - bucket.last) * self.rate / self.period >= self.burst:
+                del self._buckets[key]
+
+    def _dispatch(self, bucket):
+        """ hands tokens to the waiters by priority and schedules the next dispatch
+        """
+        loop = asyncio.get_event_loop()
+        bucket.timer = None
+        self._refill(bucket, loop.time())
+
+        while bucket.queue:
+            future = bucket.queue[0][2]
+            if future.done():  # waiter timed out or was cancelled
+                heapq.heappop(bucket.queue)
+                continue
+            if bucket.tokens < 1:
+                break
+            heapq.heappop(bucket.queue)
+            bucket.tokens -= 1
+            future.set_result(True)
+
+        if bucket.queue:
+            delay = (1 - bucket.tokens) * self.period / self.rate
+            bucket.timer = loop.call_later(delay, self._dispatch, bucket)
+
+    async def acquire(self, key, priority=INTERACTIVE, max_wait=None):
+        """ waits for a token for this key
+            - priority: INTERACTIVE or BACKGROUND
+            - max_wait: maximum time to wait in seconds (None to wait forever)
+
+            return: True if a token has been given, False if the call has been shed
+        """
+        loop = asyncio.get_event_loop()
+        now = loop.time()
+        stats = self._stats[priority]
+        if now - self._last_prune > self.period:
+            self._prune(now)
+        bucket = self._bucket(key, now)
+
+        # fast path: nobody is waiting and a token is available
+        if not bucket.queue and bucket.tokens >= 1:
+            bucket.tokens -= 1
+            stats["calls"] += 1
+            return True
+
+        future = loop.create_future()
+        heapq.heappush(bucket.queue, [priority, next(self._seq), future])
+        if bucket.timer is None:
+            self._dispatch(bucket)
+
+        try:
+            await asyncio.wait_for(future, max_wait)
+        except asyncio.TimeoutError:
+            stats["shed"] += 1
+            logging.warning(f'[ratelimit/acquire] {PRIORITY_NAMES[priority]} call shed for key {mask_key(key)} after {max_wait}s')
+            return False
+
+        wait = loop.time() - now
+        stats["calls"] += 1
+        stats["waited"] += 1
+        stats["wait_time"] += wait
+        stats["max_wait"] = max(stats["max_wait"], wait)
+        return True
+
+    def queue_depth(self, key=None):
+        if key is not None:
+            bucket = self._buckets.get(key)
+            return 0 if bucket is None else len([w for w in bucket.queue if not w[2].done()])
+        return sum([self.queue_depth(k) for k in self._buckets])
+
+    def stats(self):
+        s = {"keys": len(self._buckets), "queued": self.queue_depth()}
+        for priority, name in PRIORITY_NAMES.items():
+            p = self._stats[priority]
+            s[f'{name} calls'] = p["calls"]
+            s[f'{name} waited'] = p["waited"]
+            s[f'{name} shed'] = p["shed"]
+            s[f'{name} mean wait'] = f'{p["wait_time"] / p["waited"]:.2f}s' if p["waited"] else "0.00s"
+            s[f'{name} max wait'] = f'{p["max_wait"]:.2f}s'
+        for key in self._buckets:
+            depth = self.queue_depth(key)
+            if depth:
+                s[f'queue {mask_key(key)}'] = depth
+        return s
@@ -0,0 +1,63 @@
+"""
+Copyright 2020 kivou.2000607@gmail.com
+
+This file is part of yata-bot.
+
+    yata is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    yata is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with yata-bot. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+
+class GuildResolver:
+    """ Roles and channels of a guild by name
+        - the indexes hold ids (the discord objects are replaced on reconnection)
+        - maintained with the roles and channels events (see YataBot.on_guild_role_create, ...)
+        The lookups by id are discord's own indexes: guild.get_role, guild.get_channel and guild.get_member
+    """
+
+    def __init__(self, guild):
+        self.roles = {}  # name -> set of ids
+        self.channels = {}
+        for role in guild.roles:
+            self.add(self.roles, role)
+        for channel in guild.channels:
+            self.add(self.channels, channel)
+
+    def add(self, index, item):
+        index.setdefault(item.name, set()).add(item.id)
+
+    def remove(self, index, item):
+        ids = index.get(item.name)
+        if ids is not None:
+            ids.discard(item.id)
+            if not len(ids):
+                index.pop(item.name)
+
+    def rename(self, index, before, after):
+        if before.name != after.name:
+            self.remove(index, before)
+            self.add(index, after)
+
+    def role(self, guild, name):
+        """ role with this name (the lowest one as get(guild.roles, name=name)) or None
+        """
+        roles = [guild.get_role(id) for id in self.roles.get(name, ())]
+        roles = [r for r in roles if r is not None and r.name == name]
+        return min(roles) if len(roles) else None
+
+    def channel(self, guild, name):
+        """ channel with this name (the first one by position) or None
+        """
+        channels = [guild.get_channel(id) for id in self.channels.get(name, ())]
+        channels = [c for c in channels if c is not None and c.name == name]
+        return min(channels, key=lambda c: (c.position, c.id)) if len(channels) else None
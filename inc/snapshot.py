@@ -0,0 +1,117 @@
+"""
+Copyright 2020 kivou.2000607@gmail.com
+
+This file is part of yata-bot.
+
+    yata is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    yata is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with yata-bot. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# import standard modules
+import os
+import json
+import time
+import sqlite3
+import asyncio
+import logging
+
+
+class ConfigSnapshot:
+    """ Local copy (sqlite) of the servers configurations
+        - loaded at startup instead of waiting for YATA's database (the bot token is not stored)
+        - updated with the configurations written in YATA's database
+        The file is only readable by its owner.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = asyncio.Lock()  # saves in the order of the calls
+        self._stats = {"saves": 0, "saved servers": 0, "errors": 0}
+
+    def _connect(self):
+        if not os.path.exists(self.path):
+            os.close(os.open(self.path, os.O_CREAT | os.O_WRONLY, 0o600))
+        con = sqlite3.connect(self.path)
+        con.execute('CREATE TABLE IF NOT EXISTS servers (discord_id INTEGER PRIMARY KEY, configuration TEXT)')
+        con.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        return con
+
+    def load(self, max_age=None):
+        """ max_age: older snapshots are not loaded (seconds)
+            return: configurations, age of the snapshot (seconds) or None if no snapshot
+        """
+        if not os.path.exists(self.path):
+            return None
+
+        try:
+            con = self._connect()
+            try:
+                meta = dict(con.execute('SELECT key, value FROM meta').fetchall())
+                if "saved" not in meta:
+                    return None
+                configurations = {discord_id: json.loads(configuration) for discord_id, configuration in con.execute('SELECT discord_id, configuration FROM servers')}
+            finally:
+                con.close()
+        except (sqlite3.Error, ValueError) as e:
+            logging.error(f'[snapshot/load] {self.path}: {e}')
+            return None
+
+        age = time.time() - float(meta["saved"])
+        if max_age is not None and age > max_age:
+            logging.warning(f'[snapshot/load] {self.path}: snapshot too old ({age:.0f}s)')
+            return None
+
+        return configurations, age
+
+    def save(self, configurations, full=False):
+        """ saves configurations {discord_id: configuration}, errors are only logged
+            full: configurations are all the servers (the others are removed)
+        """
+        try:
+            self._save([(discord_id, json.dumps(configuration)) for discord_id, configuration in configurations.items()], full)
+        except (sqlite3.Error, OSError) as e:
+            self._stats["errors"] += 1
+            logging.error(f'[snapshot/save] {self.path}: {e}')
+
+    def _save(self, rows, full):
+        con = self._connect()
+        try:
+            with con:
+                if full:
+                    con.execute('DELETE FROM servers')
+                con.executemany('INSERT OR REPLACE INTO servers (discord_id, configuration) VALUES (?, ?)', rows)
+                # bot token of the older snapshots
+                con.execute('DELETE FROM meta WHERE key = ?', ("token",))
+                con.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', ("saved", str(time.time())))
+        finally:
+            con.close()
+
+        self._stats["saves"] += 1
+        self._stats["saved servers"] += len(rows)
+
+    async def save_async(self, configurations, full=False):
+        """ saves in a thread (sqlite commits wait for the disk), errors are only logged
+        """
+        # serialized now: the configurations can change while saving
+        rows = [(discord_id, json.dumps(configuration)) for discord_id, configuration in configurations.items()]
+        async with self._lock:
+            try:
+                await asyncio.get_event_loop().run_in_executor(None, self._save, rows, full)
+            except (sqlite3.Error, OSError) as e:
+                self._stats["errors"] += 1
+                logging.error(f'[snapshot/save] {self.path}: {e}')
+
+    def stats(self):
+        s = {"path": self.path}
+        s.update(self._stats)
+        return s
@@ -0,0 +1,534 @@
+"""
+Copyright 2020 kivou.2000607@gmail.com
+
+This file is part of yata-bot.
+
+    yata is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    yata is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with yata-bot. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# import standard modules
+import asyncio
+import aiohttp
+import json
+import pickle
+import logging
+import time
+from collections import deque
+
+# import bot functions and classes
+from inc.ratelimit import RateLimiter
+from inc.ratelimit import INTERACTIVE
+from inc.ratelimit import BACKGROUND
+from inc.cache import TTLCache
+from inc.circuit import CircuitBreaker
+from inc.circuit import backoff
+
+TORN_API_URL = "https://api.torn.com"
+YATA_URL = "https://yata.alwaysdata.net"
+
+# bot side error codes (Torn API error codes are positive)
+ERROR_SHED = -2  # call dropped by the rate limiter
+ERROR_CIRCUIT = -3  # call skipped while the endpoint is down
+ERROR_NETWORK = -4  # timeout, connection error or HTTP 5xx
+ERROR_TIMEOUT = -5  # call exceeded its deadline
+
+# transient errors retried (Torn API: 0 unknown error, 5 too many requests, 9 API disabled)
+RETRY_CODES = [0, 5, 9, ERROR_NETWORK]
+RETRIES = 2
+
+# errors counted as an outage of the endpoint by the circuit breakers
+OUTAGE_CODES = [0, 9, ERROR_NETWORK]
+
+# maximum time waiting for the rate limiter before shedding the call
+MAX_WAIT = {INTERACTIVE: 30, BACKGROUND: 120}
+
+# default deadline of a call (rate limiter wait, retries and http calls included)
+DEADLINE = {INTERACTIVE: 45, BACKGROUND: 180}
+
+# hedged calls: the duplicate is sent when the first call is slower than the observed p95 latency
+HEDGE_DELAY_DEFAULT = 2
+HEDGE_DELAY_MIN = 0.5
+HEDGE_SAMPLES = 20
+
+# time to live of the cached payloads by selection (Torn caches the responses for ~30s)
+# the ttl of a call is the smallest one of its selections, 0 is not cached
+CACHE_TTL_DEFAULT = 30
+CACHE_TTL = {
+    "rackets": 60,
+    "territory": 60,
+    # personal data the notifications need fresh
+    "events": 0,
+    "messages": 0,
+    "notifications": 0,
+    "bars": 0,
+    "cooldowns": 0,
+    "travel": 0,
+    "money": 0,
+    "education": 0,
+}
+
+# selections that return the same payload whatever the key used (when an id is given)
+PUBLIC_SELECTIONS = {"", "basic", "profile", "discord", "personalstats", "chain", "timestamp", "rackets", "territory"}
+
+# time window for merging the calls on the same resource while a call on it is in flight (seconds)
+# calls on an idle resource are only merged with the ones made in the same loop iteration
+COALESCE_WINDOW = 0.05
+
+# errors due to one selection not allowed with the key (the merged selections are then called separately)
+SELECTION_ERRORS = [7, 16]
+
+# errors due to the key used (the merged callers with another key then call with theirs)
+# 2 incorrect key, 5 too many requests, 10 owner in jail, 13 key disabled, 18 key paused
+KEY_ERRORS = [2, 5, 10, 13, 18, ERROR_SHED] + SELECTION_ERRORS
+
+
+def api_error(error, code=-1):
+    """ normalized error payload (same shape as the Torn API errors)
+    """
+    return {'error': {'error': error, 'code': code}}
+
+
+class TornClient:
+    """ HTTP client shared by all the cogs for the Torn API and YATA calls
+        It keeps one pooled session alive (keep-alive, dns cache, connection limits)
+        instead of opening a new session for every call.
+    """
+
+    def __init__(self, base_url=TORN_API_URL, yata_url=YATA_URL, limit=100, limit_per_host=30, dns_ttl=300, keepalive=30, timeout=30, connect_timeout=10, limiter=None, cache_size=2048, cache_bytes=32 * 1024 * 1024, coalesce_window=COALESCE_WINDOW, key_pool=None, retries=RETRIES):
+        self.base_url = base_url.rstrip("/")
+        self.yata_url = yata_url.rstrip("/")
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive = keepalive
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self._session = None
+
+        # process wide rate limiter keyed by API key
+        self.limiter = RateLimiter() if limiter is None else limiter
+
+        # payloads cache keyed by (section, id, selections, key scope) (the callers get their own copy)
+        self.cache = TTLCache(maxsize=cache_size, max_bytes=cache_bytes, copy=True)
+
+        # pending calls waiting to be merged keyed by (section, id, key scope)
+        self.coalesce_window = coalesce_window
+        self._pending = {}
+        self._busy = {}  # (section, id, key scope) -> number of merged calls in flight
+        self._coalesce_stats = {"calls": 0, "merged": 0, "split": 0}
+
+        # identical http calls in flight keyed by url
+        self._inflight = {}
+        self._granted = {}  # url -> event set when the rate limiter lets the call through (hedged calls)
+        self._flight_stats = {"calls": 0, "collapsed": 0}
+
+        # keys health (quarantine on errors)
+        self.key_pool = key_pool
+
+        # endpoints health
+        self.retries = retries
+        self.circuits = {"torn": CircuitBreaker("torn"), "yata": CircuitBreaker("yata")}
+
+        # latencies of the Torn API calls for the hedging delay
+        self._latencies = deque(maxlen=500)
+        self._latency_stats = {"deadlines expired": 0, "hedged calls": 0, "hedges won": 0}
+
+    def session(self):
+        """ gets the pooled session (created lazily to be bound to the running loop)
+        """
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit,
+                                             limit_per_host=self.limit_per_host,
+                                             ttl_dns_cache=self.dns_ttl,
+                                             keepalive_timeout=self.keepalive,
+                                             enable_cleanup_closed=True)
+            timeout = aiohttp.ClientTimeout(total=self.timeout, connect=self.connect_timeout)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+            logging.debug(f'[torn_api/session] new session (limit {self.limit}, limit per host {self.limit_per_host})')
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def url(self, section, id="", selections="", key=""):
+        if isinstance(selections, (list, tuple, set)):
+            selections = ",".join(selections)
+        return f'{self.base_url}/{section}/{"" if id is None else id}?selections={selections}&key={key}'
+
+    def cache_key(self, section, id, selections, key):
+        """ payloads of public selections are shared between keys
+            payloads of the key owner (no id) or of private selections are scoped to the key
+        """
+        public = (section == "torn" or str(id) != "") and all([s in PUBLIC_SELECTIONS for s in selections])
+        return (section, str(id), tuple(sorted(selections)), "public" if public else key)
+
+    def cache_ttl(self, selections):
+        return min([CACHE_TTL.get(s, CACHE_TTL_DEFAULT) for s in selections] or [CACHE_TTL_DEFAULT])
+
+    async def get(self, section, id="", selections="", key="", priority=INTERACTIVE, timeout=None, hedge=False, hedge_key=None):
+        """ makes a Torn API call
+            - section: user, faction, torn...
+            - id: torn id of the user or faction ("" for the owner of the key)
+            - selections: list of selections or comma separated string
+            - key: API key
+            - priority: INTERACTIVE for commands, BACKGROUND for tasks loops
+            - timeout: deadline of the call in seconds (default by priority)
+            - hedge: sends a duplicate call if the first one is slower than the p95 latency
+            - hedge_key: key of the duplicate call for public payloads (same key otherwise)
+
+            return: the payload as a dict or a normalized error {'error': {'error': message, 'code': code}}
+        """
+        id = "" if id is None else id
+        if isinstance(selections, str):
+            selections = [s for s in selections.split(",") if s]
+        selections = list(selections)
+
+        # look for the payload in the cache
+        ttl = self.cache_ttl(selections)
+        cache_key = self.cache_key(section, id, selections, key)
+        if ttl:
+            req = self.cache.get(cache_key)
+            if req is not None:
+                return req
+
+        deadline = DEADLINE[priority] if timeout is None else timeout
+        try:
+            return await asyncio.wait_for(self._get(section, id, selections, key, priority, hedge, hedge_key, cache_key, ttl), deadline)
+        except asyncio.TimeoutError:
+            self._latency_stats["deadlines expired"] += 1
+            logging.debug(f'[torn_api/get] {section} {id} {",".join(selections)}: deadline of {deadline}s expired')
+            return api_error(f'API call exceeded its deadline of {deadline}s', code=ERROR_TIMEOUT)
+
+    async def _get(self, section, id, selections, key, priority, hedge, hedge_key, cache_key, ttl):
+        hedge_key = hedge_key if cache_key[3] == "public" else None
+
+        # uncoalesced calls
+        if not self.coalesce_window:
+            if hedge:
+                req, size = await self._hedged(section, id, selections, key, priority, hedge_key)
+            else:
+                req, size = await self._request(section, id, selections, key, priority)
+            if ttl and 'error' not in req:
+                self.cache.set(cache_key, req, ttl, size=size)
+            return req
+
+        # wait for the other calls on the same resource
+        loop = asyncio.get_event_loop()
+        resource = (section, str(id), cache_key[3])
+        batch = self._pending.get(resource)
+        if batch is None:
+            batch = {"section": section, "id": id, "key": key, "priority": priority, "hedge": False, "hedge_key": None, "waiters": []}
+            self._pending[resource] = batch
+            if self._busy.get(resource):
+                loop.call_later(self.coalesce_window, lambda: asyncio.ensure_future(self._flush(resource)))
+            else:
+                loop.call_soon(lambda: asyncio.ensure_future(self._flush(resource)))
+
+        # the merged call is hedged if one of the callers asks for it
+        batch["priority"] = min(batch["priority"], priority)
+        batch["hedge"] = batch["hedge"] or hedge
+        batch["hedge_key"] = batch["hedge_key"] or hedge_key
+        future = loop.create_future()
+        batch["waiters"].append((selections, key, future))
+        return await future
+
+    async def _flush(self, resource):
+        """ makes one call with the union of the selections of the pending calls
+            and gives each caller its own part of the payload
+            (flushed right away on an idle resource, after the coalesce window while a call on it is in flight)
+        """
+        batch = self._pending.pop(resource)
+        section, id, key, priority = batch["section"], batch["id"], batch["key"], batch["priority"]
+        waiters = [(selections, k, future) for selections, k, future in batch["waiters"] if not future.done()]
+        if not len(waiters):
+            return
+
+        self._coalesce_stats["calls"] += 1
+        self._coalesce_stats["merged"] += len(waiters) - 1
+        self._busy[resource] = self._busy.get(resource, 0) + 1
+        try:
+            await self._merged_request(section, id, key, priority, waiters, hedge=batch["hedge"], hedge_key=batch["hedge_key"])
+
+        except asyncio.CancelledError:
+            for selections, k, future in waiters:
+                future.cancel()
+            raise
+
+        except Exception as e:
+            for selections, k, future in waiters:
+                if not future.done():
+                    future.set_exception(e)
+
+        finally:
+            self._busy[resource] -= 1
+            if not self._busy[resource]:
+                self._busy.pop(resource)
+
+    async def _merged_request(self, section, id, key, priority, waiters, hedge=False, hedge_key=None):
+        """ one call with `key` for the waiters [(selections, key of the caller, future)]
+        """
+        merged = []
+        for selections, k, future in waiters:
+            merged += [s for s in selections if s not in merged]
+        if hedge:
+            req, size = await self._hedged(section, id, merged, key, priority, hedge_key)
+        else:
+            req, size = await self._request(section, id, merged, key, priority)
+
+        if 'error' in req:
+            code = req["error"]["code"]
+
+            # error of the key: the callers with another key (public payloads) call with theirs
+            others = [w for w in waiters if w[1] != key]
+            if len(others) and code in KEY_ERRORS:
+                self._coalesce_stats["split"] += 1
+                other_keys = []
+                for w in others:
+                    if w[1] not in other_keys:
+                        other_keys.append(w[1])
+                await asyncio.gather(*[self._merged_request(section, id, k, priority, [w for w in others if w[1] == k], hedge=hedge, hedge_key=hedge_key) for k in other_keys])
+                waiters = [w for w in waiters if w[1] == key]
+
+            # one selection not allowed: make the calls separately
+            if len(waiters) > 1 and code in SELECTION_ERRORS:
+                self._coalesce_stats["split"] += 1
+                for selections, k, future in waiters:
+                    r, s = await self._request(section, id, selections, key, priority)
+                    self._resolve(future, section, id, selections, key, r, s)
+                return
+
+        # each caller gets its own copy of the payload (the cogs change them in place)
+        frozen = pickle.dumps(req, pickle.HIGHEST_PROTOCOL) if len(waiters) > 1 else None
+        for i, (selections, k, future) in enumerate(waiters):
+            r = req if not i else pickle.loads(frozen)
+            self._resolve(future, section, id, selections, key, self._slice(r, selections, merged), size)
+
+    def _slice(self, req, selections, merged):
+        """ removes from the payload the fields of the selections the caller didn't ask for
+        """
+        extra = [s for s in merged if s not in selections]
+        if not len(extra) or 'error' in req:
+            return req
+        return {k: v for k, v in req.items() if k not in extra}
+
+    def _resolve(self, future, section, id, selections, key, req, size):
+        ttl = self.cache_ttl(selections)
+        if ttl and 'error' not in req:
+            self.cache.set(self.cache_key(section, id, selections, key), req, ttl, size=size)
+        if not future.done():
+            future.set_result(req)
+
+    def hedge_delay(self):
+        """ p95 of the observed latencies
+        """
+        if len(self._latencies) < HEDGE_SAMPLES:
+            return HEDGE_DELAY_DEFAULT
+        latencies = sorted(self._latencies)
+        return max(HEDGE_DELAY_MIN, latencies[int(0.95 * (len(latencies) - 1))])
+
+    async def _hedged(self, section, id, selections, key, priority, hedge_key):
+        """ sends a duplicate call (bypassing the single flight) if the first one is too slow
+            and returns the first answer
+            (the delay runs once the rate limiter lets the first call through)
+        """
+        url = self.url(section, id=id, selections=selections, key=key)
+        granted = self._granted.setdefault(url, asyncio.Event())
+        primary = asyncio.ensure_future(self._request(section, id, selections, key, priority))
+        waiting = asyncio.ensure_future(granted.wait())
+        hedge = None
+        try:
+            done, _ = await asyncio.wait([primary, waiting], return_when=asyncio.FIRST_COMPLETED)
+            if primary in done:
+                return primary.result()
+
+            done, _ = await asyncio.wait([primary], timeout=self.hedge_delay())
+            if primary in done:
+                return primary.result()
+
+            key = key if hedge_key is None else hedge_key
+            hedge = asyncio.ensure_future(self._torn_fetch(self.url(section, id=id, selections=selections, key=key), key, priority))
+            self._latency_stats["hedged calls"] += 1
+
+            done, _ = await asyncio.wait([primary, hedge], return_when=asyncio.FIRST_COMPLETED)
+            if primary in done:
+                return primary.result()
+
+            self._latency_stats["hedges won"] += 1
+            return hedge.result()
+
+        finally:
+            for future in [primary, waiting, hedge]:
+                if future is not None and not future.done():
+                    future.cancel()
+            if self._granted.get(url) is granted:
+                self._granted.pop(url)
+
+    async def _request(self, section, id, selections, key, priority):
+        url = self.url(section, id=id, selections=selections, key=key)
+        return await self._single_flight(url, lambda: self._torn_fetch(url, key, priority))
+
+    async def _torn_fetch(self, url, key, priority):
+        req, size = await self._guarded("torn", lambda: self._limited_fetch(url, key, priority))
+        if self.key_pool is not None and 'error' in req:
+            self.key_pool.report(key, req["error"]["code"])
+
+        return req, size
+
+    async def _limited_fetch(self, url, key, priority):
+        if not await self.limiter.acquire(key, priority=priority, max_wait=MAX_WAIT[priority]):
+            return api_error('Too many calls with this key, request dropped by the bot', code=ERROR_SHED), 0
+        if url in self._granted:
+            self._granted[url].set()
+
+        # the endpoint went down while waiting for the rate limiter
+        if self.circuits["torn"].is_open():
+            return api_error('torn API unavailable, request skipped by the bot', code=ERROR_CIRCUIT), 0
+
+        start = time.monotonic()
+        req, size = await self._fetch(url)
+        if 'error' not in req:
+            self._latencies.append(time.monotonic() - start)
+
+        return req, size
+
+    async def _guarded(self, endpoint, call):
+        """ makes the call through the circuit breaker of the endpoint
+            and retries the transient errors with a jittered backoff
+        """
+        circuit = self.circuits[endpoint]
+        allowed, probe = circuit.allow()
+        if not allowed:
+            return api_error(f'{endpoint} API unavailable, request skipped by the bot', code=ERROR_CIRCUIT), 0
+
+        try:
+            for attempt in range(self.retries + 1):
+                if attempt:
+                    await asyncio.sleep(backoff(attempt))
+                    # don't keep retrying an endpoint that went down meanwhile
+                    if circuit.is_open():
+                        break
+                req, size = await call()
+                code = req["error"]["code"] if 'error' in req else None
+
+                # each attempt is reported to the circuit breaker
+                if code in [ERROR_SHED, ERROR_CIRCUIT]:
+                    circuit.release(probe)
+                else:
+                    circuit.record(code not in OUTAGE_CODES, probe=probe)
+                probe = False
+
+                if code not in RETRY_CODES:
+                    break
+                logging.debug(f'[torn_api/guarded] {endpoint} error {code} (attempt {attempt + 1}/{self.retries + 1})')
+
+        except BaseException:
+            circuit.release(probe)
+            raise
+
+        return req, size
+
+    def available(self, endpoint="torn"):
+        """ False while the circuit of the endpoint is open (for skipping the tasks loops)
+        """
+        return self.circuits[endpoint].available()
+
+    async def yata(self, path, timeout=DEADLINE[INTERACTIVE]):
+        """ makes a call to YATA's API
+            - path: path of the endpoint (eg: /loot/timings/)
+            - timeout: deadline of the call in seconds
+
+            return: the payload as a dict or a normalized error
+        """
+        url = f'{self.yata_url}/{path.lstrip("/")}'
+        call = self._single_flight(url, lambda: self._guarded("yata", lambda: self._fetch(url, error='YATA\'s API is talking shit... #blamekivou')))
+        try:
+            req, _ = await asyncio.wait_for(call, timeout)
+        except asyncio.TimeoutError:
+            self._latency_stats["deadlines expired"] += 1
+            return api_error(f'YATA\'s API call exceeded its deadline of {timeout}s', code=ERROR_TIMEOUT)
+        return req
+
+    async def _single_flight(self, url, call):
+        """ identical calls already in flight share the same response
+            (the collapsed calls get their own copy of the payload)
+        """
+        flight = self._inflight.get(url)
+        if flight is not None:
+            self._flight_stats["collapsed"] += 1
+            flight["collapsed"] = True
+            req, size = await asyncio.shield(flight["future"])
+            return pickle.loads(flight["frozen"]), size
+
+        def done(future):
+            # frozen before the callers resume (the first one keeps the original)
+            self._inflight.pop(url, None)
+            if flight["collapsed"] and not future.cancelled() and future.exception() is None:
+                flight["frozen"] = pickle.dumps(future.result()[0], pickle.HIGHEST_PROTOCOL)
+
+        flight = {"future": asyncio.ensure_future(call()), "collapsed": False, "frozen": None}
+        self._inflight[url] = flight
+        flight["future"].add_done_callback(done)
+        self._flight_stats["calls"] += 1
+        return await asyncio.shield(flight["future"])
+
+    def stats(self):
+        c = self._coalesce_stats
+        return {"Torn API rate limiter": self.limiter.stats(),
+                "Torn API cache": self.cache.stats(),
+                "Torn API coalescer": {"calls": c["calls"], "merged calls": c["merged"], "split calls": c["split"], "pending": len(self._pending)},
+                "HTTP single flight": {"calls": self._flight_stats["calls"], "collapsed calls": self._flight_stats["collapsed"], "in flight": len(self._inflight)},
+                "Torn API circuit": self.circuits["torn"].stats(),
+                "YATA API circuit": self.circuits["yata"].stats(),
+                "Torn API latency": self.latency_stats()}
+
+    def latency_stats(self):
+        s = dict(self._latency_stats)
+        s["samples"] = len(self._latencies)
+        if len(self._latencies):
+            latencies = sorted(self._latencies)
+            s["p50"] = f'{latencies[int(0.5 * (len(latencies) - 1))]:.3f}s'
+            s["p95"] = f'{latencies[int(0.95 * (len(latencies) - 1))]:.3f}s'
+        s["hedge delay"] = f'{self.hedge_delay():.3f}s'
+        return s
+
+    async def _fetch(self, url, error='API is talking shit... #blameched'):
+        """ makes the http call
+            return: payload (or normalized error), size of the payload
+        """
+        try:
+            async with self.session().get(url) as r:
+                if r.status >= 500:
+                    return api_error(f'{error} (HTTP {r.status})', code=ERROR_NETWORK), 0
+                text = await r.text()
+            req = json.loads(text)
+
+        except asyncio.TimeoutError:
+            return api_error(f'{error} (timeout)', code=ERROR_NETWORK), 0
+
+        except aiohttp.ClientError as e:
+            return api_error(f'{error} ({type(e).__name__})', code=ERROR_NETWORK), 0
+
+        except ValueError:  # payload is not json
+            return api_error(error), 0
+
+        if not isinstance(req, dict):
+            return api_error(error), 0
+
+        if 'error' in req:
+            e = req["error"] if isinstance(req["error"], dict) else {}
+            return api_error(e.get("error", error), code=int(e.get("code", -1))), 0
+
+        return req, len(text)
@@ -29,8 +29,13 @@ import logging
 import html
 import string
 import random
+import time
+from collections import deque
 from datetime import datetime
 
+# import bot functions
+from inc.cache import TTLCache
+
 # definition of the view linking Player to Key
 # Name of the view: player_view_player_key
 # SELECT player_key.value,
@@ -43,120 +48,469 @@ from datetime import datetime
 #   FROM player_key
 #     JOIN player_player ON player_key.player_id = player_player.id;
 
-
-def load_configurations(bot_id):
+# notifications of the changes of players and keys (invalidation of the users cache)
+# Channel: yata_players, payload: {"tId": ..., "dId": ...}
+# CREATE OR REPLACE FUNCTION notify_yata_players() RETURNS trigger AS $$
+# DECLARE
+#     player record;
+# BEGIN
+#     IF TG_TABLE_NAME = 'player_key' THEN
+#         SELECT "tId", "dId" INTO player FROM player_player WHERE id = COALESCE(NEW.player_id, OLD.player_id);
+#     ELSE
+#         player := COALESCE(NEW, OLD);
+#     END IF;
+#     PERFORM pg_notify('yata_players', json_build_object('tId', player."tId", 'dId', player."dId")::text);
+#     IF TG_OP = 'UPDATE' AND TG_TABLE_NAME = 'player_player' THEN
+#         PERFORM pg_notify('yata_players', json_build_object('tId', OLD."tId", 'dId', OLD."dId")::text);
+#     END IF;
+#     RETURN NULL;
+# END;
+# $$ LANGUAGE plpgsql;
+# CREATE TRIGGER player_key_notify AFTER INSERT OR UPDATE OR DELETE ON player_key
+#     FOR EACH ROW EXECUTE PROCEDURE notify_yata_players();
+# CREATE TRIGGER player_player_notify AFTER INSERT OR UPDATE OF "tId", "dId", name OR DELETE ON player_player
+#     FOR EACH ROW EXECUTE PROCEDURE notify_yata_players();
+
+# notifications of the changes of servers configurations (dashboard edits reloaded by the bots)
+# Channel: yata_configurations, payload: {"bot_id": ..., "discord_id": ...}
+# CREATE OR REPLACE FUNCTION notify_yata_configurations() RETURNS trigger AS $$
+# DECLARE
+#     server record;
+# BEGIN
+#     server := COALESCE(NEW, OLD);
+#     PERFORM pg_notify('yata_configurations', json_build_object('bot_id', server.bot_id, 'discord_id', server.discord_id)::text);
+#     RETURN NULL;
+# END;
+# $$ LANGUAGE plpgsql;
+# CREATE TRIGGER bot_server_notify AFTER INSERT OR UPDATE OF configuration OR DELETE ON bot_server
+#     FOR EACH ROW EXECUTE PROCEDURE notify_yata_configurations();
+
+
+# connection pool shared by the bot (created at startup with init_pool)
+_pool = None
+_pool_lock = None
+_pool_stats = {"size": "closed", "acquired": 0, "in use": 0, "max in use": 0}
+_acquire_latencies = deque(maxlen=1000)
+_pool_pids = set()  # backends of the pool (notifications of the bot's own writes)
+
+# YATA users by torn and discord id (invalidated by the yata_players notifications)
+USERS_TTL = 3600
+USERS_NEGATIVE_TTL = 60  # users not on YATA (might log in anytime)
+_users = TTLCache(maxsize=int(os.environ.get("USERS_CACHE_SIZE", 10000)))
+_listener = None
+_listener_attempt = 0
+
+# server admins and secret by (bot id, discord id) (refreshed by !sync and forgotten when the configuration changes)
+_server_admins = {}
+
+# callbacks of the yata_configurations notifications
+_configurations_callbacks = []
+_configurations_stats = {"notifications": 0, "own writes": 0}
+
+# factions names by torn id (names rarely change)
+FACTIONS_TTL = 24 * 3600
+FACTIONS_NEGATIVE_TTL = 3600  # factions not in YATA's database yet
+_factions = TTLCache(maxsize=int(os.environ.get("FACTIONS_CACHE_SIZE", 20000)))
+
+
+def db_credentials():
+    """ database name and the other connection parameters
+    """
     db_cred = json.loads(os.environ.get("DB_CREDENTIALS"))
-    con = psycopg2.connect(**db_cred)
+    dbname = db_cred.pop("dbname")
+    return dbname, db_cred
+
+
+async def init_pool():
+    """ creates the connection pool (sized with DB_POOL_MIN and DB_POOL_MAX)
+    """
+    global _pool, _pool_lock
+    if _pool is not None:
+        return _pool
+
+    if _pool_lock is None:
+        _pool_lock = asyncio.Lock()
+    async with _pool_lock:
+        if _pool is None:
+            dbname, db_cred = db_credentials()
+            min_size = int(os.environ.get("DB_POOL_MIN", 2))
+            max_size = int(os.environ.get("DB_POOL_MAX", 10))
+            _pool = await asyncpg.create_pool(database=dbname,
+                                              min_size=min_size,
+                                              max_size=max_size,
+                                              statement_cache_size=int(os.environ.get("DB_STATEMENT_CACHE", 256)),
+                                              max_inactive_connection_lifetime=300,
+                                              init=_init_connection,
+                                              **db_cred)
+            _pool_stats["size"] = f'{min_size}-{max_size}'
+            logging.info(f'[yata_db/init_pool] pool created (min {min_size}, max {max_size})')
+            await listen()
+    return _pool
+
+
+async def close_pool():
+    global _pool, _listener
+    if _listener is not None:
+        listener, _listener = _listener, None
+        await listener.close()
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+        _pool_stats["size"] = "closed"
+        logging.info(f'[yata_db/close_pool] pool closed')
+
+
+async def _init_connection(con):
+    pid = con.get_server_pid()
+    _pool_pids.add(pid)
+    con.add_termination_listener(lambda con: _pool_pids.discard(pid))
+
+
+class PooledConnection:
+    """ async with connection() as con:
+        connection of the pool released when leaving the block
+    """
+
+    async def __aenter__(self):
+        self.pool = await init_pool()
+        start = time.monotonic()
+        self.con = await self.pool.acquire()
+        _acquire_latencies.append(time.monotonic() - start)
+        _pool_stats["acquired"] += 1
+        _pool_stats["in use"] += 1
+        _pool_stats["max in use"] = max(_pool_stats["max in use"], _pool_stats["in use"])
+        return self.con
+
+    async def __aexit__(self, *args):
+        _pool_stats["in use"] -= 1
+        await self.pool.release(self.con)
+
+
+def connection():
+    return PooledConnection()
+
+
+def pool_stats():
+    s = dict(_pool_stats)
+    if len(_acquire_latencies):
+        latencies = sorted(_acquire_latencies)
+        s["acquire mean"] = f'{1000 * sum(latencies) / len(latencies):.2f}ms'
+        s["acquire p95"] = f'{1000 * latencies[int(0.95 * (len(latencies) - 1))]:.2f}ms'
+        s["acquire max"] = f'{1000 * latencies[-1]:.2f}ms'
+    return s
+
+
+async def listen():
+    """ dedicated connection listening to the yata_players and yata_configurations notifications
+        (the connections of the pool are reset when released)
+    """
+    global _listener, _listener_attempt
+    _listener_attempt = time.monotonic()
+    try:
+        dbname, db_cred = db_credentials()
+        listener = await asyncpg.connect(database=dbname, **db_cred)
+        await listener.add_listener("yata_players", _on_players_notification)
+        await listener.add_listener("yata_configurations", _on_configurations_notification)
+        listener.add_termination_listener(_on_listener_closed)
+    except (OSError, asyncio.TimeoutError, asyncpg.PostgresError) as e:
+        logging.warning(f'[yata_db/listen] not listening to the database changes: {e}')
+        return
+
+    _listener = listener
+    _users.clear()
+    logging.info(f'[yata_db/listen] listening to the database changes')
+
+    # changes might have been missed without listener
+    for callback in _configurations_callbacks:
+        callback(None, None)
+
+
+def _listen_again():
+    global _listener_attempt
+    if _pool is not None and time.monotonic() - _listener_attempt > USERS_NEGATIVE_TTL:
+        _listener_attempt = time.monotonic()
+        asyncio.ensure_future(listen())
+
+
+def listening():
+    return _listener is not None
+
+
+def _on_listener_closed(con):
+    global _listener
+    if con is _listener:
+        _listener = None
+        _users.clear()
+        logging.warning(f'[yata_db/listen] connection lost')
+        for callback in _configurations_callbacks:
+            callback(None, None)
 
-    # get bot
-    cur = con.cursor()
-    cur.execute(f"SELECT token, name FROM bot_bot WHERE id = {bot_id};")
-    token, name = cur.fetchone()
-    cur.close()
 
-    # get servers configuration linked with the bot
-    cur = con.cursor()
-    cur.execute(f"SELECT id, discord_id, name, configuration FROM bot_server WHERE bot_server.bot_id = {bot_id};")
-    configurations_raw = cur.fetchall()
-    cur.close()
+def _on_players_notification(con, pid, channel, payload):
+    try:
+        player = json.loads(payload)
+        for type, id in [("T", player["tId"]), ("D", player["dId"])]:
+            if id is not None:
+                _users.delete((type, int(id)))
+    except (ValueError, TypeError, KeyError):
+        _users.clear()
+
+
+def _on_configurations_notification(con, pid, channel, payload):
+    _configurations_stats["notifications"] += 1
+    if pid in _pool_pids:
+        _configurations_stats["own writes"] += 1
+        return
+
+    try:
+        server = json.loads(payload)
+        bot_id, discord_id = int(server["bot_id"]), int(server["discord_id"])
+    except (ValueError, TypeError, KeyError):
+        bot_id, discord_id = None, None
+
+    for callback in _configurations_callbacks:
+        callback(bot_id, discord_id)
+
+
+def on_configuration_change(callback):
+    """ callback(bot_id, discord_id) called when a server configuration is changed by someone else than the bot
+        (bot_id, discord_id are None when the changes might have been missed or won't be notified anymore)
+        Changes are notified only while listening, they need to be polled otherwise (see get_configuration_hashes)
+    """
+    _configurations_callbacks.append(callback)
+
+
+def configurations_stats():
+    s = dict(_configurations_stats)
+    s["listening"] = _listener is not None
+    return s
+
+
+def users_stats():
+    s = _users.stats()
+    s["listening"] = _listener is not None
+    return s
+
+
+def factions_stats():
+    return _factions.stats()
+
+
+async def load_configurations(bot_id):
+    async with connection() as con:
+        # get bot
+        bot = await con.fetchrow('SELECT token, name FROM bot_bot WHERE id = $1', int(bot_id))
+
+        # get servers configuration linked with the bot
+        servers = await con.fetch('SELECT discord_id, configuration FROM bot_server WHERE bot_id = $1', int(bot_id))
 
     # format configrations to a dict
     configurations = dict({})
-    for id, discord_id, name, configuration in configurations_raw:
-        configurations[discord_id] = json.loads(configuration)
+    for server in servers:
+        configurations[server.get("discord_id")] = json.loads(server.get("configuration"))
 
-    con.close()
-    return token, configurations
+    return bot.get("token"), configurations
 
 
 async def get_configuration(bot_id, discord_id):
-    db_cred = json.loads(os.environ.get("DB_CREDENTIALS"))
-    dbname = db_cred["dbname"]
-    del db_cred["dbname"]
-    con = await asyncpg.connect(database=dbname, **db_cred)
-    server = await con.fetchrow(f'SELECT configuration FROM bot_server WHERE bot_id = {bot_id} AND discord_id = {discord_id};')
+    async with connection() as con:
+        server = await con.fetchrow('SELECT configuration FROM bot_server WHERE bot_id = $1 AND discord_id = $2', bot_id, discord_id)
     return False if server is None else json.loads(server.get("configuration"))
 
 
-async def set_n_servers(bot_id, n):
-    db_cred = json.loads(os.environ.get("DB_CREDENTIALS"))
-    dbname = db_cred["dbname"]
-    del db_cred["dbname"]
-    con = await asyncpg.connect(database=dbname, **db_cred)
-
-    await con.execute('''
-        UPDATE bot_bot SET number_of_servers = $2 WHERE id = $1
-        ''', bot_id, n)
-    await con.close()
+async def get_configuration_hashes(bot_id):
+    """ return: {discord_id: md5 of the configuration} of the servers of the bot
+    """
+    async with connection() as con:
+        servers = await con.fetch('SELECT discord_id, md5(configuration) AS hash FROM bot_server WHERE bot_id = $1', int(bot_id))
+    return {server.get("discord_id"): server.get("hash") for server in servers}
 
 
-async def set_configuration(bot_id, discord_id, server_name, configuration):
-    db_cred = json.loads(os.environ.get("DB_CREDENTIALS"))
-    dbname = db_cred["dbname"]
-    del db_cred["dbname"]
-    con = await asyncpg.connect(database=dbname, **db_cred)
-
-    # check if server already in the database
-    server = await con.fetchrow(f'SELECT * FROM bot_server WHERE bot_id = {bot_id} AND discord_id = {discord_id};')
-    if server is None:  # create if not in the db
-        # logging.debug(f"[yata_db/set_configuration] Create db configuration {server_name}: {configuration}")
-        await con.execute('''
-        INSERT INTO bot_server(bot_id, discord_id, name, configuration, secret) VALUES($1, $2, $3, $4, $5)
-        ''', bot_id, discord_id, server_name, json.dumps(configuration), 'x')
-    else:  # update otherwise
-        # logging.debug(f"[yata_db/set_configuration] Update db configuration {server_name}: {configuration}")
+async def set_n_servers(bot_id, n):
+    async with connection() as con:
         await con.execute('''
-        UPDATE bot_server SET name = $3, configuration = $4 WHERE bot_id = $1 AND discord_id = $2
-        ''', bot_id, discord_id, server_name, json.dumps(configuration))
-    await con.close()
+            UPDATE bot_bot SET number_of_servers = $2 WHERE id = $1
+            ''', bot_id, n)
 
 
-async def get_server_admins(bot_id, discord_id):
-    db_cred = json.loads(os.environ.get("DB_CREDENTIALS"))
-    dbname = db_cred["dbname"]
-    del db_cred["dbname"]
-    con = await asyncpg.connect(database=dbname, **db_cred)
-    server = await con.fetchrow(f'SELECT * FROM bot_server WHERE bot_id = {bot_id} AND discord_id = {discord_id};')
-    if server is None:
-        return {}, 'x'
+# update or insert of a server configuration in a single statement
+# (no unique constraint on bot_id, discord_id for an ON CONFLICT)
+UPSERT_CONFIGURATION = '''
+    WITH updated AS (
+        UPDATE bot_server SET name = $3, configuration = $4 WHERE bot_id = $1 AND discord_id = $2 RETURNING id
+    )
+    INSERT INTO bot_server(bot_id, discord_id, name, configuration, secret)
+    SELECT $1, $2, $3, $4, 'x' WHERE NOT EXISTS (SELECT 1 FROM updated)
+    '''
+
 
-    server_yata_id = server.get("id")
-    players_yata_id = await con.fetch(f'SELECT player_id FROM bot_server_server_admin WHERE server_id = {server_yata_id};')
+async def set_configuration(bot_id, discord_id, server_name, configuration):
+    async with connection() as con:
+        await con.execute(UPSERT_CONFIGURATION, bot_id, discord_id, server_name, json.dumps(configuration))
+
+
+async def _patch(con, bot_id, discord_id, patches):
+    """ changes keys of a server configuration in one update (nested jsonb_set)
+        patches: list of (path, value) with value as in patch_configuration
+        return: False if not changed (no server or parent of a key missing)
+    """
+    configuration = 'configuration::jsonb'
+    parents = []
+    args = [bot_id, discord_id]
+    for path, value in patches:
+        path = [str(k) for k in path]
+        if value is None:
+            args.append(path)
+            configuration = f'({configuration} #- ${len(args)}::text[])'
+        else:
+            args += [path, value, path[:-1]]
+            configuration = f'jsonb_set({configuration}, ${len(args) - 2}::text[], ${len(args) - 1}::jsonb)'
+            parents.append(f'configuration::jsonb #> ${len(args)}::text[] IS NOT NULL')
+
+    where = " AND ".join(["bot_id = $1", "discord_id = $2"] + parents)
+    status = await con.execute(f'UPDATE bot_server SET configuration = {configuration}::text WHERE {where}', *args)
+    return status != "UPDATE 0"
+
+
+async def patch_configuration(bot_id, discord_id, path, value):
+    """ changes the key at path (eg: ["verify", "other", "daily_verify"]) of a server configuration
+        value: json of the new value or None to delete the key
+        return: False if not changed (no server or parent of the key missing)
+    """
+    async with connection() as con:
+        return await _patch(con, bot_id, discord_id, [(path, value)])
+
+
+async def set_configurations(bot_id, servers, patches=[]):
+    """ writes the configurations of several servers in one transaction
+        servers: list of (discord_id, server_name, configuration)
+        patches: list of (discord_id, server_name, [(path, value)], configuration) with value as in patch_configuration
+                 (the whole configuration is written if the patches can't be applied)
+    """
+    async with connection() as con:
+        async with con.transaction():
+            full = [(discord_id, server_name, configuration) for discord_id, server_name, configuration in servers]
+            for discord_id, server_name, changes, configuration in patches:
+                if not await _patch(con, bot_id, discord_id, changes):
+                    full.append((discord_id, server_name, configuration))
+
+            await con.executemany(UPSERT_CONFIGURATION, [(bot_id, discord_id, server_name, json.dumps(configuration)) for discord_id, server_name, configuration in full])
+
+
+async def get_server_admins(bot_id, discord_id, refresh=False):
+    """ gets the server admins linked on YATA and the server secret
+        (cached until the next refresh, done by !sync)
+        return: {discord id: {"name": name, "torn_id": torn id}}, secret
+    """
+    if not refresh and (bot_id, discord_id) in _server_admins:
+        admins, secret = _server_admins[(bot_id, discord_id)]
+        return dict(admins), secret
+
+    async with connection() as con:
+        rows = await con.fetch('''
+            SELECT bot_server.configuration::jsonb #>> '{admin,secret}' AS secret, player_player."tId", player_player."dId", player_player."name"
+            FROM bot_server
+            LEFT JOIN bot_server_server_admin ON bot_server_server_admin.server_id = bot_server.id
+            LEFT JOIN player_player ON player_player.id = bot_server_server_admin.player_id
+            WHERE bot_server.bot_id = $1 AND bot_server.discord_id = $2
+            ''', bot_id, discord_id)
+
+    if not len(rows):
+        return {}, 'x'
 
     admins = {}
-    for player_yata_id in [player.get("player_id") for player in players_yata_id]:
-        player = await con.fetchrow(f'SELECT "tId", "dId", "name" FROM player_player WHERE "id" = {player_yata_id};')
-        dId = player.get("dId", 0)
-        if dId:
-            admins[str(dId)] = {"name": player.get("name", "?"), "torn_id": player.get("tId")}
+    for row in rows:
+        if row.get("dId"):
+            admins[str(row.get("dId"))] = {"name": row.get("name") or "?", "torn_id": row.get("tId")}
 
-    secret = json.loads(server.get("configuration", '{}')).get("admin", {}).get("secret", 'x')
+    secret = rows[0].get("secret") or 'x'
     if secret == 'x':
         secret = ''.join(random.choice(string.ascii_lowercase) for i in range(16))
 
-    return admins, secret
+    _server_admins[(bot_id, discord_id)] = (admins, secret)
+    return dict(admins), secret
+
+
+def forget_server_admins(bot_id, discord_id):
+    _server_admins.pop((bot_id, discord_id), None)
+
+
+def forget_yata_user(torn_id):
+    """ forgets a cached YATA user (eg: key refused by the API) to read it again from the database
+    """
+    user = _users.get(("T", int(torn_id)))
+    _users.delete(("T", int(torn_id)))
+    if user is not None and len(user) and user[0][3] is not None:
+        _users.delete(("D", int(user[0][3])))
 
 
 async def get_yata_user(user_id, type="T"):
+    # get YATA user from the cache
+    cache_key = (type, int(user_id))
+    user = _users.get(cache_key)
+    if user is not None:
+        return list(user)
+
     # get YATA user
-    db_cred = json.loads(os.environ.get("DB_CREDENTIALS"))
-    dbname = db_cred["dbname"]
-    del db_cred["dbname"]
-    con = await asyncpg.connect(database=dbname, **db_cred)
-    if type == "T":
-        user = await con.fetch(f'SELECT "tId", "name", "value" FROM player_view_player_key WHERE "tId" = {user_id};')
-    elif type == "D":
-        user = await con.fetch(f'SELECT "tId", "name", "value" FROM player_view_player_key WHERE "dId" = {user_id};')
-    await con.close()
+    async with connection() as con:
+        if type == "T":
+            user = await con.fetch('SELECT "tId", "name", "value", "dId" FROM player_view_player_key WHERE "tId" = $1', cache_key[1])
+        elif type == "D":
+            user = await con.fetch('SELECT "tId", "name", "value", "dId" FROM player_view_player_key WHERE "dId" = $1', cache_key[1])
+
+    # without notifications entries are only kept for a short time
+    if _listener is None:
+        _listen_again()
+    ttl = USERS_TTL if len(user) and _listener is not None else USERS_NEGATIVE_TTL
+    _users.set(cache_key, tuple(user), ttl)
 
     return user
 
 
+async def get_yata_users_bulk(discord_ids=None, torn_ids=None, chunk=1000):
+    """ gets YATA users of a list of discord ids and / or torn ids
+        return: {id: record} for the users on YATA (missing ids are not on YATA)
+    """
+    users = {}
+    for type, ids in [("D", discord_ids or []), ("T", torn_ids or [])]:
+        # from the cache
+        missing = []
+        for id in set([int(id) for id in ids]):
+            user = _users.get((type, id))
+            if user is None:
+                missing.append(id)
+            elif len(user):
+                users[id] = user[0]
+
+        # from the database
+        column = "dId" if type == "D" else "tId"
+        for i in range(0, len(missing), chunk):
+            ids = missing[i:i + chunk]
+            async with connection() as con:
+                rows = await con.fetch(f'SELECT "tId", "name", "value", "dId" FROM player_view_player_key WHERE "{column}" = ANY($1::bigint[])', ids)
+
+            found = {}
+            for row in rows:
+                found.setdefault(row.get(column), []).append(row)
+            for id in ids:
+                user = tuple(found.get(id, []))
+                ttl = USERS_TTL if len(user) and _listener is not None else USERS_NEGATIVE_TTL
+                _users.set((type, id), user, ttl)
+                if len(user):
+                    users[id] = user[0]
+
+    if _listener is None:
+        _listen_again()
+
+    return users
+
+
 def get_secret(name):
+    # synchronous: only used by the chat scripts before their event loop starts
     db_cred = json.loads(os.environ.get("DB_CREDENTIALS"))
     con = psycopg2.connect(**db_cred)
     cur = con.cursor()
-    cur.execute(f"SELECT uid, secret, hookurl FROM bot_chat WHERE name = '{name}';")
+    cur.execute("SELECT uid, secret, hookurl FROM bot_chat WHERE name = %s;", (name,))
     uid, secret, hookurl = cur.fetchone()
     cur.close()
     con.close()
@@ -164,51 +518,79 @@ def get_secret(name):
 
 
 async def push_data(bot_id, timestamp, data, module):
-    db_cred = json.loads(os.environ.get("DB_CREDENTIALS"))
-    dbname = db_cred["dbname"]
-    del db_cred["dbname"]
-    con = await asyncpg.connect(database=dbname, **db_cred)
-    if module == "rackets":
-        await con.execute('UPDATE bot_rackets SET timestamp = $1, rackets = $2 WHERE id = $3', timestamp, json.dumps(data), bot_id)
-    elif module == "stocks":
-        await con.execute('UPDATE bot_stocks SET timestamp = $1, rackets = $2 WHERE id = $3', timestamp, json.dumps(data), bot_id)
-    await con.close()
+    async with connection() as con:
+        if module == "rackets":
+            await con.execute('UPDATE bot_rackets SET timestamp = $1, rackets = $2 WHERE id = $3', timestamp, json.dumps(data), bot_id)
+        elif module == "stocks":
+            await con.execute('UPDATE bot_stocks SET timestamp = $1, rackets = $2 WHERE id = $3', timestamp, json.dumps(data), bot_id)
 
 
-def get_data(bot_id, module):
-    db_cred = json.loads(os.environ.get("DB_CREDENTIALS"))
-    con = psycopg2.connect(**db_cred)
-    cur = con.cursor()
-    if module == "rackets":
-        cur.execute(f"SELECT timestamp, rackets FROM bot_rackets WHERE id = {bot_id};")
-    elif module == "stocks":
-        cur.execute(f"SELECT timestamp, rackets FROM bot_stocks WHERE id = {bot_id};")
+async def get_data(bot_id, module):
+    async with connection() as con:
+        if module == "rackets":
+            row = await con.fetchrow('SELECT timestamp, rackets FROM bot_rackets WHERE id = $1', bot_id)
+        elif module == "stocks":
+            row = await con.fetchrow('SELECT timestamp, rackets FROM bot_stocks WHERE id = $1', bot_id)
 
-    timestamp, data = cur.fetchone()
-    cur.close()
-    con.close()
-    return timestamp, json.loads(data)
+    return row.get("timestamp"), json.loads(row.get("rackets"))
 
 
 async def get_faction_name(tId):
-    if str(tId).isdigit():
-        tId = int(tId)
-        db_cred = json.loads(os.environ.get("DB_CREDENTIALS"))
-        dbname = db_cred["dbname"]
-        del db_cred["dbname"]
-        con = await asyncpg.connect(database=dbname, **db_cred)
-        row = await con.fetchrow('SELECT name FROM faction_faction WHERE "tId" = $1', tId)
-        await con.close()
-        return f'Faction [{tId}]' if row is None else f'{html.unescape(row.get("name", "Faction"))} [{tId}]'
-    else:
-        return f'Faction [{tId}]'
-
-
-async def reset_notifications(tornId):
-    # get YATA user
-    db_cred = json.loads(os.environ.get("DB_CREDENTIALS"))
-    dbname = db_cred["dbname"]
-    del db_cred["dbname"]
-    con = await asyncpg.connect(database=dbname, **db_cred)
-    await con.execute('UPDATE player_player SET "activateNotifications"=$1, "notifications"=$2 WHERE "tId"=$3', False, json.dumps({}), tornId)
-    await con.close()
+    return (await get_faction_names([tId]))[tId]
+
+
+async def get_faction_names(ids):
+    """ gets the names of several factions ("Name [id]") in one query
+        return: {id: name} for all ids (as given)
+    """
+    names = {}
+    missing = set()
+    for tId in ids:
+        if not str(tId).isdigit():
+            names[tId] = f'Faction [{tId}]'
+            continue
+
+        name = _factions.get(int(tId))
+        if name is None:
+            missing.add(int(tId))
+        else:
+            names[tId] = name
+
+    if len(missing):
+        async with connection() as con:
+            rows = await con.fetch('SELECT "tId", name FROM faction_faction WHERE "tId" = ANY($1::int[])', list(missing))
+        found = {row.get("tId"): f'{html.unescape(row.get("name") or "Faction")} [{row.get("tId")}]' for row in rows}
+        for tId in missing:
+            name = found.get(tId, f'Faction [{tId}]')
+            _factions.set(tId, name, FACTIONS_TTL if tId in found else FACTIONS_NEGATIVE_TTL)
+
+        for tId in ids:
+            if tId not in names:
+                names[tId] = found.get(int(tId), f'Faction [{int(tId)}]')
+
+    return names
+
+
+async def set_notifications(notifications):
+    """ writes the notifications states of several players in one update
+        notifications: list of (discord id, notifications)
+    """
+    if not len(notifications):
+        return
+
+    async with connection() as con:
+        await con.execute('''
+            UPDATE player_player SET "notifications" = n.notifications
+            FROM unnest($1::bigint[], $2::text[]) AS n("dId", notifications)
+            WHERE player_player."dId" = n."dId"
+            ''', [dId for dId, _ in notifications], [json.dumps(n) for _, n in notifications])
+
+
+async def reset_notifications(tornIds):
+    """ deactivates the notifications of several players (list of torn ids)
+    """
+    if not len(tornIds):
+        return
+
+    async with connection() as con:
+        await con.execute('UPDATE player_player SET "activateNotifications"=$1, "notifications"=$2 WHERE "tId" = ANY($3::int[])', False, json.dumps({}), list(tornIds))
@@ -0,0 +1,77 @@
+"""
+Copyright 2020 kivou.2000607@gmail.com
+
+This file is part of yata-bot.
+
+    yata is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    yata is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with yata-bot. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# import standard modules
+import asyncio
+import time
+
+# import bot functions and classes
+from inc.torn_api import TornClient
+
+
+def client(coalesce_window=0.5, latency=0.01):
+    """ Torn API client answering every call after `latency` seconds (no http calls)
+        client.calls: urls called
+    """
+    c = TornClient(cache_size=0, coalesce_window=coalesce_window)
+    c.calls = []
+
+    async def fetch(url, error=None):
+        c.calls.append(url)
+        await asyncio.sleep(latency)
+        selections = url.split("selections=")[1].split("&")[0]
+        return {s: {"value": s} for s in selections.split(",") if s}, 100
+
+    c._fetch = fetch
+    return c
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def test_uncontended_call_not_delayed():
+    c = client()
+    start = time.monotonic()
+    req = run(c.get("user", "", "bars", "key"))
+    assert req == {"bars": {"value": "bars"}}
+    assert time.monotonic() - start < 0.25  # the coalesce window is 0.5s
+
+
+def test_concurrent_calls_merged():
+    c = client()
+    reqs = run(asyncio.gather(c.get("faction", 1, "chain", "key"), c.get("faction", 1, "basic", "key")))
+    assert len(c.calls) == 1
+    assert reqs == [{"chain": {"value": "chain"}}, {"basic": {"value": "basic"}}]
+
+
+def test_merged_callers_get_their_own_copy():
+    c = client()
+    reqs = run(asyncio.gather(c.get("faction", 1, "chain", "key"), c.get("faction", 1, "chain", "key")))
+    assert len(c.calls) == 1
+    assert reqs[0] == reqs[1]
+    assert reqs[0]["chain"] is not reqs[1]["chain"]
+
+
+def test_collapsed_callers_get_their_own_copy():
+    c = client(coalesce_window=0)
+    reqs = run(asyncio.gather(c.get("faction", 1, "chain", "key"), c.get("faction", 1, "chain", "key")))
+    assert len(c.calls) == 1
+    assert reqs[0] == reqs[1]
+    assert reqs[0]["chain"] is not reqs[1]["chain"]
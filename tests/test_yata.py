@@ -0,0 +1,59 @@
+"""
+Copyright 2020 kivou.2000607@gmail.com
+
+This file is part of yata-bot.
+
+    yata is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    any later version.
+
+    yata is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with yata-bot. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+# import standard modules
+import asyncio
+
+# import bot functions and classes
+import bots.yata
+from bots.yata import YataBot
+
+
+def run(coro):
+    return asyncio.get_event_loop().run_until_complete(coro)
+
+
+def test_reconcile_reloads_pending_guilds(monkeypatch):
+    # started from a snapshot: guild 1 changed in the database, guild 2 also changed by the bot meanwhile
+    snapshot = {1: {"admin": {"prefix": "!"}}, 2: {"admin": {"prefix": "!"}}}
+    database = {1: {"admin": {"prefix": "?"}}, 2: {"admin": {"prefix": "?"}}}
+
+    async def load_configurations(bot_id):
+        return "token", {guild_id: dict(c) for guild_id, c in database.items()}
+
+    monkeypatch.setattr(bots.yata, "load_configurations", load_configurations)
+    bot = YataBot(configurations=snapshot, command_prefix="!", bot_id=1)
+
+    written = []
+    reloaded = []
+
+    async def flush():
+        written.extend(bot.config_writer._dirty)
+        bot.config_writer._dirty = {}
+
+    bot.config_writer.flush = flush
+    bot.config_feed.reload = reloaded.append
+    bot.config_writer.mark(2, "guild 2", path=["admin", "currents"])
+
+    run(bot.reconcile_configurations())
+
+    assert bot.configurations[1] == database[1]
+    assert bot.configurations[2] == {"admin": {"prefix": "!"}}  # not replaced while pending
+    assert written == [2]  # the bot changes are written first
+    assert reloaded == [2]  # then reloaded from the database
@@ -20,7 +20,7 @@ This file is part of yata-bot.
 # import standard modules
 import os
 import json
-import psycopg2
+import asyncio
 import logging
 import logging.config
 import time
@@ -45,6 +45,7 @@ from cogs.marvin import Marvin
 
 # import includes
 from inc.yata_db import load_configurations
+from inc.snapshot import ConfigSnapshot
 
 # logging
 logging.config.fileConfig('logging.conf')
@@ -56,17 +57,37 @@ logging.error("error")
 
 # get basic config
 bot_id = os.environ.get("YATA_ID", 1)
+bot_token = os.environ.get("BOT_TOKEN", "")  # token of the bot (read from YATA's database if empty)
 github_token = os.environ.get("GITHUB_TOKEN", "")
 main_server_id = os.environ.get("MAIN_SERVER_ID", 581227228537421825)
+torn_api_url = os.environ.get("TORN_API_URL", "https://api.torn.com")  # point to bench/torn_sim.py for offline benchmarks
+yata_url = os.environ.get("YATA_URL", "https://yata.alwaysdata.net")
+flush_interval = float(os.environ.get("CONFIG_FLUSH_INTERVAL", 10))  # seconds between two writes of the configurations
+poll_interval = float(os.environ.get("CONFIG_POLL_INTERVAL", 60))  # seconds between two checks of the configurations changes (without notifications)
+snapshot_path = os.environ.get("CONFIG_SNAPSHOT", "")  # local copy of the configurations (disabled if empty, eg: configurations-1.sqlite)
+snapshot_max_age = float(os.environ.get("CONFIG_SNAPSHOT_MAX_AGE", 86400))  # older snapshots are not loaded (seconds)
 logging.info(f'Starting bot: bot id = {bot_id}')
 
-# get configurations from YATA's database
-token, configurations = load_configurations(bot_id)
+# get configurations from the local snapshot (checked against YATA's database once started) or from YATA's database
+# starting from the snapshot needs the token in BOT_TOKEN (the database is only used once started)
+if snapshot_path and not bot_token:
+    logging.warning(f'Configurations snapshot {snapshot_path} not used without BOT_TOKEN')
+snapshot = ConfigSnapshot(snapshot_path) if snapshot_path and bot_token else None
+loaded = snapshot.load(max_age=snapshot_max_age) if snapshot is not None else None
+if loaded is not None:
+    token = bot_token
+    configurations, age = loaded
+    logging.info(f'Configurations loaded from {snapshot_path} ({len(configurations)} servers, {age:.0f}s old)')
+else:
+    token, configurations = asyncio.get_event_loop().run_until_complete(load_configurations(bot_id))
+    token = bot_token if bot_token else token
+    if snapshot is not None:
+        snapshot.save(configurations, full=True)
 
 
 def get_prefix(client, message):
     if message.guild:
-        prefix = client.configurations.get(message.guild.id, {}).get("admin", {}).get("prefix", "!")
+        prefix = client.get_guild_config(message.guild.id).prefix
         # logging.debug(f'[get_prefix] {message.guild}: {prefix}')
         return prefix
     else:
@@ -78,7 +99,13 @@ bot = YataBot(configurations=configurations,
               command_prefix=get_prefix,
               bot_id=bot_id,
               main_server_id=main_server_id,
-              github_token=github_token)
+              github_token=github_token,
+              torn_api_url=torn_api_url,
+              yata_url=yata_url,
+              flush_interval=flush_interval,
+              poll_interval=poll_interval,
+              snapshot=snapshot,
+              reconcile=loaded is not None)
 bot.remove_command('help')
 
 # load classes